@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LumenHermandades.settings')
+# Con ASGI las vistas de solo lectura se sirven en su versión async
+os.environ.setdefault('LUMEN_VISTAS_ASYNC', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lumenApp.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'lumenApp.middleware.RolesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,7 +65,8 @@ ROOT_URLCONF = 'LumenHermandades.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # El de Django, midiendo el tiempo de render para Server-Timing y /metrics
+        'BACKEND': 'lumenApp.metricas.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -69,6 +74,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'lumenApp.context_processors.roles',
             ],
         },
     },
@@ -76,27 +82,94 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'LumenHermandades.wsgi.application'
 
+# Vistas async de solo lectura (lumenApp/views_async.py). asgi.py lo activa; con
+# WSGI cada vista async necesitaría su propio bucle de eventos y saldría más cara.
+LUMEN_VISTAS_ASYNC = os.environ.get('LUMEN_VISTAS_ASYNC', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Perfil de base de datos, se elige con la variable de entorno LUMEN_PERFIL_BD:
+#   sqlite             desarrollo, configuración por defecto de Django
+#   sqlite_produccion  WAL, synchronous=NORMAL, busy_timeout y conexiones persistentes
+#   mysql              servidor MySQL local
+# LUMEN_BD_NOMBRE cambia el fichero de los perfiles SQLite (lo usan las pruebas de rendimiento
+# que arrancan servidores aparte contra una base de datos sembrada).
+FICHERO_SQLITE = os.environ.get('LUMEN_BD_NOMBRE', BASE_DIR / 'db.sqlite3')
 
-"""DATABASES = {
-    'default': {
+PERFILES_BD = {
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': FICHERO_SQLITE,
+    },
+    'sqlite_produccion': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': FICHERO_SQLITE,
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Segundos que espera una escritura a que se libere el bloqueo antes de fallar
+            'timeout': 20,
+            # Las transacciones piden el bloqueo de escritura al empezar, así no fallan
+            # al pasar de lectura a escritura con otra escritura en curso
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=20000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    },
+    'mysql': {
         'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'lumen_db',  
-        'USER': 'root',     
+        'NAME': 'lumen_db',
+        'USER': 'root',
         'PASSWORD': 'root',
-        'HOST': '127.0.0.1', 
+        'HOST': '127.0.0.1',
         'PORT': '3306',
-    }
-}"""
+    },
+}
+
+PERFIL_BD = os.environ.get('LUMEN_PERFIL_BD', 'sqlite')
+
+DATABASES = {
+    'default': PERFILES_BD[PERFIL_BD],
+}
+
+
+# Caché (es_admin, estadísticas y fragmentos de las páginas de detalle), se elige con LUMEN_CACHE:
+#   locmem  memoria de cada proceso, solo vale con un único worker
+#   file    ficheros en LUMEN_CACHE_RUTA, compartida por los workers de una máquina
+#   redis   servidor Redis en LUMEN_REDIS_URL, necesita el paquete redis
+PERFILES_CACHE = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('LUMEN_CACHE_RUTA', BASE_DIR / '.cache'),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('LUMEN_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+LUMEN_CACHE = os.environ.get('LUMEN_CACHE', 'locmem')
+
+CACHES = {
+    'default': PERFILES_CACHE[LUMEN_CACHE],
+}
+# Si todos los workers ven la misma caché. Con locmem cada proceso tiene la suya
+# y una invalidación solo llega al que hizo el cambio, así que lo que da permisos
+# (es_admin, ver lumenApp/permisos.py) no se guarda entre peticiones.
+LUMEN_CACHE_COMPARTIDA = LUMEN_CACHE != 'locmem'
 
 
 # Password validation
@@ -118,6 +191,62 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Algoritmo de las contraseñas nuevas, se elige con LUMEN_HASHER (argon2, scrypt o pbkdf2).
+# Los demás siguen en la lista para poder comprobar las contraseñas ya guardadas,
+# que se rehacen con el elegido la próxima vez que el hermano entra.
+# argon2 necesita el paquete argon2-cffi.
+HASHERS = {
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+LUMEN_HASHER = os.environ.get('LUMEN_HASHER', 'pbkdf2')
+
+PASSWORD_HASHERS = [HASHERS[LUMEN_HASHER]] + [
+    hasher for nombre, hasher in HASHERS.items() if nombre != LUMEN_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Pool donde se calculan los hashes fuera del hilo de la petición (ver lumenApp/contrasenas.py):
+# "hilos" (hashlib y argon2-cffi sueltan el GIL mientras calculan), "procesos" o "ninguno".
+LUMEN_HASHES_POOL = os.environ.get('LUMEN_HASHES_POOL', 'hilos')
+LUMEN_HASHES_TRABAJADORES = int(os.environ.get('LUMEN_HASHES_TRABAJADORES', os.cpu_count() or 1))
+
+# Nombre que encabeza los recibos y carnets (lumenApp/documentos.py)
+LUMEN_HERMANDAD = os.environ.get('LUMEN_HERMANDAD', 'Hermandad')
+# Fuente TrueType de los documentos; sin ella se usa la que trae Pillow
+LUMEN_DOCUMENTOS_FUENTE = os.environ.get('LUMEN_DOCUMENTOS_FUENTE') or None
+# Páginas ya dibujadas, por hash de su contenido. Es una caché: se puede borrar
+LUMEN_DOCUMENTOS_RUTA = os.environ.get('LUMEN_DOCUMENTOS_RUTA', Path(tempfile.gettempdir()) / 'lumen_documentos')
+# Pool de procesos que dibuja los documentos: "procesos" o "ninguno" (en el proceso que los pide)
+LUMEN_DOCUMENTOS_POOL = os.environ.get('LUMEN_DOCUMENTOS_POOL', 'procesos')
+LUMEN_DOCUMENTOS_TRABAJADORES = int(os.environ.get('LUMEN_DOCUMENTOS_TRABAJADORES', os.cpu_count() or 1))
+
+# Datos de la hermandad como acreedora en las remesas SEPA de cuotas (ver lumenApp/sepa.py).
+# El comando remesa_sepa permite cambiarlos en cada ejecución.
+LUMEN_SEPA_ACREEDOR = {
+    'nombre': os.environ.get('LUMEN_SEPA_NOMBRE', ''),
+    'iban': os.environ.get('LUMEN_SEPA_IBAN', ''),
+    'bic': os.environ.get('LUMEN_SEPA_BIC', ''),
+    'identificador': os.environ.get('LUMEN_SEPA_IDENTIFICADOR', ''),
+}
+
+# Control de asistencia por QR (lumenApp/asistencia.py): los escaneos se guardan
+# en lotes de LUMEN_ASISTENCIA_LOTE o cada LUMEN_ASISTENCIA_INTERVALO segundos
+# (0 para escribir solo al llenarse el lote o al llamar a volcar_asistencias()).
+LUMEN_ASISTENCIA_LOTE = int(os.environ.get('LUMEN_ASISTENCIA_LOTE', 200))
+LUMEN_ASISTENCIA_INTERVALO = float(os.environ.get('LUMEN_ASISTENCIA_INTERVALO', 1))
+
+# Métricas por petición (lumenApp/metricas.py): cabecera Server-Timing e histogramas en /metrics.
+# LUMEN_METRICAS_MUESTREO es la fracción de peticiones que se miden (0 no mide ninguna).
+LUMEN_METRICAS_MUESTREO = float(os.environ.get('LUMEN_METRICAS_MUESTREO', 1))
+# Las consultas que tarden más (ms) se registran con su SQL y su pila; sin valor no se mira
+LUMEN_METRICAS_CONSULTA_LENTA_MS = (
+    float(os.environ['LUMEN_METRICAS_CONSULTA_LENTA_MS']) if os.environ.get('LUMEN_METRICAS_CONSULTA_LENTA_MS') else None
+)
+# Para que Prometheus lea /metrics sin sesión: cabecera "Authorization: Bearer <token>"
+LUMEN_METRICAS_TOKEN = os.environ.get('LUMEN_METRICAS_TOKEN', '')
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -1,10 +1,64 @@
-from django.contrib import admin
+import io
+
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect, render
+from django.urls import path
+
+from .importacion import ContrasenaImportacion, importar_hermanos
 from .models import *
 
+
+class ImportarHermanosForm(forms.Form):
+    fichero = forms.FileField(help_text='CSV con dni, nombre, apellidos, fecha_nacimiento, fecha_ingreso y estado (opcional).')
+    contrasena = forms.ChoiceField(choices=ContrasenaImportacion.choices, initial=ContrasenaImportacion.ACTIVACION)
+
+
+class HermanoAdmin(admin.ModelAdmin):
+    list_display = ('dni', 'nombre', 'apellidos', 'estado', 'numero_antiguedad')
+    search_fields = ('dni', 'nombre', 'apellidos')
+    list_filter = ('estado',)
+    change_list_template = 'admin/lumenApp/hermano/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('importar/', self.admin_site.admin_view(self.importar), name='lumenApp_hermano_importar'),
+        ] + super().get_urls()
+
+    # Subida del CSV de importar_hermanos. El fichero se lee en streaming
+    # desde el temporal de la subida, sin cargarlo entero.
+    def importar(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:lumenApp_hermano_changelist')
+
+        form = ImportarHermanosForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            fichero = io.TextIOWrapper(form.cleaned_data['fichero'].file, encoding='utf-8-sig', newline='')
+            try:
+                resultado = importar_hermanos(fichero, form.cleaned_data['contrasena'])
+            except ValueError as e:
+                form.add_error('fichero', str(e))
+            else:
+                messages.success(request, f'{resultado.creados} hermanos creados, {resultado.actualizados} actualizados '
+                                          f'y {resultado.sin_cambios} sin cambios.')
+                for mensaje in list(resultado.mensajes_error())[:50]:
+                    messages.warning(request, mensaje)
+                if len(resultado.errores) > 50:
+                    messages.warning(request, f'... y {len(resultado.errores) - 50} filas más con errores.')
+                return redirect('admin:lumenApp_hermano_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Importar hermanos',
+            'form': form,
+        }
+        return render(request, 'admin/lumenApp/hermano/importar.html', context)
+
+
 # Register your models here.
-admin.site.register(Hermano)
+admin.site.register(Hermano, HermanoAdmin)
 admin.site.register(Rol)
 admin.site.register(HermanoRol)
 admin.site.register(TipoCulto)
 admin.site.register(Culto)
-
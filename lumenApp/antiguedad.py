@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import EstadoHermano, Hermano
+
+
+TAMANO_LOTE = 1000
+
+# Orden de antigüedad: fecha de ingreso y, a igual fecha, DNI
+ORDEN_ANTIGUEDAD = ['fecha_ingreso', 'dni']
+
+
+# Número de antigüedad (1 = el más antiguo) de los hermanos activos, guardado en
+# Hermano.numero_antiguedad. Las señales lo mantienen al crear, borrar o cambiar
+# estado, fecha de ingreso o DNI desplazando solo a los que van detrás; los
+# inactivos y suspendidos no tienen número.
+def activos():
+    return Hermano.objects.filter(estado=EstadoHermano.ACTIVO)
+
+
+# Quita un número de la secuencia: los de detrás suben un puesto.
+def quitar_numero(hermano_id, numero):
+    with transaction.atomic():
+        Hermano.objects.filter(numero_antiguedad__gt=numero).update(numero_antiguedad=F('numero_antiguedad') - 1)
+        Hermano.objects.filter(pk=hermano_id).update(numero_antiguedad=None)
+
+
+# Coloca a un hermano activo en su puesto: se cuentan los que van delante (índice
+# hermano_antiguedad_idx) y los de detrás bajan un puesto. El hermano no debe
+# tener número en ese momento.
+def colocar(hermano):
+    with transaction.atomic():
+        numero = activos().filter(
+            Q(fecha_ingreso__lt=hermano.fecha_ingreso) | Q(fecha_ingreso=hermano.fecha_ingreso, dni__lt=hermano.dni)
+        ).exclude(pk=hermano.pk).count() + 1
+        Hermano.objects.filter(numero_antiguedad__gte=numero).exclude(pk=hermano.pk).update(
+            numero_antiguedad=F('numero_antiguedad') + 1
+        )
+        Hermano.objects.filter(pk=hermano.pk).update(numero_antiguedad=numero)
+    hermano.numero_antiguedad = numero
+    return numero
+
+
+# Hermanos entre dos números de antigüedad, ambos incluidos: un rango sobre el índice.
+def rango_antiguedad(desde, hasta):
+    return Hermano.objects.filter(numero_antiguedad__range=(desde, hasta)).order_by('numero_antiguedad')
+
+
+def _numeros_correctos():
+    return activos().annotate(
+        numero=Window(RowNumber(), order_by=[F(campo).asc() for campo in ORDEN_ANTIGUEDAD])
+    ).values_list('pk', 'numero', 'numero_antiguedad')
+
+
+# (hermano_id, guardado, esperado) de los números que no cuadran.
+def verificar_antiguedad():
+    diferencias = [(pk, guardado, numero) for pk, numero, guardado in _numeros_correctos() if numero != guardado]
+    diferencias += [(pk, guardado, None) for pk, guardado in (
+        Hermano.objects.exclude(estado=EstadoHermano.ACTIVO)
+        .filter(numero_antiguedad__isnull=False)
+        .values_list('pk', 'numero_antiguedad')
+    )]
+    return diferencias
+
+
+# Recalcula todos los números con ROW_NUMBER() y solo escribe los que cambian.
+# Para después de cargas en bloque (bulk_create no lanza señales).
+def reconstruir_antiguedad():
+    with transaction.atomic():
+        cambiados = [
+            Hermano(pk=pk, numero_antiguedad=numero)
+            for pk, numero, guardado in _numeros_correctos() if numero != guardado
+        ]
+        Hermano.objects.bulk_update(cambiados, ['numero_antiguedad'], batch_size=TAMANO_LOTE)
+        sobrantes = Hermano.objects.exclude(estado=EstadoHermano.ACTIVO).filter(
+            numero_antiguedad__isnull=False
+        ).update(numero_antiguedad=None)
+    return len(cambiados) + sobrantes
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class lumenappConfig(AppConfig):
     name = 'lumenApp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,205 @@
+import atexit
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, models, transaction
+from django.utils import timezone
+
+from .fragmentos import version_fragmentos
+from .models import Asistencia, Culto, ParticipacionCulto
+
+
+# Control de asistencia en la puerta. Cada proceso tiene en memoria, por culto,
+# el hermano que corresponde a cada código (el DNI que lleva el QR del carnet)
+# y los que ya han entrado, así que un escaneo se resuelve y se contesta sin
+# tocar la base de datos. Las asistencias se acumulan y se escriben por lotes
+# con bulk_create; si dos procesos registran al mismo hermano, el unique de
+# Asistencia y ignore_conflicts hacen que solo quede una fila.
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoEscaneo(models.TextChoices):
+    REGISTRADO = 'registrado', 'Registrado'
+    REPETIDO = 'repetido', 'Ya había entrado'
+    DESCONOCIDO = 'desconocido', 'No participa en este culto'
+
+
+@dataclass
+class MapaCulto:
+    # Versión de los fragmentos del culto con la que se cargó: las señales la
+    # cambian al tocar sus participantes o los datos de un hermano
+    version: tuple
+    # código -> (hermano_id, nombre, tramo)
+    hermanos: dict
+    presentes: set = field(default_factory=set)
+
+
+_mapas = {}
+_pendientes = []
+_cerrojo = threading.Lock()
+# Solo un hilo carga el mapa de un culto; los demás esperan y lo reutilizan
+_cerrojo_carga = threading.Lock()
+_temporizador = None
+_volcado_al_salir = False
+
+
+def codigo_qr(dni):
+    return dni.strip().upper()
+
+
+def _cargar_mapa(culto_pk, version):
+    participaciones = (
+        ParticipacionCulto.objects.filter(culto_id=culto_pk).order_by('tramo', 'pk')
+        .values_list('hermano_id', 'hermano__dni', 'hermano__nombre', 'hermano__apellidos', 'tramo')
+    )
+    hermanos = {}
+    for hermano_id, dni, nombre, apellidos, tramo in participaciones:
+        # Con varios roles en el mismo culto vale el primer tramo
+        hermanos.setdefault(codigo_qr(dni), (hermano_id, f'{nombre} {apellidos}', tramo))
+    if not hermanos and not Culto.objects.filter(pk=culto_pk).exists():
+        return None
+    presentes = set(Asistencia.objects.filter(culto_id=culto_pk).values_list('hermano_id', flat=True))
+    return MapaCulto(version, hermanos, presentes)
+
+
+# Mapa del culto, recargado si ha cambiado su versión. None si el culto no existe.
+def mapa_culto(culto_pk):
+    version = version_fragmentos('culto', culto_pk)
+    mapa = _mapas.get(culto_pk)
+    if mapa is not None and mapa.version == version:
+        return mapa
+
+    with _cerrojo_carga:
+        mapa = _mapas.get(culto_pk)
+        if mapa is not None and mapa.version == version:
+            return mapa
+        nuevo = _cargar_mapa(culto_pk, version)
+        with _cerrojo:
+            mapa = _mapas.get(culto_pk)
+            if nuevo is None:
+                _mapas.pop(culto_pk, None)
+                return None
+            # Lo que aún no está en la base de datos sigue contando como presente
+            nuevo.presentes.update(a.hermano_id for a in _pendientes if a.culto_id == culto_pk)
+            if mapa is not None:
+                nuevo.presentes.update(mapa.presentes)
+            _mapas[culto_pk] = nuevo
+    return nuevo
+
+
+# Resuelve un escaneo: (estado, (hermano_id, nombre, tramo) o None). None si
+# el culto no existe. Escanear dos veces al mismo hermano no escribe nada más.
+# La escritura va siempre en otro hilo: el escaneo se contesta aunque la base
+# de datos falle en ese momento.
+def escanear(culto_pk, codigo):
+    global _volcado_al_salir
+    mapa = mapa_culto(culto_pk)
+    if mapa is None:
+        return None
+    datos = mapa.hermanos.get(codigo_qr(codigo))
+    if datos is None:
+        return EstadoEscaneo.DESCONOCIDO, None
+
+    with _cerrojo:
+        # Si otro hilo acaba de recargar el mapa, se apunta en el nuevo
+        mapa = _mapas.get(culto_pk, mapa)
+        if datos[0] in mapa.presentes:
+            return EstadoEscaneo.REPETIDO, datos
+        mapa.presentes.add(datos[0])
+        _pendientes.append(Asistencia(culto_id=culto_pk, hermano_id=datos[0], fecha_hora=timezone.now()))
+        _programar_volcado(inmediato=len(_pendientes) >= settings.LUMEN_ASISTENCIA_LOTE)
+        # Lo que quede en la cola al parar el proceso no se pierde. Solo en los
+        # procesos que escanean, no en cada comando que importe el módulo.
+        if not _volcado_al_salir:
+            atexit.register(_volcar_en_segundo_plano)
+            _volcado_al_salir = True
+    return EstadoEscaneo.REGISTRADO, datos
+
+
+def resumen_asistencia(culto_pk):
+    mapa = mapa_culto(culto_pk)
+    if mapa is None:
+        return None
+    return {'esperados': len(mapa.hermanos), 'presentes': len(mapa.presentes)}
+
+
+# Escribe las asistencias pendientes de este proceso y devuelve cuántas. Si la
+# base de datos no está disponible (OperationalError) se quedan en la cola para
+# el siguiente intento. Si alguna no se puede escribir nunca (su hermano o su
+# culto se han borrado mientras esperaba) se escriben una a una y se descartan
+# las que fallen, para que no bloqueen a las demás.
+def volcar_asistencias():
+    global _temporizador
+    with _cerrojo:
+        lote = _pendientes[:]
+        _pendientes.clear()
+        if _temporizador is not None:
+            _temporizador.cancel()
+            _temporizador = None
+    if not lote:
+        return 0
+    try:
+        with transaction.atomic():
+            Asistencia.objects.bulk_create(lote, batch_size=500, ignore_conflicts=True)
+    except OperationalError:
+        with _cerrojo:
+            _pendientes[:0] = lote
+        raise
+    except IntegrityError:
+        return _volcar_una_a_una(lote)
+    return len(lote)
+
+
+def _volcar_una_a_una(lote):
+    escritas = 0
+    for asistencia in lote:
+        try:
+            with transaction.atomic():
+                Asistencia.objects.bulk_create([asistencia], ignore_conflicts=True)
+        except IntegrityError:
+            logger.warning('Se descarta la asistencia del hermano %s al culto %s: ya no existe alguno de los dos',
+                           asistencia.hermano_id, asistencia.culto_id)
+        else:
+            escritas += 1
+    return escritas
+
+
+# Con el cerrojo cogido: el primer escaneo de un lote programa su escritura
+# dentro de LUMEN_ASISTENCIA_INTERVALO y el que lo llena la adelanta.
+def _programar_volcado(inmediato=False):
+    global _temporizador
+    intervalo = 0 if inmediato else settings.LUMEN_ASISTENCIA_INTERVALO
+    if _temporizador is not None:
+        if not inmediato or not _temporizador.interval:
+            return
+        _temporizador.cancel()
+    elif not inmediato and not intervalo:
+        return
+    _temporizador = threading.Timer(intervalo, _volcar_en_segundo_plano)
+    _temporizador.daemon = True
+    _temporizador.start()
+
+
+def _volcar_en_segundo_plano():
+    try:
+        volcar_asistencias()
+    except Exception:
+        logger.exception('No se han podido guardar las asistencias pendientes')
+        with _cerrojo:
+            _programar_volcado()
+    finally:
+        connection.close()
+
+
+# Olvida los mapas y descarta lo pendiente (pruebas y prueba de carga).
+def reiniciar_asistencia():
+    global _temporizador
+    with _cerrojo:
+        _mapas.clear()
+        _pendientes.clear()
+        if _temporizador is not None:
+            _temporizador.cancel()
+            _temporizador = None
@@ -0,0 +1,132 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import BalanceHermano, Cuota, EstadoPago, Hermano
+
+
+TAMANO_LOTE = 1000
+CERO = Decimal('0.00')
+
+
+def trozos(elementos, tamano):
+    for i in range(0, len(elementos), tamano):
+        yield elementos[i:i + tamano]
+
+
+# Lo que aporta una cuota al balance: (número, pagado, pendiente).
+def aportacion(importe, estado_pago):
+    importe = Decimal(importe)
+    if estado_pago == EstadoPago.PAGADO:
+        return 1, importe, CERO
+    return 1, CERO, importe
+
+
+# Suma (o resta, con números negativos) al balance del hermano con F() para que
+# dos escrituras a la vez no se pisen. Con crear=False no se crea la fila si falta
+# (al borrar un hermano sus cuotas se borran después que su balance).
+def aplicar_movimiento(hermano_id, num, pagado, pendiente, crear=True):
+    actualizados = BalanceHermano.objects.filter(hermano_id=hermano_id).update(
+        num_cuotas=F('num_cuotas') + num,
+        total_pagado=F('total_pagado') + pagado,
+        total_pendiente=F('total_pendiente') + pendiente,
+    )
+    if not actualizados and crear:
+        recalcular_balances([hermano_id])
+
+
+def asegurar_balances(hermano_ids):
+    BalanceHermano.objects.bulk_create(
+        [BalanceHermano(hermano_id=pk) for pk in hermano_ids],
+        ignore_conflicts=True,
+        batch_size=TAMANO_LOTE,
+    )
+
+
+# Todas las cuotas emitidas de golpe tienen el mismo importe y estado, así que
+# basta un UPDATE por lote de hermanos.
+def sumar_cuota_en_bloque(hermano_ids, importe, estado_pago):
+    num, pagado, pendiente = aportacion(importe, estado_pago)
+    asegurar_balances(hermano_ids)
+    for lote in trozos(list(hermano_ids), TAMANO_LOTE):
+        BalanceHermano.objects.filter(hermano_id__in=lote).update(
+            num_cuotas=F('num_cuotas') + num,
+            total_pagado=F('total_pagado') + pagado,
+            total_pendiente=F('total_pendiente') + pendiente,
+        )
+
+
+# Pasa de pendiente a pagado lo cobrado a cada hermano ({hermano_id: importe}).
+# Los hermanos con el mismo importe se actualizan juntos: un UPDATE por importe
+# y lote en lugar de uno por hermano.
+def pasar_a_pagado(importes):
+    por_importe = {}
+    for hermano_id, importe in importes.items():
+        por_importe.setdefault(importe, []).append(hermano_id)
+    for importe, hermano_ids in por_importe.items():
+        for lote in trozos(hermano_ids, TAMANO_LOTE):
+            BalanceHermano.objects.filter(hermano_id__in=lote).update(
+                total_pagado=F('total_pagado') + importe,
+                total_pendiente=F('total_pendiente') - importe,
+            )
+
+
+def _totales(hermano_ids):
+    filas = (
+        Cuota.objects.filter(hermano_id__in=hermano_ids)
+        .values('hermano_id')
+        .annotate(
+            num=Count('pk'),
+            pagado=Sum('importe', filter=Q(estado_pago=EstadoPago.PAGADO)),
+            pendiente=Sum('importe', filter=Q(estado_pago=EstadoPago.PENDIENTE)),
+        )
+        .order_by()
+    )
+    return {
+        fila['hermano_id']: (fila['num'], fila['pagado'] or CERO, fila['pendiente'] or CERO)
+        for fila in filas
+    }
+
+
+def _ids(hermano_ids):
+    if hermano_ids is None:
+        return list(Hermano.objects.order_by('pk').values_list('pk', flat=True))
+    return list(hermano_ids)
+
+
+# Reconstruye los balances desde las cuotas, por lotes de hermanos.
+def recalcular_balances(hermano_ids=None):
+    ids = _ids(hermano_ids)
+    with transaction.atomic():
+        for lote in trozos(ids, TAMANO_LOTE):
+            totales = _totales(lote)
+            BalanceHermano.objects.filter(hermano_id__in=lote).delete()
+            BalanceHermano.objects.bulk_create([
+                BalanceHermano(
+                    hermano_id=pk,
+                    num_cuotas=totales.get(pk, (0, CERO, CERO))[0],
+                    total_pagado=totales.get(pk, (0, CERO, CERO))[1],
+                    total_pendiente=totales.get(pk, (0, CERO, CERO))[2],
+                )
+                for pk in lote
+            ])
+    return len(ids)
+
+
+# Compara los balances guardados con los calculados desde las cuotas.
+# Devuelve una lista de (hermano_id, guardado, esperado) con las diferencias.
+def verificar_balances(hermano_ids=None):
+    diferencias = []
+    for lote in trozos(_ids(hermano_ids), TAMANO_LOTE):
+        totales = _totales(lote)
+        guardados = {
+            b.hermano_id: (b.num_cuotas, b.total_pagado, b.total_pendiente)
+            for b in BalanceHermano.objects.filter(hermano_id__in=lote)
+        }
+        for pk in lote:
+            esperado = totales.get(pk, (0, CERO, CERO))
+            guardado = guardados.get(pk)
+            if guardado != esperado:
+                diferencias.append((pk, guardado, esperado))
+    return diferencias
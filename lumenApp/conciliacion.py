@@ -0,0 +1,284 @@
+import csv
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.db import models, transaction
+
+from .balances import pasar_a_pagado, trozos
+from .estadisticas import invalidar_estadisticas
+from .fragmentos import invalidar_fragmentos
+from .models import Cuota, EstadoPago, Hermano
+
+
+TAMANO_LOTE = 1000
+
+# Referencia de una cuota concreta en el concepto del movimiento (CUOTA1234)
+PREFIJO_CUOTA = 'CUOTA'
+
+_PALABRAS = re.compile(r'[0-9A-Z]+')
+
+
+def referencia_cuota(pk):
+    return f'{PREFIJO_CUOTA}{pk}'
+
+
+class MotivoSinConciliar(models.TextChoices):
+    SIN_REFERENCIA = 'sin_referencia', 'Sin DNI ni referencia de cuota reconocibles'
+    SIN_PENDIENTES = 'sin_pendientes', 'El hermano no tiene cuotas pendientes'
+    IMPORTE = 'importe', 'El importe no cuadra con las cuotas pendientes del hermano'
+
+
+@dataclass
+class Movimiento:
+    # Fichero y línea (Norma 43) o número de apunte (camt.053)
+    origen: str
+    fecha: date
+    importe: Decimal
+    # Abono (ingreso); los cargos no se concilian
+    abono: bool
+    referencia: str = ''
+    concepto: str = ''
+
+
+@dataclass
+class ResultadoConciliacion:
+    movimientos: int = 0
+    cargos: int = 0
+    conciliados: int = 0
+    importe_conciliado: Decimal = Decimal('0.00')
+    cuotas_pagadas: int = 0
+    # (movimiento, motivo)
+    sin_conciliar: list = field(default_factory=list)
+
+
+def _fecha_aammdd(valor):
+    return datetime.strptime(valor, '%y%m%d').date()
+
+
+# Norma 43 (AEB, cuaderno 43): registros de 80 posiciones. El 22 es el
+# movimiento y los 23 que le siguen, sus conceptos complementarios. Se lee
+# línea a línea, sin cargar el fichero entero.
+def movimientos_norma43(fichero, nombre='norma43'):
+    actual = None
+    for linea, registro in enumerate(fichero, start=1):
+        if isinstance(registro, bytes):
+            registro = registro.decode('latin-1')
+        registro = registro.rstrip('\r\n')
+        codigo = registro[:2]
+        if codigo == '22':
+            if actual:
+                yield actual
+            try:
+                actual = Movimiento(
+                    origen=f'{nombre}:{linea}',
+                    fecha=_fecha_aammdd(registro[10:16]),
+                    importe=Decimal(registro[28:42]).scaleb(-2),
+                    abono=registro[27] == '2',
+                    # Número de documento, referencia 1 y referencia 2
+                    referencia=' '.join(' '.join((registro[42:52], registro[52:64], registro[64:80])).split()),
+                )
+            except (ValueError, InvalidOperation, IndexError):
+                raise ValueError(f'{nombre}, línea {linea}: registro 22 mal formado.')
+        elif codigo == '23' and actual:
+            actual.concepto = ' '.join(f'{actual.concepto} {registro[4:42]} {registro[42:80]}'.split())
+        elif actual:
+            # Fin de cuenta (33), de fichero (88) o cabecera de la siguiente cuenta (11)
+            yield actual
+            actual = None
+    if actual:
+        yield actual
+
+
+def _fecha_iso(valor):
+    return date.fromisoformat(valor[:10]) if valor else None
+
+
+# Textos no vacíos de las rutas indicadas, con el espacio de nombres del extracto.
+def _textos(elemento, ns, *rutas):
+    return [
+        ' '.join(nodo.text.split())
+        for ruta in rutas
+        for nodo in elemento.iterfind(ns + ruta.replace('/', f'/{ns}'))
+        if nodo.text and nodo.text.strip()
+    ]
+
+
+def _movimientos_apunte(ntry, ns, origen):
+    abono = ntry.findtext(f'{ns}CdtDbtInd') == 'CRDT'
+    fecha = _fecha_iso(ntry.findtext(f'{ns}BookgDt/{ns}Dt') or ntry.findtext(f'{ns}BookgDt/{ns}DtTm')
+                       or ntry.findtext(f'{ns}ValDt/{ns}Dt'))
+    referencias = _textos(ntry, ns, 'NtryRef', 'AcctSvcrRef')
+    detalles = list(ntry.iterfind(f'{ns}NtryDtls/{ns}TxDtls'))
+    importes = [d.findtext(f'{ns}Amt') or d.findtext(f'{ns}AmtDtls/{ns}TxAmt/{ns}Amt') for d in detalles]
+    # Un apunte agrupado (p. ej. una remesa de recibos) trae el importe de cada
+    # operación en su TxDtls: se concilia cada una por separado
+    if len(detalles) > 1 and all(importes):
+        for numero, (detalle, importe) in enumerate(zip(detalles, importes), start=1):
+            yield Movimiento(
+                origen=f'{origen}.{numero}', fecha=fecha, importe=Decimal(importe), abono=abono,
+                referencia=' '.join(_textos(detalle, ns, 'Refs/EndToEndId', 'Refs/MndtId', 'Refs/TxId')),
+                concepto=' '.join(_textos(detalle, ns, 'RmtInf/Ustrd', 'RmtInf/Strd/CdtrRefInf/Ref')),
+            )
+        return
+    yield Movimiento(
+        origen=origen, fecha=fecha, importe=Decimal(ntry.findtext(f'{ns}Amt')), abono=abono,
+        referencia=' '.join(referencias + _textos(ntry, ns, 'NtryDtls/TxDtls/Refs/EndToEndId')),
+        concepto=' '.join(_textos(
+            ntry, ns, 'NtryDtls/TxDtls/RmtInf/Ustrd', 'NtryDtls/TxDtls/RmtInf/Strd/CdtrRefInf/Ref', 'AddtlNtryInf',
+        )),
+    )
+
+
+# camt.053 (ISO 20022) con iterparse: cada apunte (Ntry) se procesa al cerrarse
+# y se quita del árbol, así la memoria no crece con el tamaño del extracto.
+def movimientos_camt053(fichero, nombre='camt053'):
+    abiertos = []
+    numero = 0
+    try:
+        for evento, elemento in iterparse(fichero, events=('start', 'end')):
+            if evento == 'start':
+                abiertos.append(elemento)
+                continue
+            abiertos.pop()
+            ns, _, etiqueta = elemento.tag.rpartition('}')
+            if etiqueta != 'Ntry':
+                continue
+            numero += 1
+            ns = f'{ns}}}' if ns else ''
+            try:
+                yield from _movimientos_apunte(elemento, ns, f'{nombre}:{numero}')
+            except (TypeError, ValueError, InvalidOperation):
+                raise ValueError(f'{nombre}, apunte {numero}: importe o fecha no válidos.')
+            if abiertos:
+                abiertos[-1].remove(elemento)
+    except ParseError as e:
+        raise ValueError(f'{nombre}: XML no válido ({e}).')
+
+
+# Detecta el formato por el primer carácter: XML (camt.053) o Norma 43.
+def leer_movimientos(fichero, nombre):
+    inicio = fichero.read(64)
+    fichero.seek(0)
+    if inicio.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<'):
+        return movimientos_camt053(fichero, nombre)
+    return movimientos_norma43(fichero, nombre)
+
+
+# Cuotas pendientes en memoria, leídas una vez por conciliación: por hermano,
+# de la más antigua a la más reciente (es el orden de cuota_morosidad_idx), y
+# el hermano de cada DNI.
+class IndicePendientes:
+    def __init__(self):
+        self.por_hermano = {}
+        self.hermano_de_cuota = {}
+        cuotas = (
+            Cuota.objects.filter(estado_pago=EstadoPago.PENDIENTE)
+            .order_by('hermano_id', 'fecha', 'pk')
+            .values_list('pk', 'hermano_id', 'importe')
+        )
+        for pk, hermano_id, importe in cuotas.iterator(chunk_size=10000):
+            self.por_hermano.setdefault(hermano_id, []).append((pk, importe))
+            self.hermano_de_cuota[pk] = hermano_id
+        # En las referencias del banco el DNI puede venir con ceros a la izquierda
+        self.por_dni = {}
+        for pk, dni in Hermano.objects.values_list('pk', 'dni').iterator(chunk_size=10000):
+            self.por_dni[dni.upper()] = self.por_dni[dni.upper().lstrip('0')] = pk
+
+    def _quitar(self, hermano_id, elegidas):
+        pendientes = self.por_hermano[hermano_id]
+        self.por_hermano[hermano_id] = [cuota for cuota in pendientes if cuota[0] not in elegidas]
+        for pk in elegidas:
+            del self.hermano_de_cuota[pk]
+        return list(elegidas)
+
+    # Devuelve los pks de las cuotas que paga el movimiento o el motivo por el que
+    # no se concilia. Primero una referencia de cuota con el mismo importe; si no,
+    # el DNI del hermano y su cuota pendiente más antigua con ese importe o, si
+    # paga varias de golpe, las más antiguas que sumen justo el importe.
+    def emparejar(self, movimiento):
+        palabras = _PALABRAS.findall(f'{movimiento.referencia} {movimiento.concepto}'.upper())
+        for palabra in palabras:
+            if palabra.startswith(PREFIJO_CUOTA) and palabra[len(PREFIJO_CUOTA):].isdigit():
+                pk = int(palabra[len(PREFIJO_CUOTA):])
+                hermano_id = self.hermano_de_cuota.get(pk)
+                if hermano_id and dict(self.por_hermano[hermano_id])[pk] == movimiento.importe:
+                    return self._quitar(hermano_id, {pk})
+
+        hermano_id = next((self.por_dni[p] for p in palabras if p in self.por_dni), None)
+        if hermano_id is None:
+            hermano_id = next((self.por_dni[p.lstrip('0')] for p in palabras if p.lstrip('0') in self.por_dni), None)
+        if hermano_id is None:
+            return MotivoSinConciliar.SIN_REFERENCIA
+        pendientes = self.por_hermano.get(hermano_id)
+        if not pendientes:
+            return MotivoSinConciliar.SIN_PENDIENTES
+        for pk, importe in pendientes:
+            if importe == movimiento.importe:
+                return self._quitar(hermano_id, {pk})
+        suma = 0
+        for posicion, (_, importe) in enumerate(pendientes, start=1):
+            suma += importe
+            if suma == movimiento.importe:
+                return self._quitar(hermano_id, {pk for pk, _ in pendientes[:posicion]})
+            if suma > movimiento.importe:
+                break
+        return MotivoSinConciliar.IMPORTE
+
+
+# Marca como pagadas las cuotas emparejadas en una transacción: por cada lote se
+# releen las que siguen pendientes, se pasan a pagadas con un UPDATE (todas van
+# al mismo estado) y lo cobrado se mueve en los balances de sus hermanos.
+def marcar_pagadas(cuotas, tamano_lote=TAMANO_LOTE):
+    cobrado = {}
+    pagadas = 0
+    with transaction.atomic():
+        for lote in trozos(cuotas, tamano_lote):
+            filas = list(
+                Cuota.objects.filter(pk__in=lote, estado_pago=EstadoPago.PENDIENTE).values_list('pk', 'hermano_id', 'importe')
+            )
+            # update() no lanza señales: el balance se ajusta abajo
+            pagadas += Cuota.objects.filter(pk__in=[pk for pk, _, _ in filas]).update(estado_pago=EstadoPago.PAGADO)
+            for _, hermano_id, importe in filas:
+                cobrado[hermano_id] = cobrado.get(hermano_id, 0) + importe
+        pasar_a_pagado(cobrado)
+        if pagadas:
+            transaction.on_commit(invalidar_estadisticas)
+            transaction.on_commit(invalidar_fragmentos)
+    return pagadas
+
+
+# Concilia los extractos indicados, [(nombre, fichero binario)], con las cuotas
+# pendientes. Con aplicar=False solo informa de lo que se conciliaría.
+def conciliar(extractos, aplicar=True, tamano_lote=TAMANO_LOTE):
+    resultado = ResultadoConciliacion()
+    indice = IndicePendientes()
+    cuotas = []
+    for nombre, fichero in extractos:
+        for movimiento in leer_movimientos(fichero, nombre):
+            resultado.movimientos += 1
+            if not movimiento.abono:
+                resultado.cargos += 1
+                continue
+            emparejado = indice.emparejar(movimiento)
+            if isinstance(emparejado, MotivoSinConciliar):
+                resultado.sin_conciliar.append((movimiento, emparejado))
+                continue
+            cuotas.extend(emparejado)
+            resultado.conciliados += 1
+            resultado.importe_conciliado += movimiento.importe
+
+    resultado.cuotas_pagadas = marcar_pagadas(cuotas, tamano_lote) if aplicar else len(cuotas)
+    return resultado
+
+
+def escribir_sin_conciliar(resultado, destino):
+    escritor = csv.writer(destino, delimiter=';')
+    escritor.writerow(['Origen', 'Fecha', 'Importe', 'Referencia', 'Concepto', 'Motivo'])
+    for movimiento, motivo in resultado.sin_conciliar:
+        escritor.writerow([
+            movimiento.origen, movimiento.fecha, movimiento.importe, movimiento.referencia, movimiento.concepto,
+            motivo.label,
+        ])
@@ -0,0 +1,173 @@
+import base64
+import json
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+
+from .models import Culto, Hermano, ParticipacionCulto
+
+
+# Columnas de la tabla de fichas en el mismo orden que en fichas_lista.html.
+# None marca las columnas que no se pueden ordenar.
+COLUMNAS_FICHAS = ['nombre', 'apellidos', 'total_cuotas', None]
+
+# Tope de filas por página aunque el cliente pida "todas".
+MAX_FILAS_PAGINA = 100
+
+
+# Hermanos visibles para el usuario con los filtros de fichas_lista (rol y búsqueda).
+def fichas_queryset(user, admin, rol_id=None, busqueda=None):
+    if admin:
+        fichas = Hermano.objects.all()
+    else:
+        fichas = Hermano.objects.filter(usuario=user)
+
+    # unique_together (hermano, rol) garantiza una fila por hermano, no hace falta distinct()
+    if rol_id:
+        fichas = fichas.filter(hermanorol__rol_id=rol_id)
+
+    if busqueda:
+        fichas = fichas.filter(
+            Q(nombre__icontains=busqueda) |
+            Q(apellidos__icontains=busqueda) |
+            Q(dni__istartswith=busqueda)
+        )
+    return fichas
+
+
+# Cultos con los filtros de CultoListView: tipo, próximos o pasados y rango de
+# fechas de inicio. Todos se resuelven con los índices que empiezan por
+# fecha_inicio o por (tipo, fecha_inicio).
+CUANDO_CULTOS = ('proximos', 'pasados')
+
+
+def filtrar_cultos(tipo_id=None, cuando=None, desde=None, hasta=None):
+    cultos = Culto.objects.select_related('tipo')
+    if tipo_id:
+        cultos = cultos.filter(tipo__id=tipo_id)
+    if cuando == 'proximos':
+        cultos = cultos.filter(fecha_inicio__gte=date.today())
+    elif cuando == 'pasados':
+        cultos = cultos.filter(fecha_inicio__lt=date.today())
+    if desde:
+        cultos = cultos.filter(fecha_inicio__gte=desde)
+    if hasta:
+        cultos = cultos.filter(fecha_inicio__lte=hasta)
+    return cultos
+
+
+# Participantes de cada culto con una subconsulta correlacionada: solo se cuenta
+# para las filas de la página, no para todos los cultos como haría un GROUP BY.
+def con_participantes(cultos):
+    participantes = (
+        ParticipacionCulto.objects.filter(culto=OuterRef('pk'))
+        .order_by().values('culto').annotate(total=Count('pk')).values('total')
+    )
+    return cultos.annotate(num_participantes=Coalesce(Subquery(participantes), 0))
+
+
+# Número de cuotas de cada hermano leído del balance mantenido (BalanceHermano),
+# sin agregar sobre la tabla de cuotas.
+def con_total_cuotas(fichas):
+    return fichas.annotate(total_cuotas=Coalesce('balance__num_cuotas', 0))
+
+
+def codificar_cursor(valor, pk):
+    if hasattr(valor, 'isoformat'):
+        valor = valor.isoformat()
+    datos = json.dumps([valor, pk]).encode()
+    return base64.urlsafe_b64encode(datos).decode()
+
+
+# None si el cursor no es válido (manipulado o de otra columna): se vuelve a la
+# primera página. Con `campo` el valor se convierte a su tipo, para que una
+# fecha o un número mal formados no lleguen al filtro.
+def decodificar_cursor(cursor, campo=None):
+    try:
+        valor, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if campo is not None and valor is not None:
+            valor = campo.to_python(valor)
+        return valor, int(pk)
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+# Campo del modelo o de la anotación por el que se ordena.
+def campo_orden(queryset, campo):
+    anotacion = queryset.query.annotations.get(campo)
+    if anotacion is not None:
+        return anotacion.output_field
+    return queryset.model._meta.get_field(campo)
+
+
+# Paginación por clave (keyset) sobre (campo, pk): el coste de cada página no
+# depende de lo lejos que esté del principio, al contrario que OFFSET.
+# Los NULL van siempre al principio en orden ascendente y al final en descendente.
+def consulta_keyset(queryset, campo, descendente=False, cursor=None, limite=25):
+    if descendente:
+        queryset = queryset.order_by(f'-{campo}', '-pk')
+    else:
+        queryset = queryset.order_by(campo, 'pk')
+
+    posicion = decodificar_cursor(cursor, campo_orden(queryset, campo)) if cursor else None
+    if posicion:
+        valor, pk = posicion
+        if valor is None:
+            filtro = Q(**{f'{campo}__isnull': True}, pk__lt=pk) if descendente \
+                else Q(**{f'{campo}__isnull': False}) | Q(**{f'{campo}__isnull': True}, pk__gt=pk)
+        elif descendente:
+            filtro = Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor}, pk__lt=pk) | Q(**{f'{campo}__isnull': True})
+        else:
+            filtro = Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor}, pk__gt=pk)
+        queryset = queryset.filter(filtro)
+
+    # Una fila de más para saber si hay página siguiente
+    return queryset[:limite + 1]
+
+
+# Recorta las filas leídas con consulta_keyset() y calcula el cursor de la siguiente página.
+def cortar_keyset(filas, campo, limite):
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        siguiente = codificar_cursor(getattr(ultima, campo), ultima.pk)
+    return filas, siguiente
+
+
+def pagina_keyset(queryset, campo, descendente=False, cursor=None, limite=25):
+    filas = list(consulta_keyset(queryset, campo, descendente, cursor, limite))
+    return cortar_keyset(filas, campo, limite)
+
+
+async def apagina_keyset(queryset, campo, descendente=False, cursor=None, limite=25):
+    filas = [fila async for fila in consulta_keyset(queryset, campo, descendente, cursor, limite)]
+    return cortar_keyset(filas, campo, limite)
+
+
+# Participantes de un culto con hermano y rol en la misma consulta, en el orden
+# del cortejo: por tramo (los que no tienen al final), rol y apellidos.
+def participantes_culto(culto):
+    return (
+        ParticipacionCulto.objects.filter(culto=culto)
+        .select_related('hermano', 'rol')
+        .only('tramo', 'hermano__nombre', 'hermano__apellidos', 'rol__nombre')
+        .order_by(F('tramo').asc(nulls_last=True), 'rol__nombre', 'hermano__apellidos', 'hermano__nombre', 'pk')
+    )
+
+
+def entero(valor, defecto=0):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def fecha(valor):
+    try:
+        return parse_date(valor or '')
+    except ValueError:
+        return None
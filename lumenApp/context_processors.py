@@ -0,0 +1,3 @@
+# Pone es_admin a disposición de todas las plantillas (base.html lo usa en la barra de navegación).
+def roles(request):
+    return {'es_admin': getattr(request, 'es_admin', False)}
@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+
+# Contraseñas que se mandan a cada trabajador de una vez en hashear_varias()
+TROZO = 32
+
+# Un hash cuesta cientos de milisegundos de CPU a propósito. Si cada petición lo
+# calcula en su hilo, un pico de registros ocupa todos los workers; con un pool
+# acotado como mucho LUMEN_HASHES_TRABAJADORES hashes van a la vez y el resto de
+# peticiones sigue atendiéndose.
+_pool = None
+_cerrojo = threading.Lock()
+
+
+def _iniciar_proceso():
+    import django
+    django.setup()
+
+
+# Con LUMEN_HASHES_POOL = "ninguno" no hay pool y el hash se calcula en el hilo de la petición.
+def pool():
+    global _pool
+    if _pool is None and settings.LUMEN_HASHES_POOL != 'ninguno':
+        with _cerrojo:
+            if _pool is None:
+                trabajadores = settings.LUMEN_HASHES_TRABAJADORES
+                if settings.LUMEN_HASHES_POOL == 'procesos':
+                    _pool = ProcessPoolExecutor(max_workers=trabajadores, initializer=_iniciar_proceso)
+                else:
+                    _pool = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix='hashes')
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    with _cerrojo:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def hashear(contrasena):
+    ejecutor = pool()
+    if ejecutor is None:
+        return make_password(contrasena)
+    return ejecutor.submit(make_password, contrasena).result()
+
+
+def hashear_varias(contrasenas):
+    ejecutor = pool()
+    if ejecutor is None:
+        return [make_password(contrasena) for contrasena in contrasenas]
+    return list(ejecutor.map(make_password, contrasenas, chunksize=TROZO))
+
+
+# Como User.objects.create_user pero con el hash calculado en el pool.
+def crear_usuario(username, password):
+    return User.objects.create(username=User.normalize_username(username), password=hashear(password))
+
+
+def cambiar_contrasena(usuario, password):
+    usuario.password = hashear(password)
+    usuario.save(update_fields=['password'])
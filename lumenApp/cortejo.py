@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Q
+
+from .balances import trozos
+from .fragmentos import invalidar_fragmentos
+from .models import EstadoHermano, HermanoRol, ParticipacionCulto
+
+
+TAMANO_LOTE = 1000
+
+
+# Capacidad de cada tramo a partir de "40,80,80": el último valor se repite en
+# los tramos siguientes, así "100" son tramos de 100.
+def capacidades_tramos(texto):
+    try:
+        capacidades = [int(valor) for valor in str(texto).replace(';', ',').split(',') if valor.strip()]
+    except ValueError:
+        raise ValueError('Las capacidades deben ser números separados por comas.')
+    if not capacidades or any(capacidad < 1 for capacidad in capacidades):
+        raise ValueError('Cada tramo debe admitir al menos un hermano.')
+    return capacidades
+
+
+@dataclass
+class PlanCortejo:
+    # (hermano_id, rol_id, tramo) en el orden del cortejo
+    asignaciones: list = field(default_factory=list)
+    # ParticipacionCulto a crear, a cambiar de tramo y que sobran (su hermano ya no es elegible)
+    crear: list = field(default_factory=list)
+    actualizar: list = field(default_factory=list)
+    sobrantes: list = field(default_factory=list)
+    sin_cambios: int = 0
+    # Elegibles que no caben en el número máximo de tramos
+    sin_plaza: int = 0
+    # (tramo, hermanos, nuevos, cambios de tramo)
+    tramos: list = field(default_factory=list)
+
+
+# Hermanos activos con alguno de los roles vigente el día del culto, por número
+# de antigüedad (o al revés). Si tiene varios de los roles va con el primero de
+# `roles`. Una consulta, sin instanciar modelos.
+def _elegibles(culto, roles, antiguos_primero):
+    dia = culto.fecha_inicio or date.today()
+    orden = {rol.pk: posicion for posicion, rol in enumerate(roles)}
+    filas = (
+        HermanoRol.objects
+        .filter(rol__in=list(orden), hermano__estado=EstadoHermano.ACTIVO)
+        .filter(Q(fecha_inicio__isnull=True) | Q(fecha_inicio__lte=dia))
+        .filter(Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=dia))
+        .values_list('hermano_id', 'rol_id', 'hermano__numero_antiguedad')
+    )
+    elegidos = {}
+    for hermano_id, rol_id, numero in filas:
+        anterior = elegidos.get(hermano_id)
+        if anterior is None or orden[rol_id] < orden[anterior[0]]:
+            elegidos[hermano_id] = (rol_id, numero)
+    # Los que aún no tengan número (cargas sin reconstruir_antiguedad) van al
+    # final en los dos sentidos
+    signo = 1 if antiguos_primero else -1
+    return sorted(
+        ((hermano_id, rol_id) for hermano_id, (rol_id, _) in elegidos.items()),
+        key=lambda fila: (elegidos[fila[0]][1] is None, signo * (elegidos[fila[0]][1] or 0), fila[0]),
+    )
+
+
+# Calcula el cortejo sin escribir nada: qué participaciones hay que crear, cuáles
+# cambian de tramo y cuáles sobran respecto a lo que ya tiene el culto. Los
+# hermanos que ya participan en el culto con otro rol no se vuelven a colocar.
+def planificar_cortejo(culto, roles, capacidades, tramo_inicial=1, max_tramos=None, antiguos_primero=True):
+    roles = list(roles)
+    ids_roles = {rol.pk for rol in roles}
+    existentes = {}
+    con_otro_rol = set()
+    for participacion in ParticipacionCulto.objects.filter(culto=culto).only('pk', 'hermano_id', 'rol_id', 'tramo'):
+        if participacion.rol_id in ids_roles:
+            existentes[participacion.hermano_id, participacion.rol_id] = participacion
+        else:
+            con_otro_rol.add(participacion.hermano_id)
+
+    plan = PlanCortejo()
+    tramo, ocupados, indice = tramo_inicial, 0, 0
+    contadores = {}
+    for hermano_id, rol_id in _elegibles(culto, roles, antiguos_primero):
+        if hermano_id in con_otro_rol:
+            continue
+        if ocupados >= capacidades[min(indice, len(capacidades) - 1)]:
+            tramo, ocupados, indice = tramo + 1, 0, indice + 1
+        if max_tramos and indice >= max_tramos:
+            plan.sin_plaza += 1
+            continue
+        ocupados += 1
+        plan.asignaciones.append((hermano_id, rol_id, tramo))
+        contador = contadores.setdefault(tramo, [0, 0, 0])
+        contador[0] += 1
+
+        participacion = existentes.pop((hermano_id, rol_id), None)
+        if participacion is None:
+            plan.crear.append(ParticipacionCulto(hermano_id=hermano_id, culto=culto, rol_id=rol_id, tramo=tramo))
+            contador[1] += 1
+        elif participacion.tramo != tramo:
+            participacion.tramo = tramo
+            plan.actualizar.append(participacion)
+            contador[2] += 1
+        else:
+            plan.sin_cambios += 1
+
+    plan.sobrantes = list(existentes.values())
+    plan.tramos = [(numero, *contadores[numero]) for numero in sorted(contadores)]
+    return plan
+
+
+# Vuelve a calcular el plan dentro de la transacción (lo previsualizado puede
+# haber cambiado) y lo escribe en bloque. Con quitar_sobrantes también se borran
+# las participaciones de esos roles que ya no son elegibles.
+def aplicar_cortejo(culto, roles, capacidades, quitar_sobrantes=False, **opciones):
+    with transaction.atomic():
+        plan = planificar_cortejo(culto, roles, capacidades, **opciones)
+        ParticipacionCulto.objects.bulk_create(plan.crear, batch_size=TAMANO_LOTE, ignore_conflicts=True)
+        # Un UPDATE por tramo en vez de bulk_update, que escribe un CASE con una rama por fila
+        por_tramo = {}
+        for participacion in plan.actualizar:
+            por_tramo.setdefault(participacion.tramo, []).append(participacion.pk)
+        for tramo, pks in por_tramo.items():
+            for lote in trozos(pks, TAMANO_LOTE):
+                ParticipacionCulto.objects.filter(pk__in=lote).update(tramo=tramo)
+        if quitar_sobrantes:
+            for lote in trozos([participacion.pk for participacion in plan.sobrantes], TAMANO_LOTE):
+                ParticipacionCulto.objects.filter(pk__in=lote).delete()
+        # Las operaciones en bloque no lanzan señales
+        transaction.on_commit(lambda: invalidar_fragmentos('culto', [culto.pk]))
+    return plan
@@ -0,0 +1,75 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator
+from django.db import transaction
+from django.db.models import QuerySet
+
+from .balances import sumar_cuota_en_bloque, trozos
+from .estadisticas import invalidar_estadisticas
+from .fragmentos import invalidar_fragmentos
+from .models import Cuota, EstadoPago, PeriodoCuota
+
+
+TAMANO_LOTE = 500
+
+
+# Mismas reglas que Cuota.clean(), el campo importe y los choices del modelo,
+# comprobadas una vez para toda la emisión en lugar de fila a fila. bulk_create
+# no valida: un importe con más dígitos o decimales se escribiría tal cual.
+def validar_emision(importe, periodo, estado_pago):
+    try:
+        importe = Decimal(importe)
+    except (InvalidOperation, TypeError):
+        raise ValidationError("El importe no es válido.")
+    if not importe.is_finite():
+        raise ValidationError("El importe no es válido.")
+    if importe <= 0:
+        raise ValidationError("El importe debe ser mayor que cero.")
+    campo = Cuota._meta.get_field('importe')
+    DecimalValidator(campo.max_digits, campo.decimal_places)(importe)
+    if periodo not in PeriodoCuota.values:
+        raise ValidationError("Período no válido.")
+    if estado_pago not in EstadoPago.values:
+        raise ValidationError("Estado de pago no válido.")
+    return importe
+
+
+# Emite una cuota a cada hermano indicado (queryset o lista de hermanos/pks)
+# con bulk_create por lotes dentro de una única transacción. Se omiten los
+# hermanos que ya tienen una cuota de ese período en el año en curso.
+# Devuelve un resumen {'creadas': n, 'omitidas': m}.
+def emitir_cuotas(hermanos, importe, periodo, estado_pago=EstadoPago.PENDIENTE, tamano_lote=TAMANO_LOTE):
+    importe = validar_emision(importe, periodo, estado_pago)
+    anio = date.today().year
+
+    if isinstance(hermanos, QuerySet):
+        ids = list(hermanos.order_by().values_list('pk', flat=True))
+    else:
+        ids = [getattr(hermano, 'pk', hermano) for hermano in hermanos]
+    # Un hermano repetido en la selección recibe una sola cuota
+    ids = list(dict.fromkeys(ids))
+
+    creadas = omitidas = 0
+    with transaction.atomic():
+        for lote in trozos(ids, tamano_lote):
+            existentes = set(
+                Cuota.objects.filter(hermano_id__in=lote, periodo=periodo, fecha__year=anio)
+                .values_list('hermano_id', flat=True)
+            )
+            nuevas = [
+                Cuota(hermano_id=pk, importe=importe, periodo=periodo, estado_pago=estado_pago)
+                for pk in lote if pk not in existentes
+            ]
+            Cuota.objects.bulk_create(nuevas)
+            sumar_cuota_en_bloque([cuota.hermano_id for cuota in nuevas], importe, estado_pago)
+            creadas += len(nuevas)
+            omitidas += len(lote) - len(nuevas)
+
+        # bulk_create no lanza post_save, el balance se actualiza arriba
+        if creadas:
+            transaction.on_commit(invalidar_estadisticas)
+            transaction.on_commit(invalidar_fragmentos)
+
+    return {'creadas': creadas, 'omitidas': omitidas}
@@ -0,0 +1,396 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
+
+from .consultas import fichas_queryset
+from .imagenes import en_rgb
+from .models import Cuota, EstadoHermano, EstadoPago, Hermano, PeriodoCuota
+
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+
+
+# Cambiarla cuando cambie el diseño, para que no se reutilicen páginas de la caché
+VERSION_PLANTILLAS = 1
+
+# Tamaño de la página en milímetros y en píxeles (150 ppp el recibo, 300 el carnet)
+DOCUMENTOS = {
+    'recibos': {'mm': (148, 105), 'px': (874, 620)},
+    'carnets': {'mm': (85.6, 54), 'px': (1011, 638)},
+}
+FORMATOS = ('pdf', 'zip')
+
+# Documentos que se mandan a la vez al pool; se encola el siguiente lote mientras
+# se escribe el anterior
+TAMANO_LOTE = 256
+CALIDAD_JPEG = 85
+
+ROJO = (122, 22, 38)
+GRIS = (90, 90, 90)
+VERDE = (25, 120, 60)
+
+_pool = None
+_cerrojo = threading.Lock()
+
+
+# La fuente que trae Pillow solo tiene ASCII: sin LUMEN_DOCUMENTOS_FUENTE se quitan
+# las tildes para no imprimir cuadros en su lugar.
+def _texto(valor):
+    if settings.LUMEN_DOCUMENTOS_FUENTE:
+        return valor
+    valor = valor.replace('€', 'EUR').replace('º', '.')
+    return unicodedata.normalize('NFKD', valor).encode('ascii', 'ignore').decode('ascii')
+
+
+def _escribir(dibujo, posicion, texto, fuente, color, ancla='lm'):
+    dibujo.text(posicion, _texto(texto), font=fuente, fill=color, anchor=ancla)
+
+
+# Fuentes y fondos comunes a todos los documentos de un tipo (la franja con el
+# nombre de la hermandad, los marcos y las etiquetas). Se preparan una vez por
+# proceso y cada documento parte de una copia.
+@cache
+def recursos():
+    ruta = settings.LUMEN_DOCUMENTOS_FUENTE
+
+    def fuente(tamano):
+        return ImageFont.truetype(ruta, tamano) if ruta else ImageFont.load_default(size=tamano)
+
+    fuentes = {tamano: fuente(tamano) for tamano in (22, 26, 30, 36, 44, 56)}
+    hermandad = settings.LUMEN_HERMANDAD
+
+    ancho, alto = DOCUMENTOS['recibos']['px']
+    recibo = Image.new('RGB', (ancho, alto), 'white')
+    dibujo = ImageDraw.Draw(recibo)
+    dibujo.rectangle((0, 0, ancho, 90), fill=ROJO)
+    _escribir(dibujo, (30, 45), hermandad, fuentes[36], 'white')
+    _escribir(dibujo, (30, 130), 'RECIBO DE CUOTA', fuentes[30], ROJO)
+    for y, etiqueta in ((200, 'Hermano'), (270, 'DNI'), (340, 'Período'), (410, 'Emitida')):
+        _escribir(dibujo, (30, y), etiqueta, fuentes[22], GRIS)
+    dibujo.line((30, 460, ancho - 30, 460), fill=GRIS, width=2)
+    _escribir(dibujo, (30, 530), 'Importe', fuentes[26], GRIS)
+    dibujo.rectangle((4, 4, ancho - 5, alto - 5), outline=ROJO, width=3)
+
+    ancho, alto = DOCUMENTOS['carnets']['px']
+    carnet = Image.new('RGB', (ancho, alto), 'white')
+    dibujo = ImageDraw.Draw(carnet)
+    dibujo.rectangle((0, 0, ancho, 110), fill=ROJO)
+    _escribir(dibujo, (40, 55), hermandad, fuentes[44], 'white')
+    dibujo.rectangle((40, 150, 300, 480), outline=GRIS, width=2)
+    for y, etiqueta in ((240, 'DNI'), (330, 'Número de hermano'), (420, 'Hermano desde')):
+        _escribir(dibujo, (340, y), etiqueta, fuentes[22], GRIS)
+    dibujo.rectangle((4, 4, ancho - 5, alto - 5), outline=ROJO, width=4)
+
+    return {'fuentes': fuentes, 'plantillas': {'recibos': recibo, 'carnets': carnet}}
+
+
+def _dibujar_recibo(lienzo, datos):
+    fuentes = recursos()['fuentes']
+    dibujo = ImageDraw.Draw(lienzo)
+    ancho = lienzo.width
+    _escribir(dibujo, (ancho - 30, 130), f"Nº {datos['numero']}", fuentes[26], GRIS, 'rm')
+    for y, valor in ((200, datos['nombre']), (270, datos['dni']), (340, datos['periodo']), (410, datos['fecha'])):
+        _escribir(dibujo, (200, y), valor, fuentes[26], 'black')
+    _escribir(dibujo, (200, 530), f"{datos['importe']} €", fuentes[56], 'black')
+    pagado = datos['estado'] == EstadoPago.PAGADO
+    color = VERDE if pagado else GRIS
+    dibujo.rounded_rectangle((ancho - 290, 490, ancho - 40, 570), radius=10, outline=color, width=4)
+    _escribir(dibujo, (ancho - 165, 530), datos['estado'].upper(), fuentes[30], color, 'mm')
+
+
+def _dibujar_carnet(lienzo, datos):
+    fuentes = recursos()['fuentes']
+    dibujo = ImageDraw.Draw(lienzo)
+    _escribir(dibujo, (340, 175), datos['nombre'], fuentes[36], 'black')
+    for y, valor in ((275, datos['dni']), (365, datos['numero']), (455, datos['ingreso'])):
+        _escribir(dibujo, (340, y), valor, fuentes[30], 'black')
+
+    if datos['foto']:
+        try:
+            with Image.open(datos['foto']) as foto:
+                # draft() decodifica el JPEG ya reducido, mucho más rápido que leerlo entero
+                foto.draft('RGB', (520, 660))
+                foto = en_rgb(ImageOps.exif_transpose(foto))
+                lienzo.paste(ImageOps.fit(foto, (256, 326), Image.Resampling.LANCZOS), (42, 152))
+        except (UnidentifiedImageError, OSError):
+            pass
+
+    if qrcode is not None:
+        codigo = qrcode.make(datos['dni'], box_size=6, border=1).get_image().convert('RGB')
+        codigo = codigo.resize((200, 200), Image.Resampling.NEAREST)
+        lienzo.paste(codigo, (lienzo.width - 240, lienzo.height - 240))
+
+
+DIBUJOS = {'recibos': _dibujar_recibo, 'carnets': _dibujar_carnet}
+
+
+# Dibuja un documento sobre una copia de su plantilla y lo deja como JPEG en la
+# caché, en lugar de la página que tuviera antes ese documento. Es lo que corre
+# en el pool: recibe y devuelve solo datos simples.
+def renderizar(tarea):
+    tipo, nombre, datos, ruta = tarea
+    lienzo = recursos()['plantillas'][tipo].copy()
+    DIBUJOS[tipo](lienzo, datos)
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    # Se escribe en un temporal propio (puede haber varios hilos dibujando la
+    # misma página) y se renombra para que nadie lea una página a medias
+    with tempfile.NamedTemporaryFile(dir=ruta.parent, suffix='.tmp', delete=False) as temporal:
+        try:
+            lienzo.save(temporal, 'JPEG', quality=CALIDAD_JPEG)
+        except BaseException:
+            os.unlink(temporal.name)
+            raise
+    os.replace(temporal.name, ruta)
+    for anterior in ruta.parent.glob(f'{glob.escape(nombre)}.*.jpg'):
+        if anterior != ruta:
+            anterior.unlink(missing_ok=True)
+    return str(ruta)
+
+
+def _iniciar_proceso():
+    import django
+    django.setup()
+    recursos()
+
+
+# Con LUMEN_DOCUMENTOS_POOL = "ninguno" los documentos se dibujan en el proceso que los pide.
+def pool(trabajadores=None):
+    global _pool
+    if _pool is None and settings.LUMEN_DOCUMENTOS_POOL != 'ninguno':
+        with _cerrojo:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=trabajadores or settings.LUMEN_DOCUMENTOS_TRABAJADORES, initializer=_iniciar_proceso,
+                )
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    with _cerrojo:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+# La página de cada documento (recibo_12, carnet_<dni>) se guarda con el hash de
+# todo lo que sale en ella: si nada ha cambiado desde la última vez se reutiliza
+# sin volver a dibujarla. Cada documento tiene una sola página en la caché:
+# renderizar() borra las de versiones anteriores al escribir la nueva.
+def ruta_cache(tipo, nombre, datos):
+    contenido = json.dumps(
+        [VERSION_PLANTILLAS, settings.LUMEN_HERMANDAD, settings.LUMEN_DOCUMENTOS_FUENTE, qrcode is not None,
+         tipo, datos],
+        sort_keys=True, default=str,
+    )
+    clave = hashlib.sha256(contenido.encode()).hexdigest()[:32]
+    carpeta = hashlib.sha256(nombre.encode()).hexdigest()[:2]
+    return Path(settings.LUMEN_DOCUMENTOS_RUTA) / tipo / carpeta / f'{nombre}.{clave}.jpg'
+
+
+def vaciar_cache():
+    borradas = 0
+    for ruta in Path(settings.LUMEN_DOCUMENTOS_RUTA).rglob('*.jpg'):
+        ruta.unlink(missing_ok=True)
+        borradas += 1
+    return borradas
+
+
+# Ruta de la foto en disco con su tamaño y fecha, para que cambiarla invalide el carnet.
+def _foto(imagen, storage):
+    if not imagen:
+        return None, None
+    try:
+        ruta = storage.path(imagen)
+        estado = os.stat(ruta)
+    except (NotImplementedError, OSError):
+        return None, None
+    return ruta, f'{imagen}:{estado.st_size}:{estado.st_mtime_ns}'
+
+
+def datos_recibos(user=None, admin=True, rol_id=None, busqueda=None, periodo=None, anio=None, estado_pago=None):
+    cuotas = Cuota.objects.all()
+    if not admin or rol_id or busqueda:
+        cuotas = cuotas.filter(hermano__in=fichas_queryset(user, admin, rol_id, busqueda).values('pk'))
+    if periodo:
+        cuotas = cuotas.filter(periodo=periodo)
+    if anio:
+        cuotas = cuotas.filter(fecha__year=anio)
+    if estado_pago:
+        cuotas = cuotas.filter(estado_pago=estado_pago)
+    periodos = dict(PeriodoCuota.choices)
+    filas = cuotas.order_by('pk').values_list(
+        'pk', 'importe', 'fecha', 'periodo', 'estado_pago', 'hermano__nombre', 'hermano__apellidos', 'hermano__dni',
+    )
+    for pk, importe, fecha, periodo_cuota, estado, nombre, apellidos, dni in filas.iterator(chunk_size=2000):
+        yield f'recibo_{pk}', {
+            'numero': str(pk), 'importe': f'{importe:.2f}', 'fecha': f'{fecha:%d/%m/%Y}',
+            'periodo': f'{periodos.get(periodo_cuota, periodo_cuota)} {fecha:%Y}', 'estado': estado,
+            'nombre': f'{nombre} {apellidos}', 'dni': dni,
+        }
+
+
+# Carnets de los hermanos activos, por número de antigüedad.
+def datos_carnets(user=None, admin=True, rol_id=None, busqueda=None, **filtros):
+    storage = Hermano._meta.get_field('imagen').storage
+    hermanos = fichas_queryset(user, admin, rol_id, busqueda).filter(estado=EstadoHermano.ACTIVO)
+    filas = hermanos.order_by('numero_antiguedad', 'pk').values_list(
+        'nombre', 'apellidos', 'dni', 'numero_antiguedad', 'fecha_ingreso', 'imagen',
+    )
+    for nombre, apellidos, dni, numero, ingreso, imagen in filas.iterator(chunk_size=2000):
+        ruta, huella = _foto(imagen, storage)
+        yield f'carnet_{dni}', {
+            'nombre': f'{nombre} {apellidos}', 'dni': dni, 'numero': str(numero or '-'),
+            'ingreso': f'{ingreso:%d/%m/%Y}', 'foto': ruta, 'huella_foto': huella,
+        }
+
+
+ORIGENES = {'recibos': datos_recibos, 'carnets': datos_carnets}
+
+
+def trozos_de(iterable, tamano):
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# (nombre, ruta del JPEG) de cada documento, en orden. Las páginas que no están
+# en la caché se dibujan en el pool por lotes; mientras el pool dibuja un lote
+# ya se está leyendo el siguiente de la base de datos.
+def paginas(tipo, estadisticas=None, usar_pool=True, **filtros):
+    estadisticas = estadisticas if estadisticas is not None else {}
+    estadisticas.setdefault('documentos', 0)
+    estadisticas.setdefault('dibujados', 0)
+    ejecutor = pool() if usar_pool else None
+    anterior = None
+    for lote in trozos_de(ORIGENES[tipo](**filtros), TAMANO_LOTE):
+        rutas = [(nombre, ruta_cache(tipo, nombre, datos), datos) for nombre, datos in lote]
+        tareas = [(tipo, nombre, datos, str(ruta)) for nombre, ruta, datos in rutas if not ruta.exists()]
+        estadisticas['documentos'] += len(rutas)
+        estadisticas['dibujados'] += len(tareas)
+        # Con un solo documento no compensa mandarlo a otro proceso
+        if ejecutor is None or len(tareas) < 2:
+            hechos = map(renderizar, tareas)
+        else:
+            trozo = max(1, len(tareas) // (4 * settings.LUMEN_DOCUMENTOS_TRABAJADORES))
+            hechos = ejecutor.map(renderizar, tareas, chunksize=trozo)
+        actual = (rutas, hechos)
+        if anterior:
+            yield from _terminar(*anterior)
+        anterior = actual
+    if anterior:
+        yield from _terminar(*anterior)
+
+
+def _terminar(rutas, hechos):
+    list(hechos)
+    for nombre, ruta, _ in rutas:
+        yield nombre, ruta
+
+
+# PDF mínimo con una página por JPEG, cada uno incrustado tal cual (DCTDecode):
+# no se vuelve a comprimir nada. Se genera por trozos de bytes; el objeto Pages,
+# que necesita la lista de páginas, va al final y la tabla xref detrás.
+def pdf(rutas, tipo):
+    ancho_mm, alto_mm = DOCUMENTOS[tipo]['mm']
+    ancho, alto = ancho_mm * 72 / 25.4, alto_mm * 72 / 25.4
+    w, h = DOCUMENTOS[tipo]['px']
+    posiciones = {}
+    escrito = 0
+
+    def objeto(numero, cuerpo, flujo=None):
+        nonlocal escrito
+        posiciones[numero] = escrito
+        trozo = f'{numero} 0 obj\n{cuerpo}\n'.encode()
+        if flujo is not None:
+            trozo += b'stream\n' + flujo + b'\nendstream\n'
+        trozo += b'endobj\n'
+        escrito += len(trozo)
+        return trozo
+
+    cabecera = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    escrito = len(cabecera)
+    yield cabecera
+    yield objeto(1, '<< /Type /Catalog /Pages 2 0 R >>')
+    hojas = []
+    numero = 3
+    for ruta in rutas:
+        with open(ruta, 'rb') as fichero:
+            jpeg = fichero.read()
+        yield objeto(numero, (
+            f'<< /Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace /DeviceRGB '
+            f'/BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>'
+        ), jpeg)
+        contenido = f'q {ancho:.2f} 0 0 {alto:.2f} 0 0 cm /Im0 Do Q'.encode()
+        yield objeto(numero + 1, f'<< /Length {len(contenido)} >>', contenido)
+        yield objeto(numero + 2, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {ancho:.2f} {alto:.2f}] '
+            f'/Resources << /XObject << /Im0 {numero} 0 R >> >> /Contents {numero + 1} 0 R >>'
+        ))
+        hojas.append(numero + 2)
+        numero += 3
+    yield objeto(2, f"<< /Type /Pages /Kids [{' '.join(f'{hoja} 0 R' for hoja in hojas)}] /Count {len(hojas)} >>")
+
+    xref = [f'xref\n0 {numero}\n', '0000000000 65535 f \n']
+    xref += [f'{posiciones[n]:010d} 00000 n \n' for n in range(1, numero)]
+    xref.append(f'trailer\n<< /Size {numero} /Root 1 0 R >>\nstartxref\n{escrito}\n%%EOF\n')
+    yield ''.join(xref).encode()
+
+
+# Objeto con write() que guarda lo escrito hasta que se recoge, para que
+# zipfile genere el ZIP por trozos en vez de en un fichero.
+class Tuberia:
+    def __init__(self):
+        self.trozos = []
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def recoger(self):
+        datos = b''.join(self.trozos)
+        self.trozos = []
+        return datos
+
+
+# Un PDF de una página por documento dentro de un ZIP sin comprimir (los JPEG
+# ya lo están), generado a medida que llegan las páginas.
+def zip_documentos(paginas_tipo, tipo):
+    tuberia = Tuberia()
+    with zipfile.ZipFile(tuberia, 'w', zipfile.ZIP_STORED) as archivo:
+        for nombre, ruta in paginas_tipo:
+            with archivo.open(f'{nombre}.pdf', 'w') as destino:
+                for trozo in pdf([ruta], tipo):
+                    destino.write(trozo)
+            yield tuberia.recoger()
+    yield tuberia.recoger()
+
+
+# Bytes del PDF con todos los documentos o del ZIP con uno por documento.
+def generar_documentos(tipo, formato, estadisticas=None, usar_pool=True, **filtros):
+    generadas = paginas(tipo, estadisticas, usar_pool, **filtros)
+    if formato == 'zip':
+        return zip_documentos(generadas, tipo)
+    return pdf((ruta for _, ruta in generadas), tipo)
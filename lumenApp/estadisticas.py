@@ -0,0 +1,69 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import BalanceHermano, Culto, Cuota, EstadoHermano, EstadoPago, Hermano
+
+
+CLAVE_VERSION = 'estadisticas:version'
+TIEMPO_SNAPSHOT = 60 * 60 * 24
+
+
+# Si la caché pierde la versión se reinicia con la hora actual y no con 1,
+# para no volver a leer un snapshot antiguo que siga guardado.
+def version_actual():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+# Se llama desde las señales de Hermano, Cuota y Culto. Al cambiar la versión
+# el snapshot anterior deja de leerse y caduca solo.
+def invalidar_estadisticas():
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+
+
+# Todas las cifras del panel con agregación condicional: una consulta por tabla.
+def calcular_estadisticas():
+    hermanos = Hermano.objects.aggregate(
+        total_hermanos=Count('pk'),
+        hermanos_activos=Count('pk', filter=Q(estado=EstadoHermano.ACTIVO)),
+        hermanos_inactivos=Count('pk', filter=Q(estado=EstadoHermano.INACTIVO)),
+        hermanos_suspendidos=Count('pk', filter=Q(estado=EstadoHermano.SUSPENDIDO)),
+    )
+    cuotas = Cuota.objects.aggregate(
+        total_cuotas=Count('pk'),
+        importe_total=Sum('importe'),
+        importe_pagado=Sum('importe', filter=Q(estado_pago=EstadoPago.PAGADO)),
+        importe_pendiente=Sum('importe', filter=Q(estado_pago=EstadoPago.PENDIENTE)),
+    )
+    for clave in ('importe_total', 'importe_pagado', 'importe_pendiente'):
+        cuotas[clave] = cuotas[clave] or 0
+
+    return {
+        **hermanos,
+        **cuotas,
+        'total_cultos': Culto.objects.count(),
+        # Del balance mantenido de cada hermano, sin agrupar las cuotas
+        'hermanos_morosos': BalanceHermano.objects.filter(total_pendiente__gt=0).count(),
+        'generado': timezone.now(),
+    }
+
+
+# Snapshot de la versión actual; solo se recalcula si alguna escritura lo invalidó.
+def obtener_estadisticas():
+    version = version_actual()
+    clave = f'estadisticas:snapshot:{version}'
+    snapshot = cache.get(clave)
+    if snapshot is None:
+        snapshot = calcular_estadisticas()
+        snapshot['version'] = version
+        cache.set(clave, snapshot, TIEMPO_SNAPSHOT)
+    return snapshot
@@ -0,0 +1,113 @@
+import csv
+
+from .consultas import fichas_queryset, filtrar_cultos
+from .models import Cuota, HermanoRol, ParticipacionCulto
+from .morosidad import COLUMNAS_PERIODO, informe_morosidad
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl es opcional, solo hace falta para XLSX
+    Workbook = None
+
+
+# Filas que se piden a la base de datos de cada vez. Con values_list() e
+# iterator() nunca hay más de un trozo en memoria, sea cual sea el total.
+TAMANO_TROZO = 2000
+
+FORMATOS = ('csv', 'xlsx')
+
+
+# Cabecera y columnas de values_list() de cada exportación
+EXPORTACIONES = {
+    'hermanos': (
+        ['DNI', 'Nombre', 'Apellidos', 'Fecha de nacimiento', 'Fecha de ingreso', 'Estado',
+         'Cuotas', 'Total pagado', 'Total pendiente'],
+        ['dni', 'nombre', 'apellidos', 'fecha_nacimiento', 'fecha_ingreso', 'estado',
+         'balance__num_cuotas', 'balance__total_pagado', 'balance__total_pendiente'],
+    ),
+    'cuotas': (
+        ['DNI', 'Nombre', 'Apellidos', 'Fecha', 'Periodo', 'Importe', 'Estado de pago'],
+        ['hermano__dni', 'hermano__nombre', 'hermano__apellidos', 'fecha', 'periodo', 'importe', 'estado_pago'],
+    ),
+    'roles': (
+        ['DNI', 'Nombre', 'Apellidos', 'Rol', 'Fecha de inicio', 'Fecha de fin'],
+        ['hermano__dni', 'hermano__nombre', 'hermano__apellidos', 'rol__nombre', 'fecha_inicio', 'fecha_fin'],
+    ),
+    'morosidad': (
+        ['DNI', 'Nombre', 'Apellidos', 'Cuotas pendientes', 'Importe pendiente', 'Pendiente desde']
+        + [f'Pendientes {periodo}' for periodo in COLUMNAS_PERIODO],
+        ['hermano__dni', 'hermano__nombre', 'hermano__apellidos', 'pendientes', 'deuda', 'mas_antigua']
+        + list(COLUMNAS_PERIODO.values()),
+    ),
+    'participaciones': (
+        ['Culto', 'Tipo de culto', 'Fecha del culto', 'DNI', 'Nombre', 'Apellidos', 'Rol', 'Tramo'],
+        ['culto_id', 'culto__tipo__nombre', 'culto__fecha_inicio', 'hermano__dni', 'hermano__nombre',
+         'hermano__apellidos', 'rol__nombre', 'tramo'],
+    ),
+}
+
+
+def xlsx_disponible():
+    return Workbook is not None
+
+
+# Restringe a los hermanos de fichas_lista con los mismos filtros. Un administrador
+# sin filtros lo ve todo y no hace falta la subconsulta.
+def _de_fichas(queryset, user, admin, rol_id, busqueda):
+    if admin and not rol_id and not busqueda:
+        return queryset
+    return queryset.filter(hermano__in=fichas_queryset(user, admin, rol_id, busqueda).values('pk'))
+
+
+def queryset_exportacion(tipo, user=None, admin=True, rol_id=None, busqueda=None, tipo_culto=None, umbrales=None):
+    if tipo == 'morosidad':
+        # Ya viene agrupado por hermano: el nombre y el DNI se unen a esas filas
+        queryset = informe_morosidad(**(umbrales or {}))
+        if not admin or rol_id or busqueda:
+            queryset = queryset.filter(hermano__in=fichas_queryset(user, admin, rol_id, busqueda).values('pk'))
+        return queryset.order_by('hermano_id').values_list(*EXPORTACIONES[tipo][1])
+    if tipo == 'hermanos':
+        queryset = fichas_queryset(user, admin, rol_id, busqueda)
+    elif tipo == 'cuotas':
+        queryset = _de_fichas(Cuota.objects.all(), user, admin, rol_id, busqueda)
+    elif tipo == 'roles':
+        queryset = _de_fichas(HermanoRol.objects.all(), user, admin, rol_id, busqueda)
+    elif tipo == 'participaciones':
+        queryset = _de_fichas(ParticipacionCulto.objects.all(), user, admin, rol_id, busqueda)
+        if tipo_culto:
+            queryset = queryset.filter(culto__in=filtrar_cultos(tipo_culto).values('pk'))
+    else:
+        raise ValueError(f'Exportación desconocida: {tipo}')
+    return queryset.order_by('pk').values_list(*EXPORTACIONES[tipo][1])
+
+
+def filas(tipo, **filtros):
+    return queryset_exportacion(tipo, **filtros).iterator(chunk_size=TAMANO_TROZO)
+
+
+# Objeto con write() que devuelve lo escrito, para que csv.writer genere
+# las líneas una a una en vez de acumularlas en un buffer.
+class Eco:
+    def write(self, valor):
+        return valor
+
+
+# Líneas CSV con BOM y punto y coma, que es lo que espera Excel en español.
+def lineas_csv(tipo, **filtros):
+    escritor = csv.writer(Eco(), delimiter=';')
+    yield '\ufeff' + escritor.writerow(EXPORTACIONES[tipo][0])
+    for fila in filas(tipo, **filtros):
+        yield escritor.writerow(fila)
+
+
+# Escribe el XLSX en `destino` (ruta o fichero abierto en binario). En modo
+# write_only openpyxl vuelca cada fila a disco en vez de mantener la hoja en memoria.
+def escribir_xlsx(tipo, destino, **filtros):
+    if Workbook is None:
+        raise RuntimeError('La exportación a XLSX necesita openpyxl (pip install openpyxl).')
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(tipo.capitalize())
+    hoja.append(EXPORTACIONES[tipo][0])
+    for fila in filas(tipo, **filtros):
+        hoja.append(fila)
+    libro.save(destino)
@@ -1,11 +1,14 @@
 from datetime import __all__
 from django import forms
+from django.db import models
+from django.urls import reverse_lazy
+from .cortejo import capacidades_tramos
 from .models import *
 
 class HermanoForm(forms.ModelForm):
     class Meta:
         model = Hermano
-        fields = ['nombre', 'apellidos', 'dni', 'fecha_nacimiento', 'fecha_ingreso', 'estado', 'imagen']
+        fields = ['nombre', 'apellidos', 'dni', 'fecha_nacimiento', 'fecha_ingreso', 'estado', 'iban', 'imagen']
         widgets = {
             'fecha_nacimiento': forms.DateInput(attrs={'type': 'date'}),
             'fecha_ingreso': forms.DateInput(attrs={'type': 'date'}),
@@ -28,6 +31,10 @@ class HermanoForm(forms.ModelForm):
         if dni and len(dni) > 9:
             raise forms.ValidationError("El DNI no puede tener más de 9 caracteres.")
         return dni
+
+    # Se guarda sin espacios y en mayúsculas; el validador del modelo comprueba los dígitos de control
+    def clean_iban(self):
+        return ''.join(self.cleaned_data.get('iban', '').split()).upper()
         
 
 class AsignarRolForm(forms.ModelForm):
@@ -44,10 +51,50 @@ class CuotaForm(forms.ModelForm):
         model = Cuota
         fields = ['importe', 'periodo', 'estado_pago']
 
+class AutocompletarHermanosWidget(forms.HiddenInput):
+    # Guarda los pks elegidos separados por comas; el buscador se rellena por AJAX
+    template_name = 'lumenApp/widgets/autocompletar_hermanos.html'
+
+    def __init__(self, url='', attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['url'] = self.url
+        return context
+
+
+class SeleccionHermanos(models.TextChoices):
+    ACTIVOS = 'activos', 'Todos los hermanos activos'
+    ROL = 'rol', 'Por rol'
+    ESTADO = 'estado', 'Por estado'
+    INGRESO = 'ingreso', 'Por fecha de ingreso'
+    INDIVIDUAL = 'individual', 'Hermanos concretos'
+
+
 class CuotaMasivaForm(forms.Form):
-    hermanos = forms.ModelMultipleChoiceField(
-        queryset=Hermano.objects.all(),
-        widget=forms.CheckboxSelectMultiple,
+    seleccion = forms.ChoiceField(
+        choices=SeleccionHermanos.choices,
+        initial=SeleccionHermanos.ACTIVOS,
+        widget=forms.RadioSelect,
+        label="A quién se emite"
+    )
+    rol = forms.ModelChoiceField(queryset=Rol.objects.all(), required=False, label="Rol")
+    estado = forms.ChoiceField(choices=EstadoHermano.choices, required=False, label="Estado")
+    ingreso_desde = forms.DateField(
+        required=False,
+        label="Ingreso desde",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    ingreso_hasta = forms.DateField(
+        required=False,
+        label="Ingreso hasta",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    hermanos = forms.CharField(
+        required=False,
+        widget=AutocompletarHermanosWidget(url=reverse_lazy('hermanos_autocompletar')),
         label="Selecciona los hermanos"
     )
     importe = forms.DecimalField(
@@ -67,6 +114,76 @@ class CuotaMasivaForm(forms.Form):
         initial=EstadoPago.PENDIENTE
     )
 
+    def clean_hermanos(self):
+        valor = self.cleaned_data.get('hermanos') or ''
+        try:
+            return [int(pk) for pk in valor.split(',') if pk.strip()]
+        except ValueError:
+            raise forms.ValidationError("Selección de hermanos no válida.")
+
+    # Convierte la selección en un queryset sin evaluarlo; emitir_cuotas solo lee los pks.
+    def clean(self):
+        cleaned_data = super().clean()
+        seleccion = cleaned_data.get('seleccion')
+        hermanos = Hermano.objects.all()
+
+        if seleccion == SeleccionHermanos.ACTIVOS:
+            hermanos = hermanos.filter(estado=EstadoHermano.ACTIVO)
+        elif seleccion == SeleccionHermanos.ROL:
+            if not cleaned_data.get('rol'):
+                self.add_error('rol', "Elige un rol.")
+            hermanos = hermanos.filter(hermanorol__rol=cleaned_data.get('rol'))
+        elif seleccion == SeleccionHermanos.ESTADO:
+            if not cleaned_data.get('estado'):
+                self.add_error('estado', "Elige un estado.")
+            hermanos = hermanos.filter(estado=cleaned_data.get('estado'))
+        elif seleccion == SeleccionHermanos.INGRESO:
+            desde = cleaned_data.get('ingreso_desde')
+            hasta = cleaned_data.get('ingreso_hasta')
+            if not desde and not hasta:
+                self.add_error('ingreso_desde', "Indica al menos una fecha.")
+            if desde:
+                hermanos = hermanos.filter(fecha_ingreso__gte=desde)
+            if hasta:
+                hermanos = hermanos.filter(fecha_ingreso__lte=hasta)
+        elif seleccion == SeleccionHermanos.INDIVIDUAL:
+            pks = cleaned_data.get('hermanos')
+            if pks is not None and not pks:
+                self.add_error('hermanos', "Selecciona al menos un hermano.")
+            hermanos = hermanos.filter(pk__in=pks or [])
+
+        cleaned_data['hermanos'] = hermanos
+        return cleaned_data
+
+class CortejoForm(forms.Form):
+    roles = forms.ModelMultipleChoiceField(
+        queryset=Rol.objects.all(),
+        widget=forms.CheckboxSelectMultiple,
+        label="Roles que forman el cortejo"
+    )
+    capacidades = forms.CharField(
+        initial='100',
+        label="Hermanos por tramo",
+        help_text="Un número para todos los tramos o uno por tramo separados por comas (el último se repite)."
+    )
+    tramo_inicial = forms.IntegerField(min_value=1, initial=1, label="Primer tramo")
+    max_tramos = forms.IntegerField(min_value=1, required=False, label="Número máximo de tramos")
+    antiguos_primero = forms.BooleanField(
+        required=False,
+        initial=True,
+        label="Los más antiguos en los primeros tramos"
+    )
+    quitar_sobrantes = forms.BooleanField(
+        required=False,
+        label="Quitar a los que ya no cumplen los requisitos"
+    )
+
+    def clean_capacidades(self):
+        try:
+            return capacidades_tramos(self.cleaned_data['capacidades'])
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
+
 class CultoForm(forms.ModelForm):
     class Meta:
         model = Culto
@@ -102,12 +219,22 @@ class RegistroHermanoForm(forms.ModelForm):
         if password and password2 and password != password2:
             raise ValidationError("Las contraseñas no coinciden.")
 
+        # Las fichas importadas sin contraseña se activan registrándose con el
+        # mismo DNI y fecha de nacimiento
+        self.hermano_activable = None
         if dni and User.objects.filter(username=dni).exists():
-            raise ValidationError("Ya existe un usuario con este DNI.")
+            hermano = Hermano.objects.select_related('usuario').filter(dni=dni).first()
+            if (hermano and not hermano.usuario.has_usable_password()
+                    and hermano.fecha_nacimiento == cleaned_data.get("fecha_nacimiento")):
+                self.hermano_activable = hermano
+            else:
+                raise ValidationError("Ya existe un usuario con este DNI.")
 
         fecha_nacimiento = cleaned_data.get("fecha_nacimiento")
 
         if fecha_nacimiento and fecha_nacimiento > date.today():
             self.add_error('fecha_nacimiento', "La fecha de nacimiento no puede ser futura.")
 
-       
\ No newline at end of file
+    def validate_unique(self):
+        if not getattr(self, 'hermano_activable', None):
+            super().validate_unique()
@@ -0,0 +1,147 @@
+import time
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+
+# Caché del contenido ya renderizado de las páginas de detalle. Cada hermano y
+# cada culto tiene su versión en la caché y las señales la cambian al guardar
+# algo que la página muestra; las claves incluyen la versión, así que lo
+# anterior deja de leerse y caduca solo. En un acierto la vista no consulta la
+# base de datos ni renderiza la plantilla de la página, solo base.html.
+TIEMPO_FRAGMENTO = 60 * 60 * 24
+
+# Versión común a todos los fragmentos, para cambios que afectan a muchos a la
+# vez (nombres de roles, emisiones y reimportaciones en bloque)
+CLAVE_GLOBAL = 'fragmentos:version'
+
+VISTAS = ('ficha_detalle', 'cuotas_lista', 'culto_detalle')
+
+
+def _clave_version(tipo, pk):
+    return f'{CLAVE_GLOBAL}:{tipo}:{pk}'
+
+
+def _clave_contador(vista, acierto):
+    return f"fragmentos:{'aciertos' if acierto else 'fallos'}:{vista}"
+
+
+def _clave(vista, pk, versiones, partes):
+    return ':'.join(str(parte) for parte in ('fragmentos', vista, pk, *versiones, *partes))
+
+
+# Como version_actual() de estadisticas.py: las que falten se reinician con la
+# hora actual para no volver a leer fragmentos antiguos que sigan guardados.
+def _versiones(claves):
+    versiones = cache.get_many(claves)
+    faltan = [clave for clave in claves if clave not in versiones]
+    if faltan:
+        for clave in faltan:
+            cache.add(clave, time.time_ns(), None)
+        versiones.update(cache.get_many(faltan))
+    return [versiones[clave] for clave in claves]
+
+
+async def _aversiones(claves):
+    versiones = await cache.aget_many(claves)
+    faltan = [clave for clave in claves if clave not in versiones]
+    if faltan:
+        for clave in faltan:
+            await cache.aadd(clave, time.time_ns(), None)
+        versiones.update(await cache.aget_many(faltan))
+    return [versiones[clave] for clave in claves]
+
+
+def _subir_version(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.add(clave, time.time_ns(), None)
+
+
+# `partes` son lo que cambia el HTML para un mismo objeto (es_admin, página...).
+def clave_fragmento(vista, tipo, pk, *partes):
+    return _clave(vista, pk, _versiones([CLAVE_GLOBAL, _clave_version(tipo, pk)]), partes)
+
+
+async def aclave_fragmento(vista, tipo, pk, *partes):
+    return _clave(vista, pk, await _aversiones([CLAVE_GLOBAL, _clave_version(tipo, pk)]), partes)
+
+
+def _contar(vista, acierto):
+    clave = _clave_contador(vista, acierto)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.add(clave, 1, None)
+
+
+async def _acontar(vista, acierto):
+    clave = _clave_contador(vista, acierto)
+    try:
+        await cache.aincr(clave)
+    except ValueError:
+        await cache.aadd(clave, 1, None)
+
+
+def leer_fragmento(vista, clave):
+    fragmento = cache.get(clave)
+    _contar(vista, fragmento is not None)
+    return fragmento
+
+
+async def aleer_fragmento(vista, clave):
+    fragmento = await cache.aget(clave)
+    await _acontar(vista, fragmento is not None)
+    return fragmento
+
+
+# Lo que se guarda: el HTML del bloque content, el título de la página y el
+# usuario dueño de la ficha, para comprobar el permiso sin ir a la base de datos.
+def crear_fragmento(request, plantilla, context, titulo, propietario=None):
+    return {
+        'titulo': titulo,
+        'propietario': propietario,
+        'contenido': render_to_string(plantilla, context, request),
+    }
+
+
+def guardar_fragmento(clave, fragmento):
+    cache.set(clave, fragmento, TIEMPO_FRAGMENTO)
+
+
+async def aguardar_fragmento(clave, fragmento):
+    await cache.aset(clave, fragmento, TIEMPO_FRAGMENTO)
+
+
+# Sin tipo se invalidan todos los fragmentos.
+def invalidar_fragmentos(tipo=None, pks=()):
+    if tipo is None:
+        _subir_version(CLAVE_GLOBAL)
+        return
+    for pk in set(pks):
+        _subir_version(_clave_version(tipo, pk))
+
+
+# Versiones con las que se calcula ahora la clave de un objeto. Otras cachés
+# en memoria (el mapa de asistencia de un culto) las guardan para saber si
+# siguen valiendo sin consultar la base de datos.
+def version_fragmentos(tipo, pk):
+    return tuple(_versiones([CLAVE_GLOBAL, _clave_version(tipo, pk)]))
+
+
+# {vista: {'aciertos': n, 'fallos': m, 'ratio': aciertos / total}}
+def estadisticas_fragmentos():
+    claves = {(vista, acierto): _clave_contador(vista, acierto) for vista in VISTAS for acierto in (True, False)}
+    contadores = cache.get_many(claves.values())
+    resultado = {}
+    for vista in VISTAS:
+        aciertos = contadores.get(claves[vista, True], 0)
+        fallos = contadores.get(claves[vista, False], 0)
+        total = aciertos + fallos
+        resultado[vista] = {'aciertos': aciertos, 'fallos': fallos, 'ratio': aciertos / total if total else 0}
+    return resultado
+
+
+def reiniciar_estadisticas_fragmentos():
+    cache.delete_many([_clave_contador(vista, acierto) for vista in VISTAS for acierto in (True, False)])
@@ -0,0 +1,132 @@
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+logger = logging.getLogger(__name__)
+
+# Lado máximo del original que se guarda; las fotos de móvil suelen pasar de 4000px
+LADO_MAXIMO_ORIGINAL = 1600
+
+# Tamaños fijos de cada hueco de las plantillas: (ancho, alto, recortar).
+# Las que se recortan llenan el hueco entero, "detail" conserva la proporción.
+RENDICIONES = {
+    'thumb': (64, 64, True),
+    'card': (240, 240, True),
+    'detail': (600, 600, False),
+}
+
+# WebP para los navegadores que lo soportan y JPEG como alternativa
+FORMATOS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+FORMATOS_ORIGINAL = {
+    'JPEG': {'quality': 88, 'optimize': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 88},
+}
+
+
+# hermanos/foto.jpg -> hermanos/foto.jpg.thumb.webp, junto al original. Se
+# mantiene la extensión para que foto.jpg y foto.png no compartan rendiciones.
+def ruta_rendicion(nombre, rendicion, formato):
+    return f'{nombre}.{rendicion}.{formato}'
+
+
+# Devuelve la imagen ya girada según su orientación EXIF y el formato original
+def _abrir(fichero):
+    fichero.seek(0)
+    imagen = Image.open(fichero)
+    imagen.load()
+    return ImageOps.exif_transpose(imagen), imagen.format
+
+
+# RGB para JPEG y PDF; la transparencia se aplana sobre fondo blanco.
+def en_rgb(imagen):
+    if imagen.mode in ('RGB', 'L'):
+        return imagen
+    if imagen.mode in ('RGBA', 'LA', 'P'):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        return fondo
+    return imagen.convert('RGB')
+
+
+# Reduce una subida recién recibida a LADO_MAXIMO_ORIGINAL y la vuelve a guardar
+# sin EXIF (ubicación GPS, modelo del móvil...). Devuelve un ContentFile con el
+# mismo nombre, o None si el fichero no es una imagen que Pillow sepa leer.
+def preparar_original(fichero):
+    try:
+        imagen, formato = _abrir(fichero)
+    except (UnidentifiedImageError, OSError):
+        logger.warning('No se pudo procesar la imagen %s', getattr(fichero, 'name', fichero))
+        return None
+
+    if formato not in FORMATOS_ORIGINAL:
+        formato = 'JPEG'
+    imagen.thumbnail((LADO_MAXIMO_ORIGINAL, LADO_MAXIMO_ORIGINAL), Image.Resampling.LANCZOS)
+    if formato == 'JPEG':
+        imagen = en_rgb(imagen)
+
+    salida = BytesIO()
+    # Sin pasar exif= Pillow no copia los metadatos al nuevo fichero
+    imagen.save(salida, formato, **FORMATOS_ORIGINAL[formato])
+    return ContentFile(salida.getvalue(), name=posixpath.basename(fichero.name))
+
+
+def _redimensionar(imagen, ancho, alto, recortar):
+    if recortar:
+        return ImageOps.fit(imagen, (ancho, alto), Image.Resampling.LANCZOS)
+    copia = imagen.copy()
+    copia.thumbnail((ancho, alto), Image.Resampling.LANCZOS)
+    return copia
+
+
+# Genera todas las rendiciones de un ImageFieldFile ya guardado, sustituyendo las
+# que hubiera. Devuelve las rutas generadas.
+def generar_rendiciones(campo):
+    storage = campo.storage
+    with storage.open(campo.name, 'rb') as fichero:
+        imagen = en_rgb(_abrir(fichero)[0])
+
+    rutas = []
+    for rendicion, (ancho, alto, recortar) in RENDICIONES.items():
+        reducida = _redimensionar(imagen, ancho, alto, recortar)
+        for formato, opciones in FORMATOS.items():
+            ruta = ruta_rendicion(campo.name, rendicion, formato)
+            salida = BytesIO()
+            reducida.save(salida, **opciones)
+            # El storage añade un sufijo si el nombre existe; se borra antes para sobrescribir
+            storage.delete(ruta)
+            storage.save(ruta, ContentFile(salida.getvalue()))
+            rutas.append(ruta)
+    return rutas
+
+
+def borrar_rendiciones(storage, nombre):
+    for rendicion in RENDICIONES:
+        for formato in FORMATOS:
+            storage.delete(ruta_rendicion(nombre, rendicion, formato))
+
+
+# URL de una rendición. Si todavía no existe (imágenes anteriores al proceso o
+# generación fallida) se genera en el momento; si tampoco se puede, se sirve el
+# original para no dejar el hueco vacío.
+def url_rendicion(campo, rendicion, formato='webp'):
+    if not campo:
+        return None
+    ruta = ruta_rendicion(campo.name, rendicion, formato)
+    storage = campo.storage
+    if not storage.exists(ruta):
+        try:
+            generar_rendiciones(campo)
+        except (UnidentifiedImageError, OSError):
+            logger.warning('No se pudieron generar las rendiciones de %s', campo.name)
+            return campo.url
+    return storage.url(ruta)
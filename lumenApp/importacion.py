@@ -0,0 +1,167 @@
+import csv
+from dataclasses import dataclass, field
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import models, transaction
+
+from .antiguedad import reconstruir_antiguedad
+from .balances import asegurar_balances
+from .contrasenas import hashear_varias
+from .estadisticas import invalidar_estadisticas
+from .fragmentos import invalidar_fragmentos
+from .forms import HermanoForm
+from .models import EstadoHermano, Hermano
+
+
+TAMANO_LOTE = 1000
+
+COLUMNAS = ['dni', 'nombre', 'apellidos', 'fecha_nacimiento', 'fecha_ingreso', 'estado']
+CAMPOS_ACTUALIZABLES = ['nombre', 'apellidos', 'fecha_nacimiento', 'fecha_ingreso', 'estado']
+
+# En el CSV se aceptan fechas ISO y a la española (día primero)
+FORMATOS_FECHA = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']
+
+
+class ContrasenaImportacion(models.TextChoices):
+    # Igual que FichaCreateView: la contraseña inicial es el DNI. Hay que calcular
+    # un hash por hermano y es lo que más tarda; se reparte en el pool de contrasenas.py.
+    DNI = 'dni', 'DNI como contraseña inicial'
+    # Sin contraseña utilizable: el hermano activa la cuenta al registrarse con su
+    # DNI y fecha de nacimiento (ver RegistroHermanoForm). La importación no hashea nada.
+    ACTIVACION = 'activacion', 'Activación en el registro'
+
+
+# Las reglas de HermanoForm sin la comprobación de DNI único: si el DNI existe
+# se actualiza el hermano en vez de rechazar la fila.
+class HermanoImportacionForm(HermanoForm):
+    class Meta(HermanoForm.Meta):
+        fields = COLUMNAS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for nombre in ('fecha_nacimiento', 'fecha_ingreso'):
+            self.fields[nombre].input_formats = FORMATOS_FECHA
+
+    def validate_unique(self):
+        pass
+
+
+@dataclass
+class ResultadoImportacion:
+    creados: int = 0
+    actualizados: int = 0
+    sin_cambios: int = 0
+    # (línea del CSV, DNI, errores del formulario)
+    errores: list = field(default_factory=list)
+
+    def mensajes_error(self):
+        for linea, dni, errores in self.errores:
+            detalle = '; '.join(f"{campo}: {error['message']}" for campo, lista in errores.items() for error in lista)
+            yield f"Línea {linea or '-'} ({dni or 'sin DNI'}): {detalle}"
+
+
+# Lee el CSV fila a fila (acepta coma o punto y coma) y devuelve lotes de
+# (línea, fila) sin cargar el fichero entero.
+def lotes_csv(fichero, tamano=TAMANO_LOTE):
+    muestra = fichero.readline()
+    separador = ';' if muestra.count(';') > muestra.count(',') else ','
+    cabecera = [columna.strip().lower() for columna in next(csv.reader([muestra], delimiter=separador))]
+    faltan = [columna for columna in COLUMNAS if columna != 'estado' and columna not in cabecera]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+
+    lote = []
+    for linea, valores in enumerate(csv.reader(fichero, delimiter=separador), start=2):
+        if not any(valores):
+            continue
+        lote.append((linea, dict(zip(cabecera, (valor.strip() for valor in valores)))))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _validar(lote, resultado):
+    validos = {}
+    for linea, fila in lote:
+        fila.setdefault('estado', EstadoHermano.ACTIVO)
+        fila['estado'] = fila['estado'] or EstadoHermano.ACTIVO
+        form = HermanoImportacionForm(fila)
+        if form.is_valid():
+            # Si un DNI se repite en el fichero gana la última fila
+            validos[form.cleaned_data['dni']] = form.cleaned_data
+        else:
+            resultado.errores.append((linea, fila.get('dni', ''), form.errors.get_json_data()))
+    return validos
+
+
+# Crea o actualiza por DNI los hermanos de un lote, con sus usuarios, en una
+# transacción: un SELECT de existentes, un bulk_create de usuarios y otro de
+# hermanos, y un bulk_update para los que ya estaban. Los hashes se calculan
+# antes de abrirla para no tener la base de datos bloqueada mientras tanto.
+def _guardar_lote(validos, modo, resultado):
+    sin_usuario = set(validos) - set(User.objects.filter(username__in=list(validos)).values_list('username', flat=True))
+    if modo == ContrasenaImportacion.DNI:
+        contrasenas = dict(zip(sin_usuario, hashear_varias(sin_usuario)))
+    else:
+        inutilizable = make_password(None)
+        contrasenas = {dni: inutilizable for dni in sin_usuario}
+
+    with transaction.atomic():
+        existentes = Hermano.objects.filter(dni__in=list(validos)).in_bulk(field_name='dni')
+        # Solo se reescriben los que cambian: en una reimportación casi todos son iguales
+        # y bulk_update es caro (un CASE por campo y fila)
+        cambiados = []
+        for dni, hermano in existentes.items():
+            datos = validos[dni]
+            if any(getattr(hermano, campo) != datos[campo] for campo in CAMPOS_ACTUALIZABLES):
+                for campo in CAMPOS_ACTUALIZABLES:
+                    setattr(hermano, campo, datos[campo])
+                cambiados.append(hermano)
+        Hermano.objects.bulk_update(cambiados, CAMPOS_ACTUALIZABLES, batch_size=200)
+
+        nuevos = [dni for dni in validos if dni not in existentes]
+        # Un usuario con ese DNI que ya es de otra ficha no se puede reutilizar
+        ocupados = set(User.objects.filter(username__in=nuevos, hermano__isnull=False).values_list('username', flat=True))
+        for dni in ocupados:
+            resultado.errores.append((None, dni, {'dni': [{'message': 'El usuario con este DNI pertenece a otra ficha.'}]}))
+        nuevos = [dni for dni in nuevos if dni not in ocupados]
+        if nuevos:
+            # Puede haber usuarios sin ficha con ese DNI (registros a medias): se reutilizan
+            usuarios = dict(User.objects.filter(username__in=nuevos).values_list('username', 'pk'))
+            faltan = [dni for dni in nuevos if dni not in usuarios]
+            User.objects.bulk_create(
+                [User(username=dni, password=contrasenas.get(dni) or make_password(None)) for dni in faltan],
+                batch_size=TAMANO_LOTE,
+            )
+            # bulk_create no devuelve los pks en MySQL: se vuelven a leer por username
+            usuarios.update(User.objects.filter(username__in=faltan).values_list('username', 'pk'))
+
+            Hermano.objects.bulk_create(
+                [Hermano(usuario_id=usuarios[dni], **validos[dni]) for dni in nuevos],
+                batch_size=TAMANO_LOTE,
+            )
+            # bulk_create no lanza señales: el balance de los nuevos se crea aquí
+            asegurar_balances(Hermano.objects.filter(dni__in=nuevos).values_list('pk', flat=True))
+
+        transaction.on_commit(invalidar_estadisticas)
+        if cambiados:
+            transaction.on_commit(invalidar_fragmentos)
+
+    resultado.creados += len(nuevos)
+    resultado.actualizados += len(cambiados)
+    resultado.sin_cambios += len(existentes) - len(cambiados)
+
+
+def importar_hermanos(fichero, modo=ContrasenaImportacion.ACTIVACION, tamano_lote=TAMANO_LOTE):
+    resultado = ResultadoImportacion()
+    for lote in lotes_csv(fichero, tamano_lote):
+        validos = _validar(lote, resultado)
+        if validos:
+            _guardar_lote(validos, modo, resultado)
+    # Los números de antigüedad se recalculan una vez al final y no por lote
+    if resultado.creados or resultado.actualizados:
+        reconstruir_antiguedad()
+    return resultado
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.antiguedad import reconstruir_antiguedad, verificar_antiguedad
+
+
+class Command(BaseCommand):
+    help = 'Verifica los números de antigüedad de los hermanos activos, o los reconstruye'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true', help='Recalcular todos los números por fecha de ingreso y DNI')
+
+    def handle(self, *args, **options):
+        if options['reconstruir']:
+            total = reconstruir_antiguedad()
+            self.stdout.write(self.style.SUCCESS(f'Números de antigüedad corregidos: {total}.'))
+            return
+
+        diferencias = verificar_antiguedad()
+        for hermano_id, guardado, esperado in diferencias[:50]:
+            self.stdout.write(f'Hermano {hermano_id}: guardado {guardado}, esperado {esperado}')
+        if diferencias:
+            raise CommandError(f'{len(diferencias)} número(s) no cuadran. Ejecuta "antiguedad --reconstruir".')
+        self.stdout.write(self.style.SUCCESS('Todos los números de antigüedad son correctos.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.balances import recalcular_balances, verificar_balances
+from lumenApp.fragmentos import invalidar_fragmentos
+
+
+class Command(BaseCommand):
+    help = 'Verifica los balances de cuotas de los hermanos contra las cuotas, o los reconstruye'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true', help='Recalcular todos los balances desde las cuotas')
+
+    def handle(self, *args, **options):
+        if options['reconstruir']:
+            total = recalcular_balances()
+            # Los totales de cuotas_lista salen del balance
+            invalidar_fragmentos()
+            self.stdout.write(self.style.SUCCESS(f'Balances reconstruidos: {total}.'))
+            return
+
+        diferencias = verificar_balances()
+        for hermano_id, guardado, esperado in diferencias[:50]:
+            self.stdout.write(f'Hermano {hermano_id}: guardado {guardado}, esperado {esperado}')
+        if diferencias:
+            raise CommandError(f'{len(diferencias)} balance(s) no cuadran. Ejecuta "balances --reconstruir".')
+        self.stdout.write(self.style.SUCCESS('Todos los balances cuadran con las cuotas.'))
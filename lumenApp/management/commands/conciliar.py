@@ -0,0 +1,40 @@
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.conciliacion import TAMANO_LOTE, conciliar, escribir_sin_conciliar
+
+
+class Command(BaseCommand):
+    help = ('Concilia extractos bancarios (Norma 43 o camt.053) con las cuotas pendientes: cada abono se empareja '
+            'por DNI o referencia de cuota (CUOTA<id>) e importe, y las cuotas emparejadas pasan a pagadas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ficheros', nargs='+', help='Extractos en Norma 43 o camt.053, en orden cronológico')
+        parser.add_argument('--sin-conciliar', help='CSV donde escribir los abonos que no se han podido conciliar')
+        parser.add_argument('--simular', action='store_true', help='Solo informar, sin marcar cuotas como pagadas')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Cuotas por UPDATE')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pila:
+                extractos = [(Path(ruta).name, pila.enter_context(open(ruta, 'rb'))) for ruta in options['ficheros']]
+                resultado = conciliar(extractos, aplicar=not options['simular'], tamano_lote=options['lote'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        segundos = time.perf_counter() - inicio
+
+        if options['sin_conciliar']:
+            with open(options['sin_conciliar'], 'w', encoding='utf-8-sig', newline='') as destino:
+                escribir_sin_conciliar(resultado, destino)
+
+        verbo = 'se marcarían' if options['simular'] else 'marcadas'
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.movimientos} movimientos ({resultado.cargos} cargos) en {segundos:.1f} s: '
+            f'{resultado.conciliados} abonos conciliados por {resultado.importe_conciliado} €, '
+            f'{resultado.cuotas_pagadas} cuotas {verbo} como pagadas; '
+            f'{len(resultado.sin_conciliar)} abonos sin conciliar.'
+        ))
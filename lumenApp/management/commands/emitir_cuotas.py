@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.cuotas import emitir_cuotas
+from lumenApp.models import EstadoHermano, EstadoPago, Hermano, PeriodoCuota
+
+
+class Command(BaseCommand):
+    help = 'Emite una cuota del período indicado a los hermanos (por defecto, a los activos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--importe', required=True)
+        parser.add_argument('--periodo', required=True, choices=PeriodoCuota.values)
+        parser.add_argument('--estado-pago', default=EstadoPago.PENDIENTE, choices=EstadoPago.values)
+        parser.add_argument('--estado', default=EstadoHermano.ACTIVO, choices=EstadoHermano.values,
+                            help='Estado de los hermanos a los que se emite la cuota')
+        parser.add_argument('--todos', action='store_true', help='Emitir a todos los hermanos sin mirar su estado')
+
+    def handle(self, *args, **options):
+        hermanos = Hermano.objects.all()
+        if not options['todos']:
+            hermanos = hermanos.filter(estado=options['estado'])
+
+        try:
+            resumen = emitir_cuotas(hermanos, options['importe'], options['periodo'], options['estado_pago'])
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Cuotas creadas: {resumen['creadas']}. Omitidas por existir ya: {resumen['omitidas']}."
+        ))
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.exportacion import EXPORTACIONES, FORMATOS, escribir_xlsx, lineas_csv, xlsx_disponible
+from lumenApp.morosidad import umbrales_morosidad
+
+
+class Command(BaseCommand):
+    help = ('Exporta hermanos, cuotas, roles, participaciones o morosidad en CSV o XLSX con los mismos filtros '
+            'que fichas_lista, cultos_lista y el informe de morosidad, leyendo por trozos para no cargar todo en memoria.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(EXPORTACIONES))
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--salida', help='Fichero de salida (por defecto la salida estándar, solo CSV)')
+        parser.add_argument('--rol', type=int, help='Solo hermanos con este rol')
+        parser.add_argument('--busqueda', help='Texto como en el buscador de fichas_lista')
+        parser.add_argument('--tipo-culto', type=int, help='Solo participaciones en cultos de este tipo')
+        parser.add_argument('--min-cuotas', help='Morosidad: al menos este número de cuotas pendientes')
+        parser.add_argument('--min-deuda', help='Morosidad: al menos este importe pendiente')
+        parser.add_argument('--dias', help='Morosidad: con alguna cuota pendiente desde hace más de estos días')
+        parser.add_argument('--periodo', help='Morosidad: solo las cuotas de este período')
+
+    def handle(self, *args, **options):
+        tipo = options['tipo']
+        filtros = {
+            'rol_id': options['rol'],
+            'busqueda': options['busqueda'],
+            'tipo_culto': options['tipo_culto'],
+            'umbrales': umbrales_morosidad(options),
+        }
+
+        if options['formato'] == 'xlsx':
+            if not options['salida']:
+                raise CommandError('La exportación a XLSX necesita --salida.')
+            if not xlsx_disponible():
+                raise CommandError('La exportación a XLSX necesita openpyxl (pip install openpyxl).')
+            escribir_xlsx(tipo, options['salida'], **filtros)
+            return
+
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8', newline='') as salida:
+                salida.writelines(lineas_csv(tipo, **filtros))
+        else:
+            sys.stdout.writelines(lineas_csv(tipo, **filtros))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lumenApp.fragmentos import estadisticas_fragmentos, invalidar_fragmentos, reiniciar_estadisticas_fragmentos
+
+
+class Command(BaseCommand):
+    help = 'Muestra los aciertos y fallos de la caché de fragmentos de las páginas de detalle'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true', help='Poner los contadores a cero después de mostrarlos')
+        parser.add_argument('--invalidar', action='store_true', help='Invalidar todos los fragmentos guardados')
+
+    def handle(self, *args, **options):
+        # Con locmem cada proceso tiene su caché y aquí solo se ven los contadores de este
+        if settings.LUMEN_CACHE == 'locmem':
+            self.stderr.write('LUMEN_CACHE=locmem: los contadores de los workers no son visibles desde este proceso.')
+
+        self.stdout.write(f"{'vista':<16}{'aciertos':>10}{'fallos':>10}{'ratio':>8}")
+        for vista, datos in estadisticas_fragmentos().items():
+            self.stdout.write(f"{vista:<16}{datos['aciertos']:>10}{datos['fallos']:>10}{datos['ratio']:>8.1%}")
+
+        if options['reiniciar']:
+            reiniciar_estadisticas_fragmentos()
+            self.stdout.write('Contadores reiniciados.')
+        if options['invalidar']:
+            invalidar_fragmentos()
+            self.stdout.write(self.style.SUCCESS('Fragmentos invalidados.'))
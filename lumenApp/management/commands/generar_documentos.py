@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.documentos import DOCUMENTOS, FORMATOS, cerrar_pool, generar_documentos, pool, vaciar_cache
+from lumenApp.models import EstadoPago, PeriodoCuota
+
+
+class Command(BaseCommand):
+    help = ('Genera en lote los recibos de cuotas o los carnets de los hermanos activos, en un PDF o en un ZIP '
+            'con un PDF por documento. Las páginas se dibujan en un pool de procesos y se reutilizan de la caché '
+            '(LUMEN_DOCUMENTOS_RUTA) si no han cambiado.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=list(DOCUMENTOS))
+        parser.add_argument('--formato', choices=FORMATOS, default='pdf')
+        parser.add_argument('--salida', help='Fichero de salida (por defecto <tipo>.<formato>)')
+        parser.add_argument('--periodo', choices=PeriodoCuota.values, help='Solo recibos de este período')
+        parser.add_argument('--anio', type=int, help='Solo recibos de este año')
+        parser.add_argument('--estado', choices=EstadoPago.values, help='Solo recibos en este estado')
+        parser.add_argument('--trabajadores', type=int, help='Procesos del pool (0 para no usar pool)')
+        parser.add_argument('--vaciar-cache', action='store_true', help='Borrar antes las páginas guardadas')
+
+    def handle(self, *args, **options):
+        tipo, formato = options['tipo'], options['formato']
+        salida = options['salida'] or f'{tipo}.{formato}'
+        filtros = {}
+        if tipo == 'recibos':
+            filtros = {'periodo': options['periodo'], 'anio': options['anio'], 'estado_pago': options['estado']}
+
+        trabajadores = options['trabajadores']
+        if trabajadores is not None and trabajadores < 0:
+            raise CommandError('--trabajadores no puede ser negativo.')
+
+        if options['vaciar_cache']:
+            self.stdout.write(f'{vaciar_cache()} páginas borradas de la caché.')
+
+        estadisticas = {}
+        inicio = time.perf_counter()
+        try:
+            if trabajadores:
+                cerrar_pool()
+                pool(trabajadores)
+            with open(salida, 'wb') as destino:
+                for trozo in generar_documentos(tipo, formato, estadisticas, usar_pool=trabajadores != 0, **filtros):
+                    destino.write(trozo)
+        except OSError as e:
+            raise CommandError(str(e))
+        finally:
+            cerrar_pool()
+        segundos = time.perf_counter() - inicio
+
+        documentos = estadisticas.get('documentos', 0)
+        dibujados = estadisticas.get('dibujados', 0)
+        self.stdout.write(self.style.SUCCESS(
+            f'{salida}: {documentos} documentos en {segundos:.1f} s ({documentos / max(segundos, 1e-6):.0f}/s); '
+            f'{dibujados} dibujados, {documentos - dibujados} de la caché.'
+        ))
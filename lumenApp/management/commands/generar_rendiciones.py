@@ -0,0 +1,48 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from lumenApp.imagenes import FORMATOS, RENDICIONES, generar_rendiciones, preparar_original, ruta_rendicion
+from lumenApp.models import Hermano
+
+
+class Command(BaseCommand):
+    help = ('Genera las rendiciones (thumb, card, detail) de las imágenes de hermanos que no las tengan. '
+            'Con --reducir-originales también reduce y limpia de EXIF los originales subidos antes del proceso.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true', help='Regenerar aunque ya existan')
+        parser.add_argument('--reducir-originales', action='store_true',
+                            help='Reescribir los originales reducidos y sin EXIF')
+
+    def handle(self, *args, **options):
+        generadas = omitidas = fallidas = 0
+        hermanos = Hermano.objects.exclude(imagen='').exclude(imagen__isnull=True).only('pk', 'imagen')
+
+        for hermano in hermanos.iterator(chunk_size=500):
+            campo = hermano.imagen
+            storage = campo.storage
+            try:
+                if options['reducir_originales']:
+                    with storage.open(campo.name, 'rb') as fichero:
+                        preparada = preparar_original(fichero)
+                    if preparada is not None:
+                        # Mismo nombre: las rutas guardadas en la base de datos no cambian
+                        storage.delete(campo.name)
+                        storage.save(campo.name, ContentFile(preparada.read()))
+
+                completas = all(
+                    storage.exists(ruta_rendicion(campo.name, rendicion, formato))
+                    for rendicion in RENDICIONES for formato in FORMATOS
+                )
+                if completas and not options['forzar'] and not options['reducir_originales']:
+                    omitidas += 1
+                    continue
+                generar_rendiciones(campo)
+                generadas += 1
+            except OSError as e:
+                fallidas += 1
+                self.stderr.write(f'{campo.name}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{generadas} imágenes procesadas, {omitidas} ya tenían rendiciones, {fallidas} con errores.'
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.importacion import TAMANO_LOTE, ContrasenaImportacion, importar_hermanos
+
+
+class Command(BaseCommand):
+    help = ('Importa hermanos desde un CSV (dni, nombre, apellidos, fecha_nacimiento, fecha_ingreso y estado '
+            'opcional), creando o actualizando por DNI en lotes. Las filas se validan con las reglas de HermanoForm.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='CSV separado por comas o punto y coma, con cabecera')
+        parser.add_argument('--contrasena', choices=ContrasenaImportacion.values, default=ContrasenaImportacion.ACTIVACION,
+                            help='"activacion": sin contraseña, el hermano la pone al registrarse (rápido). '
+                                 '"dni": el DNI como contraseña inicial, un hash por hermano en el pool de hashes '
+                                 '(LUMEN_HASHES_POOL, LUMEN_HASHES_TRABAJADORES).')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por transacción')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with open(options['fichero'], encoding='utf-8-sig', newline='') as fichero:
+                resultado = importar_hermanos(fichero, options['contrasena'], options['lote'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        segundos = time.perf_counter() - inicio
+
+        for mensaje in resultado.mensajes_error():
+            self.stderr.write(mensaje)
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.creados} hermanos creados, {resultado.actualizados} actualizados y '
+            f'{resultado.sin_cambios} sin cambios en {segundos:.1f} s; '
+            f'{len(resultado.errores)} filas con errores.'
+        ))
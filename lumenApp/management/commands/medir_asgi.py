@@ -0,0 +1,148 @@
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from lumenApp.rendimiento import RUTAS, percentil, base_datos_en_fichero, sembrar_hermandad
+
+
+# Rutas de solo lectura que tienen versión async (views_async.py)
+RUTAS_LECTURA = ['fichas_lista', 'fichas_lista_datos', 'cuota_lista', 'cultos_lista', 'detalle_culto']
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _esperar(puerto, segundos=30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(('127.0.0.1', puerto), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'El servidor no arrancó en el puerto {puerto}')
+
+
+# Peticiones GET en bucle desde `concurrencia` hilos durante `segundos`, con
+# conexiones keep-alive y la cookie de sesión del administrador.
+def _cargar(puerto, urls, cookie, concurrencia, segundos):
+    latencias, errores = [], []
+    cerrojo = threading.Lock()
+    fin = time.monotonic() + segundos
+
+    def trabajador(n):
+        conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=30)
+        i = n
+        propias, fallos = [], []
+        while time.monotonic() < fin:
+            url = urls[i % len(urls)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                conexion.request('GET', url, headers={'Cookie': cookie})
+                respuesta = conexion.getresponse()
+                respuesta.read()
+                if respuesta.status >= 400:
+                    fallos.append(respuesta.status)
+            except (OSError, http.client.HTTPException) as e:
+                fallos.append(repr(e))
+                conexion.close()
+                conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=30)
+            propias.append((time.perf_counter() - inicio) * 1000)
+        conexion.close()
+        with cerrojo:
+            latencias.extend(propias)
+            errores.extend(fallos)
+
+    hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return {
+        'peticiones': len(latencias),
+        'errores': len(errores),
+        'por_segundo': round((len(latencias) - len(errores)) / segundos, 1),
+        'p50_ms': round(percentil(latencias, 0.5), 1),
+        'p99_ms': round(percentil(latencias, 0.99), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Compara el rendimiento de las vistas de solo lectura servidas con WSGI (gunicorn, vistas síncronas) '
+            'y con ASGI (uvicorn, vistas async) contra la misma base de datos sembrada.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hermanos', type=int, default=2000, help='Tamaño del censo sembrado')
+        parser.add_argument('--workers', type=int, default=2, help='Procesos de cada servidor')
+        parser.add_argument('--hilos-wsgi', type=int, default=4, help='Hilos por worker de gunicorn')
+        parser.add_argument('--concurrencia', type=int, nargs='+', default=[8, 32],
+                            help='Clientes simultáneos a probar')
+        parser.add_argument('--segundos', type=int, default=10, help='Duración de cada medida')
+        parser.add_argument('--servidores', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('La prueba siembra una base de datos SQLite temporal; usa un perfil sqlite.')
+        falta = [modulo for modulo, servidor in (('gunicorn', 'wsgi'), ('uvicorn', 'asgi'))
+                 if servidor in options['servidores'] and not shutil.which(modulo)]
+        if falta:
+            raise CommandError(f"Hace falta instalar: {', '.join(falta)} (pip install {' '.join(falta)})")
+
+        with base_datos_en_fichero():
+            self.stdout.write(f"Sembrando {options['hermanos']} hermanos...")
+            datos = sembrar_hermandad(hermanos=options['hermanos'])
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                sesion = Client()
+                sesion.force_login(datos['usuarios']['admin'])
+            cookie = f"{settings.SESSION_COOKIE_NAME}={sesion.cookies[settings.SESSION_COOKIE_NAME].value}"
+            urls = []
+            for nombre in RUTAS_LECTURA:
+                kwargs, query = RUTAS[nombre](datos, 'admin')
+                urls.append(reverse(nombre, kwargs=kwargs) + (f'?{query}' if query else ''))
+            fichero = str(connection.settings_dict['NAME'])
+            connection.close()
+
+            entorno = {**os.environ, 'LUMEN_BD_NOMBRE': fichero, 'DJANGO_SETTINGS_MODULE': 'LumenHermandades.settings'}
+            self.stdout.write(f"{'servidor':<10}{'clientes':>9}{'peticiones':>12}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errores':>9}")
+            for servidor in options['servidores']:
+                puerto = _puerto_libre()
+                if servidor == 'wsgi':
+                    orden = [shutil.which('gunicorn'), 'LumenHermandades.wsgi:application',
+                             '--bind', f'127.0.0.1:{puerto}', '--workers', str(options['workers']),
+                             '--threads', str(options['hilos_wsgi']), '--log-level', 'warning']
+                    entorno['LUMEN_VISTAS_ASYNC'] = '0'
+                else:
+                    orden = [shutil.which('uvicorn'), 'LumenHermandades.asgi:application',
+                             '--port', str(puerto), '--workers', str(options['workers']), '--log-level', 'warning',
+                             '--no-access-log']
+                    entorno['LUMEN_VISTAS_ASYNC'] = '1'
+
+                proceso = subprocess.Popen(orden, env=entorno, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+                try:
+                    _esperar(puerto)
+                    # Una vuelta para calentar cachés y conexiones antes de medir
+                    _cargar(puerto, urls, cookie, 2, 1)
+                    for concurrencia in options['concurrencia']:
+                        r = _cargar(puerto, urls, cookie, concurrencia, options['segundos'])
+                        linea = (f"{servidor:<10}{concurrencia:>9}{r['peticiones']:>12}{r['por_segundo']:>9.1f}"
+                                 f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['errores']:>9}")
+                        self.stdout.write(self.style.ERROR(linea) if r['errores'] else linea)
+                finally:
+                    proceso.terminate()
+                    proceso.wait(timeout=30)
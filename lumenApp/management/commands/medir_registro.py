@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from lumenApp.contrasenas import cerrar_pool
+from lumenApp.rendimiento import base_datos_en_fichero, prueba_registro
+
+
+class Command(BaseCommand):
+    help = ('Mide registros por segundo y latencias p50/p99 de /registro/ con registros concurrentes, '
+            'para cada hasher (argon2, scrypt, pbkdf2) y tipo de pool de hashes, en una base de datos temporal.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', nargs='+', choices=list(settings.HASHERS), default=list(settings.HASHERS))
+        parser.add_argument('--pools', nargs='+', choices=['ninguno', 'hilos', 'procesos'], default=['ninguno', 'hilos'],
+                            help='"ninguno" calcula el hash en el hilo de la petición, como antes')
+        parser.add_argument('--hilos', type=int, default=8, help='Peticiones de registro a la vez')
+        parser.add_argument('--registros', type=int, default=100, help='Registros por combinación')
+        parser.add_argument('--json', help='Guardar los resultados en este fichero')
+
+    def handle(self, *args, **options):
+        resultados = []
+        self.stdout.write(f"{'hasher':<9}{'pool':<10}{'registros':>10}{'fallos':>8}{'reg/s':>8}{'p50 ms':>9}{'p99 ms':>9}")
+
+        with base_datos_en_fichero():
+            for nombre in options['hashers']:
+                hashers = [settings.HASHERS[nombre]] + [h for h in settings.PASSWORD_HASHERS if h != settings.HASHERS[nombre]]
+                with override_settings(PASSWORD_HASHERS=hashers):
+                    # argon2 necesita argon2-cffi; sin él make_password falla con ValueError
+                    try:
+                        make_password('prueba')
+                    except ValueError as e:
+                        self.stderr.write(f'{nombre}: no disponible ({e})')
+                        continue
+
+                    for tipo_pool in options['pools']:
+                        cerrar_pool()
+                        with override_settings(LUMEN_HASHES_POOL=tipo_pool, ALLOWED_HOSTS=['testserver']):
+                            r = prueba_registro(options['hilos'], options['registros'], prefijo=f'{nombre[:3]}{tipo_pool[:3]}')
+                        cerrar_pool()
+                        r.update(hasher=nombre, pool=tipo_pool)
+                        resultados.append(r)
+                        linea = (f"{nombre:<9}{tipo_pool:<10}{r['registros']:>10}{r['fallos']:>8}{r['por_segundo']:>8.1f}"
+                                 f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+                        self.stdout.write(self.style.ERROR(linea) if r['fallos'] else linea)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(resultados, f, indent=2)
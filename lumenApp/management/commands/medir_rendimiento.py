@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from lumenApp.rendimiento import RUTAS, excesos, medir_rutas, sembrar_hermandad
+
+
+class Command(BaseCommand):
+    help = ('Siembra una hermandad sintética en una base de datos temporal y mide consultas, '
+            'tiempo y tamaño de respuesta de cada ruta. Falla si alguna ruta supera su presupuesto de consultas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hermanos', type=int, nargs='+', default=[100],
+                            help='Tamaños del censo a medir, por ejemplo: --hermanos 100 10000 100000')
+        parser.add_argument('--cuotas', type=int, default=2, help='Cuotas por hermano')
+        parser.add_argument('--rutas', nargs='+', choices=sorted(RUTAS), help='Medir solo estas rutas')
+        parser.add_argument('--json', help='Guardar los resultados en este fichero')
+
+    def handle(self, *args, **options):
+        todos = []
+        nombre_bd = connection.settings_dict['NAME']
+
+        for escala in options['hermanos']:
+            # Una base de datos temporal por escala para no tocar la real ni mezclar tamaños
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.stdout.write(f'Sembrando {escala} hermanos...')
+                datos = sembrar_hermandad(hermanos=escala, cuotas_por_hermano=options['cuotas'])
+                with override_settings(ALLOWED_HOSTS=['testserver']):
+                    resultados = medir_rutas(datos, options['rutas'])
+            finally:
+                connection.creation.destroy_test_db(nombre_bd, verbosity=0)
+
+            self.stdout.write(f"{'ruta':<24}{'perfil':<9}{'estado':>7}{'consultas':>11}{'máx':>5}{'ms':>10}{'bytes':>10}")
+            for r in resultados:
+                r['hermanos'] = escala
+                linea = (f"{r['ruta']:<24}{r['perfil']:<9}{r['estado']:>7}{r['consultas']:>11}"
+                         f"{r['presupuesto'] if r['presupuesto'] is not None else '-':>5}{r['ms']:>10.1f}{r['bytes']:>10}")
+                self.stdout.write(self.style.ERROR(linea) if r in excesos([r]) else linea)
+            todos.extend(resultados)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(todos, f, indent=2)
+
+        fallos = excesos(todos)
+        if fallos:
+            detalle = ', '.join(f"{r['ruta']} ({r['perfil']}, {r['hermanos']}): {r['consultas']}" for r in fallos)
+            raise CommandError(f'Rutas por encima del presupuesto de consultas: {detalle}')
+        self.stdout.write(self.style.SUCCESS('Todas las rutas están dentro del presupuesto de consultas.'))
@@ -0,0 +1,97 @@
+import json
+import random
+import threading
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from lumenApp.asistencia import EstadoEscaneo, reiniciar_asistencia, volcar_asistencias
+from lumenApp.models import Asistencia, ParticipacionCulto
+from lumenApp.rendimiento import base_datos_en_fichero, ejecutar_concurrente, percentil, sembrar_hermandad
+
+
+# Escáneres concurrentes en la puerta de un culto: cada hilo es un móvil con la
+# sesión del administrador que manda códigos de participantes, con una parte
+# de escaneos repetidos y de códigos que no son del culto. Al final se vuelcan
+# las asistencias pendientes y se comprueba que hay una fila por hermano.
+def prueba_asistencia(datos, escaneres=8, escaneos=2000, repetidos=0.1, desconocidos=0.02, semilla=0):
+    reiniciar_asistencia()
+    culto = datos['culto']
+    codigos = list(ParticipacionCulto.objects.filter(culto_id=culto).values_list('hermano__dni', flat=True).distinct())
+    azar = random.Random(semilla)
+    azar.shuffle(codigos)
+    cola = []
+    for n in range(escaneos):
+        tirada = azar.random()
+        if tirada < desconocidos:
+            cola.append(f'DESCONOCIDO{n}')
+        elif tirada < desconocidos + repetidos and n:
+            cola.append(azar.choice(cola))
+        else:
+            cola.append(codigos[n % len(codigos)])
+
+    sesion = Client()
+    sesion.force_login(datos['usuarios']['admin'])
+    clientes = []
+    for _ in range(escaneres):
+        client = Client()
+        for nombre, galleta in sesion.cookies.items():
+            client.cookies[nombre] = galleta.value
+        clientes.append(client)
+    url = reverse('registrar_asistencia', kwargs={'culto_pk': culto})
+    estados = {estado: 0 for estado in EstadoEscaneo.values}
+    cerrojo = threading.Lock()
+
+    def escanear(hilo, n):
+        respuesta = clientes[hilo].post(url, {'codigo': cola[n]})
+        if respuesta.status_code < 400:
+            with cerrojo:
+                estados[respuesta.json()['estado']] += 1
+        return respuesta
+
+    latencias, fallos, segundos = ejecutar_concurrente(escanear, escaneres, escaneos)
+    volcar_asistencias()
+    return {
+        'escaneos': len(latencias) - len(fallos),
+        'fallos': len(fallos),
+        'por_segundo': round((len(latencias) - len(fallos)) / segundos, 1),
+        'p50_ms': round(percentil(latencias, 0.5), 1),
+        'p99_ms': round(percentil(latencias, 0.99), 1),
+        **estados,
+        'filas': Asistencia.objects.filter(culto_id=culto).count(),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Simula varios escáneres a la vez en la puerta de un culto contra /culto/<pk>/asistencia/, en una '
+            'base de datos SQLite temporal, y mide escaneos por segundo, latencias y filas escritas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hermanos', type=int, default=2000, help='Tamaño del censo sembrado')
+        parser.add_argument('--escaneres', type=int, default=8, help='Móviles escaneando a la vez')
+        parser.add_argument('--escaneos', type=int, default=2000, help='Escaneos en total')
+        parser.add_argument('--repetidos', type=float, default=0.1, help='Proporción de escaneos repetidos')
+        parser.add_argument('--lote', type=int, help='Asistencias por escritura (LUMEN_ASISTENCIA_LOTE)')
+        parser.add_argument('--json', help='Guardar los resultados en este fichero')
+
+    def handle(self, *args, **options):
+        ajustes = {'ALLOWED_HOSTS': ['testserver']}
+        if options['lote']:
+            ajustes['LUMEN_ASISTENCIA_LOTE'] = options['lote']
+
+        with base_datos_en_fichero(), override_settings(**ajustes):
+            datos = sembrar_hermandad(hermanos=options['hermanos'])
+            r = prueba_asistencia(datos, options['escaneres'], options['escaneos'], options['repetidos'])
+
+        linea = (f"{r['escaneos']} escaneos ({r['fallos']} fallos) en {r['escaneos'] / max(r['por_segundo'], 1e-6):.1f} s: "
+                 f"{r['por_segundo']} escaneos/s, p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms; "
+                 f"{r['registrado']} registrados, {r['repetido']} repetidos, {r['desconocido']} desconocidos, "
+                 f"{r['filas']} filas de asistencia.")
+        correcto = not r['fallos'] and r['filas'] == r['registrado']
+        self.stdout.write(self.style.SUCCESS(linea) if correcto else self.style.ERROR(linea))
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(r, f, indent=2)
@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from lumenApp.models import Cuota
+from lumenApp.rendimiento import base_datos_en_fichero, prueba_carga, sembrar_hermandad
+
+
+class Command(BaseCommand):
+    help = ('Siembra una hermandad sintética en una base de datos SQLite temporal y mide peticiones por segundo '
+            'de lectura y escritura concurrentes con cada perfil de base de datos.')
+
+    def add_arguments(self, parser):
+        perfiles = [nombre for nombre, perfil in settings.PERFILES_BD.items()
+                    if perfil['ENGINE'] == connection.settings_dict['ENGINE']]
+        parser.add_argument('--perfiles', nargs='+', choices=perfiles, default=perfiles,
+                            help='Perfiles de settings.PERFILES_BD a comparar')
+        parser.add_argument('--hermanos', type=int, default=1000, help='Tamaño del censo sembrado')
+        parser.add_argument('--lectores', type=int, default=4, help='Hilos que leen la tabla de fichas')
+        parser.add_argument('--escritores', type=int, default=2, help='Hilos que editan cuotas')
+        parser.add_argument('--segundos', type=int, default=10, help='Duración de cada prueba')
+        parser.add_argument('--json', help='Guardar los resultados en este fichero')
+
+    def handle(self, *args, **options):
+        ajustes = connection.settings_dict
+        originales = {clave: ajustes.get(clave) for clave in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')}
+        todos = {}
+
+        self.stdout.write(f"{'perfil':<20}{'tipo':<11}{'ok':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'bloqueos':>10}{'errores':>9}")
+        for nombre in options['perfiles']:
+            perfil = settings.PERFILES_BD[nombre]
+            # Las conexiones de cada hilo se crean a partir de este mismo diccionario
+            connection.close()
+            ajustes.update(
+                CONN_MAX_AGE=perfil.get('CONN_MAX_AGE', 0),
+                CONN_HEALTH_CHECKS=perfil.get('CONN_HEALTH_CHECKS', False),
+                OPTIONS=dict(perfil.get('OPTIONS', {})),
+            )
+            with base_datos_en_fichero():
+                datos = sembrar_hermandad(hermanos=options['hermanos'])
+                cuotas = list(Cuota.objects.values_list('pk', flat=True))
+                connection.close()
+                with override_settings(ALLOWED_HOSTS=['testserver']):
+                    resultado = prueba_carga(datos, cuotas, options['lectores'],
+                                             options['escritores'], options['segundos'])
+
+            todos[nombre] = resultado
+            for tipo, r in resultado.items():
+                linea = (f"{nombre:<20}{tipo:<11}{r['ok']:>8}{r['por_segundo']:>9.1f}{r['p50_ms']:>9.1f}"
+                         f"{r['p99_ms']:>9.1f}{r['bloqueos']:>10}{r['errores']:>9}")
+                self.stdout.write(self.style.ERROR(linea) if r['bloqueos'] or r['errores'] else linea)
+
+        ajustes.update(originales)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(todos, f, indent=2)
@@ -0,0 +1,50 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lumenApp.models import PeriodoCuota
+from lumenApp.sepa import POR_FICHERO, Acreedor, generar_remesas
+
+
+class Command(BaseCommand):
+    help = ('Genera las remesas SEPA de adeudos directos (pain.008) de las cuotas pendientes de un período y año, '
+            'en ficheros de como mucho --por-fichero adeudos. Los hermanos sin IBAN se omiten.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', required=True, choices=PeriodoCuota.values)
+        parser.add_argument('--anio', type=int, help='Año de las cuotas (por defecto, el de la fecha de cobro)')
+        parser.add_argument('--fecha-cobro', required=True, type=date.fromisoformat, help='Fecha de cobro (AAAA-MM-DD)')
+        parser.add_argument('--destino', default='.', help='Carpeta donde dejar los ficheros')
+        parser.add_argument('--por-fichero', type=int, default=POR_FICHERO, help='Adeudos por fichero')
+        parser.add_argument('--concepto', help='Concepto que verá el hermano en su banco')
+        parser.add_argument('--acreedor', help='Nombre del acreedor (por defecto LUMEN_SEPA_NOMBRE)')
+        parser.add_argument('--iban', help='IBAN del acreedor (por defecto LUMEN_SEPA_IBAN)')
+        parser.add_argument('--bic', help='BIC del acreedor (por defecto LUMEN_SEPA_BIC)')
+        parser.add_argument('--identificador', help='Identificador de acreedor SEPA (por defecto LUMEN_SEPA_IDENTIFICADOR)')
+
+    def handle(self, *args, **options):
+        if options['por_fichero'] < 1:
+            raise CommandError('--por-fichero debe ser al menos 1.')
+        inicio = time.perf_counter()
+        try:
+            acreedor = Acreedor.desde_settings(
+                nombre=options['acreedor'], iban=options['iban'], bic=options['bic'],
+                identificador=options['identificador'],
+            )
+            resultado = generar_remesas(
+                options['periodo'], options['fecha_cobro'], options['destino'], acreedor,
+                por_fichero=options['por_fichero'], concepto=options['concepto'], anio=options['anio'],
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        segundos = time.perf_counter() - inicio
+
+        for ruta, adeudos, suma in resultado.ficheros:
+            self.stdout.write(f'{ruta}: {adeudos} adeudos, {suma} €')
+        if resultado.sin_iban:
+            self.stderr.write(f'{resultado.sin_iban} cuotas pendientes omitidas porque el hermano no tiene IBAN.')
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.adeudos} adeudos por {resultado.importe} € en {len(resultado.ficheros)} ficheros '
+            f'({segundos:.1f} s).'
+        ))
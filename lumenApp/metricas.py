@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.template.backends import django as backend_django
+
+
+# Métricas de cada petición: consultas SQL, tiempo en la base de datos, en
+# plantillas y en la vista. MetricasMiddleware (middleware.py) crea una
+# Medicion por petición muestreada y la deja en un ContextVar; el envoltorio
+# de las conexiones y el backend de plantillas de aquí suman en ella. Sin
+# Medicion (peticiones no muestreadas, comandos) no miden nada.
+#
+# Los histogramas son de cada proceso: con varios workers cada uno expone los
+# suyos en /metrics. Con muestreo se cuentan solo las peticiones medidas.
+
+logger = logging.getLogger(__name__)
+
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CUBETAS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# (nombre, ayuda, cubetas)
+METRICAS = {
+    'total': ('lumen_peticion_segundos', 'Duración de la petición completa, con el middleware', CUBETAS_SEGUNDOS),
+    'vista': ('lumen_vista_segundos', 'Duración de la vista, plantillas incluidas', CUBETAS_SEGUNDOS),
+    'bd': ('lumen_bd_segundos', 'Tiempo en consultas SQL por petición', CUBETAS_SEGUNDOS),
+    'plantillas': ('lumen_plantillas_segundos', 'Tiempo renderizando plantillas por petición', CUBETAS_SEGUNDOS),
+    'consultas': ('lumen_consultas', 'Consultas SQL por petición', CUBETAS_CONSULTAS),
+}
+
+# Ruta de las peticiones que no resuelven ninguna URL (404)
+SIN_RUTA = 'sin_ruta'
+LENTAS_GUARDADAS = 50
+
+
+@dataclass
+class Medicion:
+    request: object
+    inicio: float = field(default_factory=time.perf_counter)
+    inicio_vista: float = None
+    fin: float = None
+    consultas: int = 0
+    bd: float = 0.0
+    plantillas: float = 0.0
+    # Plantillas renderizadas dentro de otras: solo cuenta la de fuera
+    anidadas: int = 0
+    testigo: object = None
+
+    # Deja de sumar en esta medición (al acabar la petición, también si falla).
+    def cerrar(self):
+        self.fin = time.perf_counter()
+        _medicion.reset(self.testigo)
+
+    @property
+    def ruta(self):
+        coincidencia = getattr(self.request, 'resolver_match', None)
+        return (coincidencia and coincidencia.url_name) or SIN_RUTA
+
+
+_medicion = ContextVar('lumen_medicion', default=None)
+
+
+class Histograma:
+    __slots__ = ('cubetas', 'cuentas', 'suma')
+
+    def __init__(self, cubetas):
+        self.cubetas = cubetas
+        # Una más para +Inf
+        self.cuentas = [0] * (len(cubetas) + 1)
+        self.suma = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect_left(self.cubetas, valor)] += 1
+        self.suma += valor
+
+
+_histogramas = {}
+_lentas_por_ruta = {}
+_lentas = deque(maxlen=LENTAS_GUARDADAS)
+_cerrojo = threading.Lock()
+
+
+def muestrear():
+    muestreo = settings.LUMEN_METRICAS_MUESTREO
+    return muestreo >= 1 or (muestreo > 0 and random.random() < muestreo)
+
+
+def empezar(request):
+    medicion = Medicion(request)
+    medicion.testigo = _medicion.set(medicion)
+    return medicion
+
+
+# Con la medición ya cerrada: la acumula en los histogramas y añade Server-Timing.
+def terminar(medicion, response):
+    valores = {
+        'total': medicion.fin - medicion.inicio,
+        'vista': medicion.fin - medicion.inicio_vista if medicion.inicio_vista is not None else 0.0,
+        'bd': medicion.bd,
+        'plantillas': medicion.plantillas,
+        'consultas': medicion.consultas,
+    }
+    ruta = medicion.ruta
+    with _cerrojo:
+        for clave, valor in valores.items():
+            histograma = _histogramas.get((clave, ruta))
+            if histograma is None:
+                histograma = _histogramas[clave, ruta] = Histograma(METRICAS[clave][2])
+            histograma.observar(valor)
+
+    # Las respuestas en streaming se generan después: solo cuenta lo de antes
+    response['Server-Timing'] = ', '.join([
+        f'bd;dur={valores["bd"] * 1000:.1f};desc="{medicion.consultas} consultas"',
+        f'plantillas;dur={valores["plantillas"] * 1000:.1f}',
+        f'vista;dur={valores["vista"] * 1000:.1f}',
+        f'total;dur={valores["total"] * 1000:.1f}',
+    ])
+    return response
+
+
+def empezar_vista():
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.inicio_vista = time.perf_counter()
+
+
+# Envoltorio de execute() que se instala en cada conexión (ver signals.py).
+def medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        medicion.consultas += 1
+        medicion.bd += duracion
+        umbral = settings.LUMEN_METRICAS_CONSULTA_LENTA_MS
+        if umbral is not None and duracion * 1000 >= umbral:
+            _consulta_lenta(medicion.ruta, sql, duracion)
+
+
+# Al principio de la lista: connection.execute_wrapper() saca siempre el último.
+def instalar_medidor(connection):
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, medir_consulta)
+
+
+# La pila solo con los marcos del proyecto, sin Django ni este módulo.
+def _pila():
+    marcos = [
+        marco for marco in traceback.extract_stack()
+        if marco.filename.startswith(str(settings.BASE_DIR)) and marco.filename != __file__
+        and 'site-packages' not in marco.filename
+    ]
+    return ''.join(traceback.format_list(marcos))
+
+
+def _consulta_lenta(ruta, sql, duracion):
+    pila = _pila()
+    with _cerrojo:
+        _lentas_por_ruta[ruta] = _lentas_por_ruta.get(ruta, 0) + 1
+        _lentas.append({'ruta': ruta, 'ms': round(duracion * 1000, 1), 'sql': sql, 'pila': pila})
+    logger.warning('Consulta lenta en %s (%.1f ms): %s\n%s', ruta, duracion * 1000, sql, pila)
+
+
+# Las últimas LENTAS_GUARDADAS consultas lentas, de la más antigua a la más reciente.
+def consultas_lentas():
+    with _cerrojo:
+        return list(_lentas)
+
+
+def reiniciar_metricas():
+    with _cerrojo:
+        _histogramas.clear()
+        _lentas_por_ruta.clear()
+        _lentas.clear()
+
+
+def _numero(valor):
+    return f'{valor:g}' if isinstance(valor, float) else str(valor)
+
+
+# Formato de texto de Prometheus (version 0.0.4).
+def exportar_metricas():
+    with _cerrojo:
+        histogramas = {clave: (list(h.cuentas), h.suma) for clave, h in _histogramas.items()}
+        lentas = dict(_lentas_por_ruta)
+
+    lineas = []
+    for clave, (nombre, ayuda, cubetas) in METRICAS.items():
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} histogram']
+        for (metrica, ruta), (cuentas, suma) in sorted(histogramas.items()):
+            if metrica != clave:
+                continue
+            acumulado = 0
+            for limite, cuenta in zip((*map(_numero, cubetas), '+Inf'), cuentas):
+                acumulado += cuenta
+                lineas.append(f'{nombre}_bucket{{ruta="{ruta}",le="{limite}"}} {acumulado}')
+            lineas.append(f'{nombre}_sum{{ruta="{ruta}"}} {_numero(suma)}')
+            lineas.append(f'{nombre}_count{{ruta="{ruta}"}} {acumulado}')
+    lineas += ['# HELP lumen_consultas_lentas_total Consultas por encima de LUMEN_METRICAS_CONSULTA_LENTA_MS',
+               '# TYPE lumen_consultas_lentas_total counter']
+    lineas += [f'lumen_consultas_lentas_total{{ruta="{ruta}"}} {n}' for ruta, n in sorted(lentas.items())]
+    return '\n'.join(lineas) + '\n'
+
+
+class _PlantillaMedida(backend_django.Template):
+    def render(self, context=None, request=None):
+        medicion = _medicion.get()
+        if medicion is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        medicion.anidadas += 1
+        try:
+            return super().render(context, request)
+        finally:
+            medicion.anidadas -= 1
+            if not medicion.anidadas:
+                medicion.plantillas += time.perf_counter() - inicio
+
+
+# El backend de Django con el tiempo de render de cada plantilla (settings.TEMPLATES).
+class DjangoTemplates(backend_django.DjangoTemplates):
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name).template, self)
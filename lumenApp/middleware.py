@@ -0,0 +1,69 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+
+from .metricas import empezar, empezar_vista, muestrear, terminar
+from .permisos import es_admin
+
+
+# Resuelve una sola vez por petición si el usuario es administrador y lo deja
+# en request.es_admin. Es perezoso: las peticiones que no lo miran no consultan nada.
+# Funciona con WSGI y con ASGI; las vistas async lo resuelven con aes_admin() y
+# sustituyen request.es_admin por el resultado.
+class RolesMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.es_admin = SimpleLazyObject(lambda: es_admin(request.user))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.es_admin = SimpleLazyObject(lambda: es_admin(request.user))
+        return await self.get_response(request)
+
+
+# Mide consultas, tiempo de base de datos, plantillas y vista de las peticiones
+# muestreadas (LUMEN_METRICAS_MUESTREO), los añade en la cabecera Server-Timing
+# y los acumula en los histogramas de /metrics (ver metricas.py). Va el primero
+# de MIDDLEWARE para que el total incluya a los demás. Las no muestreadas solo
+# pagan una llamada a random().
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not muestrear():
+            return self.get_response(request)
+        medicion = empezar(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            medicion.cerrar()
+        return terminar(medicion, response)
+
+    async def __acall__(self, request):
+        if not muestrear():
+            return await self.get_response(request)
+        medicion = empezar(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            medicion.cerrar()
+        return terminar(medicion, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        empezar_vista()
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0007_alter_hermano_usuario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='culto',
+            index=models.Index(fields=['tipo', 'fecha_inicio'], name='culto_tipo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['hermano', 'estado_pago', 'importe'], name='cuota_hermano_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['estado_pago', 'importe'], name='cuota_estado_importe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['periodo', 'fecha'], name='cuota_periodo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(condition=models.Q(('estado_pago', 'Pendiente')), fields=['hermano', 'fecha'], name='cuota_pendiente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hermano',
+            index=models.Index(fields=['estado'], name='hermano_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hermano',
+            index=models.Index(fields=['nombre'], name='hermano_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hermano',
+            index=models.Index(fields=['apellidos'], name='hermano_apellidos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participacionculto',
+            index=models.Index(fields=['culto', 'rol'], name='participacion_culto_rol_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def construir_balances(apps, schema_editor):
+    Hermano = apps.get_model('lumenApp', 'Hermano')
+    Cuota = apps.get_model('lumenApp', 'Cuota')
+    BalanceHermano = apps.get_model('lumenApp', 'BalanceHermano')
+
+    totales = {
+        fila['hermano_id']: fila
+        for fila in Cuota.objects.values('hermano_id').annotate(
+            num=Count('pk'),
+            pagado=Sum('importe', filter=Q(estado_pago='Pagado')),
+            pendiente=Sum('importe', filter=Q(estado_pago='Pendiente')),
+        ).order_by()
+    }
+    BalanceHermano.objects.bulk_create([
+        BalanceHermano(
+            hermano_id=pk,
+            num_cuotas=totales.get(pk, {}).get('num') or 0,
+            total_pagado=totales.get(pk, {}).get('pagado') or 0,
+            total_pendiente=totales.get(pk, {}).get('pendiente') or 0,
+        )
+        for pk in Hermano.objects.values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceHermano',
+            fields=[
+                ('hermano', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='lumenApp.hermano')),
+                ('num_cuotas', models.PositiveIntegerField(default=0)),
+                ('total_pagado', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_pendiente', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.RunPython(construir_balances, migrations.RunPython.noop),
+    ]
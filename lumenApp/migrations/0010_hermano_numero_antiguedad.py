@@ -0,0 +1,37 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def numerar_hermanos(apps, schema_editor):
+    Hermano = apps.get_model('lumenApp', 'Hermano')
+    numeros = Hermano.objects.filter(estado='Activo').annotate(
+        numero=Window(RowNumber(), order_by=[F('fecha_ingreso').asc(), F('dni').asc()])
+    ).values_list('pk', 'numero')
+    Hermano.objects.bulk_update(
+        [Hermano(pk=pk, numero_antiguedad=numero) for pk, numero in numeros],
+        ['numero_antiguedad'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0009_balancehermano'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hermano',
+            name='numero_antiguedad',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='hermano',
+            index=models.Index(fields=['estado', 'fecha_ingreso', 'dni'], name='hermano_antiguedad_idx'),
+        ),
+        migrations.RunPython(numerar_hermanos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0010_hermano_numero_antiguedad'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='culto',
+            index=models.Index(fields=['fecha_inicio', 'id'], name='culto_fecha_id_idx'),
+        ),
+    ]
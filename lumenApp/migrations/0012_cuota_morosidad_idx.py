@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0011_culto_fecha_id_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cuota',
+            name='cuota_pendiente_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(
+                condition=models.Q(estado_pago='Pendiente'),
+                fields=['hermano', 'fecha', 'periodo', 'importe'],
+                name='cuota_morosidad_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='balancehermano',
+            index=models.Index(condition=models.Q(total_pendiente__gt=0), fields=['hermano'], name='balance_moroso_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0012_cuota_morosidad_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hermano',
+            name='iban',
+            field=models.CharField(blank=True, default='', max_length=34),
+        ),
+    ]
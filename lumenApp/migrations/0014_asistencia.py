@@ -0,0 +1,26 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0013_hermano_iban'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Asistencia',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_hora', models.DateTimeField()),
+                ('culto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asistencias', to='lumenApp.culto')),
+                ('hermano', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asistencias', to='lumenApp.hermano')),
+            ],
+            options={
+                'unique_together': {('culto', 'hermano')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:40
+
+import lumenApp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0014_asistencia'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hermano',
+            name='iban',
+            field=models.CharField(blank=True, default='', max_length=34, validators=[lumenApp.models.validar_iban]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+# MySQL no admite índices parciales y Django omite sin aviso los que llevan
+# condition= (cuota_morosidad_idx, balance_moroso_idx). Allí se crean estos
+# compuestos completos, que cubren las mismas consultas; en el resto de motores
+# sobran. No están en el Meta de los modelos porque serían para todos los motores.
+INDICES_MYSQL = {
+    'Cuota': models.Index(
+        fields=['estado_pago', 'hermano', 'fecha', 'periodo', 'importe'],
+        name='cuota_morosidad_mysql_idx',
+    ),
+    'BalanceHermano': models.Index(fields=['total_pendiente', 'hermano'], name='balance_moroso_mysql_idx'),
+}
+
+
+def crear_indices_mysql(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for modelo, indice in INDICES_MYSQL.items():
+        schema_editor.add_index(apps.get_model('lumenApp', modelo), indice)
+
+
+def borrar_indices_mysql(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for modelo, indice in INDICES_MYSQL.items():
+        schema_editor.remove_index(apps.get_model('lumenApp', modelo), indice)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumenApp', '0015_alter_hermano_iban'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_mysql, borrar_indices_mysql),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+import re
+
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 from datetime import date
@@ -10,6 +12,19 @@ class EstadoHermano(models.TextChoices):
     INACTIVO = 'Inactivo', 'Inactivo'
     SUSPENDIDO = 'Suspendido', 'Suspendido'
 
+def iban_valido(iban):
+    if not re.fullmatch(r'[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}', iban):
+        return False
+    numero = ''.join(str(int(caracter, 36)) for caracter in iban[4:] + iban[:4])
+    return int(numero) % 97 == 1
+
+
+# Sin espacios y en mayúsculas, como lo deja HermanoForm.clean_iban()
+def validar_iban(iban):
+    if iban and not iban_valido(iban):
+        raise ValidationError("El IBAN no es válido.")
+
+
 class Hermano(models.Model):
     nombre = models.CharField(max_length=100)
     apellidos = models.CharField(max_length=100)
@@ -23,8 +38,23 @@ class Hermano(models.Model):
     )
     imagen = models.ImageField(upload_to='hermanos/', blank=True, null=True)
     usuario = models.OneToOneField(User, on_delete=models.CASCADE)
+    # Cuenta para domiciliar las cuotas (remesas SEPA, ver sepa.py), sin espacios
+    iban = models.CharField(max_length=34, blank=True, default='', validators=[validar_iban])
+    # Puesto por antigüedad entre los activos (1 = el más antiguo), lo mantiene antiguedad.py
+    numero_antiguedad = models.PositiveIntegerField(blank=True, null=True, editable=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado'], name='hermano_estado_idx'),
+            models.Index(fields=['nombre'], name='hermano_nombre_idx'),
+            models.Index(fields=['apellidos'], name='hermano_apellidos_idx'),
+            # Cuántos activos van delante de un hermano al colocarlo
+            models.Index(fields=['estado', 'fecha_ingreso', 'dni'], name='hermano_antiguedad_idx'),
+        ]
 
     def clean(self):
+        if not self.fecha_nacimiento:
+            return
         edad = date.today().year - self.fecha_nacimiento.year # Calcular la edad
         if edad < 0 or edad > 120:
             raise ValidationError("Edad no válida.")
@@ -76,13 +106,56 @@ class Cuota(models.Model):
     estado_pago = models.CharField(max_length=10, choices=EstadoPago.choices, default=EstadoPago.PENDIENTE)
     periodo = models.CharField(max_length=10, choices=PeriodoCuota.choices, default=PeriodoCuota.SEMESTRE_1)
 
+    class Meta:
+        indexes = [
+            # Totales por hermano de cuota_lista sin leer la tabla (índice que cubre la consulta)
+            models.Index(fields=['hermano', 'estado_pago', 'importe'], name='cuota_hermano_estado_idx'),
+            # Totales del panel de estadísticas
+            models.Index(fields=['estado_pago', 'importe'], name='cuota_estado_importe_idx'),
+            models.Index(fields=['periodo', 'fecha'], name='cuota_periodo_fecha_idx'),
+            # Solo las pendientes, que son las que se consultan para cobrar. Cubre el
+            # informe de morosidad, que agrupa por hermano sin leer la tabla.
+            # En MySQL no hay índices parciales: lo sustituye uno completo
+            # creado en la migración 0016.
+            models.Index(
+                fields=['hermano', 'fecha', 'periodo', 'importe'],
+                condition=models.Q(estado_pago='Pendiente'),
+                name='cuota_morosidad_idx',
+            ),
+        ]
+
     def clean(self):
         if self.importe <= 0:
             raise ValidationError("El importe debe ser mayor que cero.")
 
+    # La fila y su balance (señales de signals.py) se escriben en la misma
+    # transacción aunque se guarde desde el admin, la shell o un comando. Los
+    # borrados ya lo son: Django lanza post_delete dentro de la suya.
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Cuota {self.importe} - {self.hermano} - {self.get_periodo_display()} - {self.estado_pago}"
 
+# Totales de cuotas de cada hermano mantenidos al crear, editar o borrar cuotas
+# (ver balances.py), para que los listados no tengan que agregar.
+class BalanceHermano(models.Model):
+    hermano = models.OneToOneField(Hermano, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    num_cuotas = models.PositiveIntegerField(default=0)
+    total_pagado = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_pendiente = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Recuento de hermanos con deuda del panel de estadísticas (en MySQL,
+            # el completo de la migración 0016)
+            models.Index(fields=['hermano'], condition=models.Q(total_pendiente__gt=0), name='balance_moroso_idx'),
+        ]
+
+    def __str__(self):
+        return f"Balance de {self.hermano_id}: {self.num_cuotas} cuotas, {self.total_pagado} pagado, {self.total_pendiente} pendiente"
+
 class TipoCulto(models.Model):
     nombre = models.CharField(max_length=50, unique=True)
     descripcion = models.TextField(blank=True, null=True)
@@ -99,6 +172,13 @@ class Culto(models.Model):
     descripcion = models.TextField(blank=True, null=True)
     hermanos = models.ManyToManyField(Hermano, through='ParticipacionCulto', related_name='cultos')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['tipo', 'fecha_inicio'], name='culto_tipo_fecha_idx'),
+            # Orden y paginación de cultos_lista, próximos/pasados y rangos de fechas
+            models.Index(fields=['fecha_inicio', 'id'], name='culto_fecha_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.tipo.nombre} el {self.fecha_inicio}" 
 
@@ -110,6 +190,23 @@ class ParticipacionCulto(models.Model):
 
     class Meta:
         unique_together = ('hermano', 'culto', 'rol')
+        indexes = [
+            models.Index(fields=['culto', 'rol'], name='participacion_culto_rol_idx'),
+        ]
 
     def __str__(self):
         return f"{self.hermano} como {self.rol} en {self.culto}"
+
+
+# Hermanos que han pasado por la puerta en un culto (asistencia.py). Los
+# escaneos se escriben por lotes; el unique hace que repetirlos no duplique nada.
+class Asistencia(models.Model):
+    culto = models.ForeignKey(Culto, on_delete=models.CASCADE, related_name='asistencias')
+    hermano = models.ForeignKey(Hermano, on_delete=models.CASCADE, related_name='asistencias')
+    fecha_hora = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('culto', 'hermano')
+
+    def __str__(self):
+        return f"{self.hermano} en {self.culto} a las {self.fecha_hora:%H:%M}"
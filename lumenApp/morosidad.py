@@ -0,0 +1,120 @@
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Min, Q, Sum
+
+from .consultas import entero
+from .estadisticas import TIEMPO_SNAPSHOT, version_actual
+from .models import Cuota, EstadoPago, Hermano, PeriodoCuota
+
+
+# Cuotas pendientes de cada período en el informe: pendientes_sem1, pendientes_sem2...
+COLUMNAS_PERIODO = {periodo: f'pendientes_{periodo}' for periodo in PeriodoCuota.values}
+
+# Filas del informe que se muestran en la página; el resto se descarga
+FILAS_INFORME = 100
+
+
+def _decimal(valor):
+    try:
+        return Decimal(valor) if valor not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+# Umbrales del informe a partir de la query string (o de las opciones del comando).
+def umbrales_morosidad(datos):
+    periodo = datos.get('periodo')
+    return {
+        'min_cuotas': entero(datos.get('min_cuotas')) or None,
+        'min_deuda': _decimal(datos.get('min_deuda')),
+        'dias': entero(datos.get('dias')) or None,
+        'periodo': periodo if periodo in PeriodoCuota.values else None,
+    }
+
+
+def cuotas_pendientes(periodo=None):
+    cuotas = Cuota.objects.filter(estado_pago=EstadoPago.PENDIENTE)
+    if periodo:
+        cuotas = cuotas.filter(periodo=periodo)
+    return cuotas
+
+
+# Una fila por hermano con cuotas pendientes: cuántas, cuánto debe, la más
+# antigua y cuántas de cada período, agregado en la base de datos. Lee solo el
+# índice parcial cuota_morosidad_idx, que ya viene ordenado por hermano.
+# Los umbrales van en el HAVING: al menos min_cuotas, al menos min_deuda y con
+# alguna pendiente desde hace más de `dias`.
+def informe_morosidad(min_cuotas=None, min_deuda=None, dias=None, periodo=None):
+    filas = cuotas_pendientes(periodo).values('hermano_id').annotate(
+        pendientes=Count('pk'),
+        deuda=Sum('importe'),
+        mas_antigua=Min('fecha'),
+        **{columna: Count('pk', filter=Q(periodo=valor)) for valor, columna in COLUMNAS_PERIODO.items()},
+    ).order_by()
+    if min_cuotas:
+        filas = filas.filter(pendientes__gte=min_cuotas)
+    if min_deuda:
+        filas = filas.filter(deuda__gte=min_deuda)
+    if dias:
+        filas = filas.filter(mas_antigua__lte=date.today() - timedelta(days=dias))
+    return filas
+
+
+# Totales por período: cuotas, importe, hermanos distintos y la cuota más antigua.
+# Con agregación condicional en vez de GROUP BY periodo, para que se resuelva
+# recorriendo solo el índice parcial de pendientes.
+def resumen_por_periodo(periodo=None):
+    periodos = [periodo] if periodo else PeriodoCuota.values
+    totales = cuotas_pendientes(periodo).aggregate(**{
+        f'{campo}_{valor}': funcion(columna, filter=Q(periodo=valor), **extra)
+        for valor in periodos
+        for campo, funcion, columna, extra in (
+            ('cuotas', Count, 'pk', {}),
+            ('importe', Sum, 'importe', {}),
+            ('hermanos', Count, 'hermano_id', {'distinct': True}),
+            ('mas_antigua', Min, 'fecha', {}),
+        )
+    })
+    nombres = dict(PeriodoCuota.choices)
+    return [
+        {
+            'periodo': valor,
+            'nombre': nombres[valor],
+            'cuotas': totales[f'cuotas_{valor}'],
+            'importe': totales[f'importe_{valor}'] or 0,
+            'hermanos': totales[f'hermanos_{valor}'],
+            'mas_antigua': totales[f'mas_antigua_{valor}'],
+        }
+        for valor in periodos if totales[f'cuotas_{valor}']
+    ]
+
+
+# Los que más deben, con nombre y DNI leídos solo para las filas mostradas.
+def mayores_deudores(filas, limite=FILAS_INFORME):
+    filas = list(filas.order_by('-deuda', '-pendientes', 'hermano_id')[:limite])
+    hermanos = Hermano.objects.only('nombre', 'apellidos', 'dni').in_bulk([fila['hermano_id'] for fila in filas])
+    for fila in filas:
+        fila['hermano'] = hermanos.get(fila['hermano_id'])
+    return filas
+
+
+# Informe completo de la página: total de hermanos que cumplen los umbrales, los
+# que más deben y el resumen por período. Se guarda con la versión de las
+# estadísticas, que cambia con cada cuota creada, editada o borrada. Con `dias`
+# el resultado depende también de la fecha, que entra en la clave.
+def obtener_informe(umbrales):
+    clave = 'morosidad:{}:{}'.format(version_actual(), ':'.join(str(umbrales[campo]) for campo in sorted(umbrales)))
+    if umbrales['dias']:
+        clave += f':{date.today().isoformat()}'
+    informe = cache.get(clave)
+    if informe is None:
+        filas = informe_morosidad(**umbrales)
+        informe = {
+            'total_morosos': filas.count(),
+            'deudores': mayores_deudores(filas),
+            'resumen': resumen_por_periodo(umbrales['periodo']),
+        }
+        cache.set(clave, informe, TIEMPO_SNAPSHOT)
+    return informe
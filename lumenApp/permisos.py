@@ -0,0 +1,74 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+GRUPO_ADMIN = "Administradores"
+TIEMPO_CACHE = 60 * 60
+CLAVE_VERSION = 'es_admin:version'
+
+
+def _version():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+async def _aversion():
+    version = await cache.aget(CLAVE_VERSION)
+    if version is None:
+        await cache.aadd(CLAVE_VERSION, time.time_ns(), None)
+        version = await cache.aget(CLAVE_VERSION)
+    return version
+
+
+def _clave(user_id):
+    return f'es_admin:{_version()}:{user_id}'
+
+
+# Funcion para comprobar que un usuario es admin o no. El resultado se guarda
+# por usuario en la caché hasta que cambian sus grupos, solo si la caché es
+# compartida (LUMEN_CACHE_COMPARTIDA): con locmem, quitar a alguien del grupo
+# en un worker no lo invalidaría en los demás. Sin ella se consulta una vez por
+# petición (request.es_admin es perezoso, ver middleware.py).
+def es_admin(user):
+    if not user.is_authenticated:
+        return False
+    if not settings.LUMEN_CACHE_COMPARTIDA:
+        return user.groups.filter(name=GRUPO_ADMIN).exists()
+
+    clave = _clave(user.pk)
+    admin = cache.get(clave)
+    if admin is None:
+        admin = user.groups.filter(name=GRUPO_ADMIN).exists()
+        cache.set(clave, admin, TIEMPO_CACHE)
+    return admin
+
+
+# Lo mismo para las vistas async, con la caché y el ORM asíncronos.
+async def aes_admin(user):
+    if not user.is_authenticated:
+        return False
+    if not settings.LUMEN_CACHE_COMPARTIDA:
+        return await user.groups.filter(name=GRUPO_ADMIN).aexists()
+
+    clave = f'es_admin:{await _aversion()}:{user.pk}'
+    admin = await cache.aget(clave)
+    if admin is None:
+        admin = await user.groups.filter(name=GRUPO_ADMIN).aexists()
+        await cache.aset(clave, admin, TIEMPO_CACHE)
+    return admin
+
+
+# Sin user_id se invalidan todos los usuarios (cambios hechos desde el grupo).
+def invalidar_es_admin(user_id=None):
+    if user_id is not None:
+        cache.delete(_clave(user_id))
+        return
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
@@ -0,0 +1,385 @@
+import logging
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .antiguedad import reconstruir_antiguedad
+from .balances import recalcular_balances
+from .models import (
+    Culto, Cuota, EstadoHermano, EstadoPago, Hermano, HermanoRol, ParticipacionCulto,
+    PeriodoCuota, Rol, TipoCulto,
+)
+from .permisos import GRUPO_ADMIN
+
+
+TAMANO_LOTE = 2000
+
+# Máximo de consultas SQL por ruta y perfil con la caché vacía. No dependen del
+# tamaño del censo: si una vista empieza a hacer N+1 se pasa del presupuesto.
+PRESUPUESTO_CONSULTAS = {
+    'principal': {'admin': 4, 'hermano': 5},
+    'fichas_lista': {'admin': 5, 'hermano': 4},
+    'fichas_lista_datos': {'admin': 6, 'hermano': 6},
+    'hermanos_autocompletar': {'admin': 4, 'hermano': 3},
+    'hermanos_antiguedad': {'admin': 4, 'hermano': 3},
+    'exportar': {'admin': 4, 'hermano': 4},
+    'documentos': {'admin': 4, 'hermano': 4},
+    'detalle_hermano': {'admin': 7, 'hermano': 7},
+    'editar_hermano': {'admin': 5, 'hermano': 5},
+    'crear_hermano': {'admin': 4, 'hermano': 3},
+    'eliminar_hermano': {'admin': 5, 'hermano': 3},
+    'asignar_rol': {'admin': 6, 'hermano': 3},
+    'eliminar_rol': {'admin': 6, 'hermano': 3},
+    'cuota_lista': {'admin': 6, 'hermano': 6},
+    'crear_cuota': {'admin': 5, 'hermano': 6},
+    'crear_cuota_masiva': {'admin': 5, 'hermano': 3},
+    'eliminar_cuota': {'admin': 6, 'hermano': 3},
+    'editar_cuota': {'admin': 6, 'hermano': 3},
+    'cultos_lista': {'admin': 6, 'hermano': 6},
+    'detalle_culto': {'admin': 7, 'hermano': 7},
+    'crear_culto': {'admin': 5, 'hermano': 3},
+    'eliminar_culto': {'admin': 6, 'hermano': 3},
+    'asignar_participante': {'admin': 8, 'hermano': 3},
+    'generar_cortejo': {'admin': 6, 'hermano': 3},
+    'registrar_asistencia': {'admin': 5, 'hermano': 3},
+    'estadisticas': {'admin': 8, 'hermano': 3},
+    'morosidad': {'admin': 8, 'hermano': 3},
+    'registro': {'admin': 0, 'hermano': 0},
+    'metricas': {'admin': 3, 'hermano': 3},
+}
+
+
+# Rutas de lumenApp/urls.py con sus argumentos. Cada función recibe los datos
+# sembrados y el perfil, y devuelve (kwargs de reverse, query string).
+RUTAS = {
+    'principal': lambda d, p: ({}, ''),
+    'fichas_lista': lambda d, p: ({}, ''),
+    'fichas_lista_datos': lambda d, p: ({}, 'draw=1&start=0&length=25&order[0][column]=1&search[value]=Her'),
+    'hermanos_autocompletar': lambda d, p: ({}, 'q=Her'),
+    'hermanos_antiguedad': lambda d, p: ({}, 'desde=5&hasta=15'),
+    'exportar': lambda d, p: ({'tipo': 'cuotas'}, 'formato=csv&q=Her'),
+    'documentos': lambda d, p: ({'tipo': 'carnets'}, f"formato=zip&q={d['usuarios']['hermano'].username}"),
+    'detalle_hermano': lambda d, p: ({'pk': d['hermano'][p]}, ''),
+    'editar_hermano': lambda d, p: ({'pk': d['hermano'][p]}, ''),
+    'crear_hermano': lambda d, p: ({}, ''),
+    'eliminar_hermano': lambda d, p: ({'pk': d['hermano'][p]}, ''),
+    'asignar_rol': lambda d, p: ({'pk': d['hermano'][p]}, ''),
+    'eliminar_rol': lambda d, p: ({'pk': d['hermano'][p]}, ''),
+    'cuota_lista': lambda d, p: ({'hermano_pk': d['hermano'][p]}, ''),
+    'crear_cuota': lambda d, p: ({'hermano_pk': d['hermano'][p]}, ''),
+    'crear_cuota_masiva': lambda d, p: ({}, ''),
+    'eliminar_cuota': lambda d, p: ({'pk': d['cuota'][p]}, ''),
+    'editar_cuota': lambda d, p: ({'pk': d['cuota'][p]}, ''),
+    'cultos_lista': lambda d, p: ({}, ''),
+    'detalle_culto': lambda d, p: ({'pk': d['culto']}, ''),
+    'crear_culto': lambda d, p: ({}, ''),
+    'eliminar_culto': lambda d, p: ({'pk': d['culto']}, ''),
+    'asignar_participante': lambda d, p: ({'culto_pk': d['culto']}, ''),
+    'generar_cortejo': lambda d, p: ({'culto_pk': d['culto']}, ''),
+    'registrar_asistencia': lambda d, p: ({'culto_pk': d['culto']}, ''),
+    'estadisticas': lambda d, p: ({}, ''),
+    'morosidad': lambda d, p: ({}, 'min_cuotas=1&dias=0'),
+    'registro': lambda d, p: ({}, ''),
+    'metricas': lambda d, p: ({}, ''),
+}
+
+PERFILES = ('admin', 'hermano')
+
+
+def _lotes(objetos, modelo):
+    for i in range(0, len(objetos), TAMANO_LOTE):
+        modelo.objects.bulk_create(objetos[i:i + TAMANO_LOTE])
+
+
+# Crea una hermandad sintética con `hermanos` hermanos, sus usuarios, roles,
+# cuotas y un culto con todos los activos como participantes. Todo con
+# bulk_create para poder llegar a cientos de miles de filas en segundos.
+# Devuelve los usuarios y pks que usa medir_rutas().
+@transaction.atomic
+def sembrar_hermandad(hermanos=100, cuotas_por_hermano=2, prefijo='bench'):
+    password = make_password(None)
+    grupo, _ = Group.objects.get_or_create(name=GRUPO_ADMIN)
+    roles = [Rol.objects.get_or_create(nombre=nombre)[0] for nombre in ('Nazareno', 'Costalero', 'Acolito')]
+    tipo, _ = TipoCulto.objects.get_or_create(nombre='Estación de penitencia')
+
+    # El índice 0 es el administrador, que también es hermano
+    dnis = [f'{prefijo}{i:07d}' for i in range(hermanos + 1)]
+    _lotes([User(username=dni, password=password) for dni in dnis], User)
+    usuarios = dict(User.objects.filter(username__in=dnis).values_list('username', 'pk'))
+
+    inicio = date(1950, 1, 1)
+    _lotes([
+        Hermano(
+            nombre=f'Hermano{i}',
+            apellidos=f'Apellido{i % 997} Apellido{i % 101}',
+            dni=dni,
+            fecha_nacimiento=inicio + timedelta(days=i % 20000),
+            fecha_ingreso=inicio + timedelta(days=7000 + i % 20000),
+            estado=EstadoHermano.ACTIVO if i % 10 else EstadoHermano.INACTIVO,
+            usuario_id=usuarios[dni],
+        )
+        for i, dni in enumerate(dnis)
+    ], Hermano)
+    ids = list(Hermano.objects.filter(dni__in=dnis).order_by('dni').values_list('pk', 'estado'))
+
+    _lotes([HermanoRol(hermano_id=pk, rol=roles[n % len(roles)]) for n, (pk, _) in enumerate(ids)], HermanoRol)
+
+    periodos = [PeriodoCuota.SEMESTRE_1, PeriodoCuota.SEMESTRE_2]
+    _lotes([
+        Cuota(
+            hermano_id=pk,
+            importe=Decimal('25.00'),
+            periodo=periodos[c % 2],
+            estado_pago=EstadoPago.PAGADO if (n + c) % 3 else EstadoPago.PENDIENTE,
+        )
+        for n, (pk, _) in enumerate(ids) for c in range(cuotas_por_hermano)
+    ], Cuota)
+
+    culto = Culto.objects.create(tipo=tipo, fecha_inicio=date.today(), descripcion='Culto sintético')
+    _lotes([
+        ParticipacionCulto(hermano_id=pk, culto=culto, rol=roles[n % len(roles)], tramo=n // 100 + 1)
+        for n, (pk, estado) in enumerate(ids) if estado == EstadoHermano.ACTIVO
+    ], ParticipacionCulto)
+
+    # bulk_create no lanza señales: los balances y la antigüedad se calculan al final de una vez
+    recalcular_balances([pk for pk, _ in ids])
+    reconstruir_antiguedad()
+
+    admin = User.objects.get(pk=usuarios[dnis[0]])
+    admin.groups.add(grupo)
+    normal = User.objects.get(pk=usuarios[dnis[1]])
+    cuotas = dict(Cuota.objects.filter(hermano_id__in=[ids[0][0], ids[1][0]]).values_list('hermano_id', 'pk'))
+
+    return {
+        'usuarios': {'admin': admin, 'hermano': normal},
+        'hermano': {'admin': ids[1][0], 'hermano': ids[1][0]},
+        'cuota': {'admin': cuotas[ids[1][0]], 'hermano': cuotas[ids[1][0]]},
+        'culto': culto.pk,
+        'tipo': tipo.pk,
+    }
+
+
+# Pide una ruta con la caché vacía y devuelve consultas, tiempo y tamaño de la respuesta.
+def medir_ruta(client, nombre, datos, perfil):
+    kwargs, query = RUTAS[nombre](datos, perfil)
+    url = reverse(nombre, kwargs=kwargs) + (f'?{query}' if query else '')
+    cache.clear()
+
+    with CaptureQueriesContext(connection) as consultas:
+        inicio = time.perf_counter()
+        respuesta = client.get(url)
+        if respuesta.streaming:
+            tamano = sum(len(trozo) for trozo in respuesta.streaming_content)
+        else:
+            tamano = len(respuesta.content)
+        ms = (time.perf_counter() - inicio) * 1000
+
+    return {
+        'ruta': nombre,
+        'perfil': perfil,
+        'estado': respuesta.status_code,
+        'consultas': len(consultas),
+        'ms': round(ms, 2),
+        'bytes': tamano,
+        'presupuesto': PRESUPUESTO_CONSULTAS.get(nombre, {}).get(perfil),
+    }
+
+
+def medir_rutas(datos, rutas=None):
+    resultados = []
+    # Los 403 del perfil hermano son esperados, no hace falta registrarlos
+    registro = logging.getLogger('django.request')
+    nivel = registro.level
+    registro.setLevel(logging.ERROR)
+    try:
+        for perfil in PERFILES:
+            client = Client()
+            client.force_login(datos['usuarios'][perfil])
+            for nombre in rutas or RUTAS:
+                resultados.append(medir_ruta(client, nombre, datos, perfil))
+    finally:
+        registro.setLevel(nivel)
+    return resultados
+
+
+def excesos(resultados):
+    return [r for r in resultados if r['presupuesto'] is None or r['consultas'] > r['presupuesto']]
+
+
+# Base de datos de pruebas en un fichero temporal (no en memoria: WAL, bloqueos
+# y concurrencia entre hilos solo se pueden medir en disco).
+@contextmanager
+def base_datos_en_fichero():
+    ajustes = connection.settings_dict
+    nombre_bd = ajustes['NAME']
+    with tempfile.TemporaryDirectory() as carpeta:
+        ajustes['TEST']['NAME'] = str(Path(carpeta) / 'pruebas.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(nombre_bd, verbosity=0)
+            ajustes['TEST']['NAME'] = None
+
+
+# Lanza `hilos` hilos que repiten `tarea(hilo, n)` hasta hacer `total` llamadas
+# entre todos y devuelve las latencias en ms y los fallos (excepciones o respuestas >= 400).
+def ejecutar_concurrente(tarea, hilos, total):
+    latencias, fallos = [], []
+    cerrojo = threading.Lock()
+    contador = iter(range(total))
+
+    def trabajador(hilo):
+        try:
+            while True:
+                with cerrojo:
+                    n = next(contador, None)
+                if n is None:
+                    return
+                inicio = time.perf_counter()
+                try:
+                    respuesta = tarea(hilo, n)
+                    error = respuesta.status_code if respuesta.status_code >= 400 else None
+                except Exception as e:
+                    error = repr(e)
+                ms = (time.perf_counter() - inicio) * 1000
+                with cerrojo:
+                    latencias.append(ms)
+                    if error:
+                        fallos.append(error)
+                close_old_connections()
+        finally:
+            connection.close()
+
+    registro = logging.getLogger('django.request')
+    nivel = registro.level
+    registro.setLevel(logging.CRITICAL)
+    inicio = time.perf_counter()
+    try:
+        lista = [threading.Thread(target=trabajador, args=(h,)) for h in range(hilos)]
+        for hilo in lista:
+            hilo.start()
+        for hilo in lista:
+            hilo.join()
+    finally:
+        registro.setLevel(nivel)
+    return latencias, fallos, time.perf_counter() - inicio
+
+
+# Registros concurrentes por /registro/ con el hasher configurado.
+def prueba_registro(hilos=8, registros=200, prefijo='alta'):
+    clientes = [Client() for _ in range(hilos)]
+
+    def registrar(hilo, n):
+        return clientes[hilo].post(reverse('registro'), {
+            'nombre': f'Alta{n}',
+            'apellidos': 'Registro Concurrente',
+            'dni': f'{prefijo}{n:05d}',
+            'fecha_nacimiento': '1990-01-01',
+            'password': 'Candelaria-2026',
+            'password2': 'Candelaria-2026',
+        })
+
+    latencias, fallos, segundos = ejecutar_concurrente(registrar, hilos, registros)
+    correctos = len(latencias) - len(fallos)
+    return {
+        'registros': correctos,
+        'fallos': len(fallos),
+        'por_segundo': round(correctos / segundos, 1),
+        'p50_ms': round(percentil(latencias, 0.5), 1),
+        'p99_ms': round(percentil(latencias, 0.99), 1),
+    }
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+# Lectores y escritores concurrentes contra la base de datos durante `segundos`.
+# Los lectores piden la tabla de fichas por AJAX y los escritores editan cuotas
+# al azar (cada edición actualiza también el balance del hermano).
+# Devuelve peticiones por segundo, latencias y errores de cada tipo.
+def prueba_carga(datos, cuotas, lectores=4, escritores=2, segundos=10):
+    sesion = Client()
+    sesion.force_login(datos['usuarios']['admin'])
+    url_lectura = reverse('fichas_lista_datos') + '?' + RUTAS['fichas_lista_datos'](datos, 'admin')[1]
+
+    resultados = {tipo: {'ok': 0, 'bloqueos': 0, 'errores': 0, 'ms': []} for tipo in ('lectura', 'escritura')}
+    cerrojo = threading.Lock()
+    fin = time.perf_counter() + segundos
+
+    def trabajador(tipo, semilla):
+        client = Client()
+        for nombre, galleta in sesion.cookies.items():
+            client.cookies[nombre] = galleta.value
+        azar = random.Random(semilla)
+        propios = {'ok': 0, 'bloqueos': 0, 'errores': 0, 'ms': []}
+        try:
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                try:
+                    if tipo == 'lectura':
+                        respuesta = client.get(url_lectura)
+                    else:
+                        respuesta = client.post(reverse('editar_cuota', kwargs={'pk': azar.choice(cuotas)}), {
+                            'importe': f'{azar.randint(10, 60)}.00',
+                            'periodo': azar.choice(PeriodoCuota.values),
+                            'estado_pago': azar.choice(EstadoPago.values),
+                        })
+                    propios['ok' if respuesta.status_code < 400 else 'errores'] += 1
+                except OperationalError as e:
+                    propios['bloqueos' if 'locked' in str(e) else 'errores'] += 1
+                except Exception:
+                    propios['errores'] += 1
+                propios['ms'].append((time.perf_counter() - inicio) * 1000)
+                # El cliente de pruebas no cierra conexiones al acabar la petición;
+                # se hace aquí como el servidor, respetando CONN_MAX_AGE
+                close_old_connections()
+        finally:
+            connection.close()
+            with cerrojo:
+                for clave in ('ok', 'bloqueos', 'errores'):
+                    resultados[tipo][clave] += propios[clave]
+                resultados[tipo]['ms'].extend(propios['ms'])
+
+    hilos = [threading.Thread(target=trabajador, args=('lectura', n)) for n in range(lectores)]
+    hilos += [threading.Thread(target=trabajador, args=('escritura', n)) for n in range(escritores)]
+    # Los "database is locked" se cuentan en el resultado, no hace falta registrarlos
+    registro = logging.getLogger('django.request')
+    nivel = registro.level
+    registro.setLevel(logging.CRITICAL)
+    try:
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        registro.setLevel(nivel)
+
+    return {
+        tipo: {
+            'ok': r['ok'],
+            'bloqueos': r['bloqueos'],
+            'errores': r['errores'],
+            'por_segundo': round(r['ok'] / segundos, 1),
+            'p50_ms': round(percentil(r['ms'], 0.5), 1),
+            'p99_ms': round(percentil(r['ms'], 0.99), 1),
+        }
+        for tipo, r in resultados.items()
+    }
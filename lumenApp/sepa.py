@@ -0,0 +1,160 @@
+import re
+import shutil
+import tempfile
+import unicodedata
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+
+from .conciliacion import referencia_cuota
+from .models import Cuota, EstadoPago, iban_valido
+
+
+# Adeudos por fichero: los bancos suelen limitar el tamaño de cada remesa
+POR_FICHERO = 5000
+TAMANO_TROZO = 2000
+
+_NO_SEPA = re.compile(r"[^A-Za-z0-9/\-?:().,'+ ]")
+
+
+# Juego de caracteres básico de SEPA: se quitan tildes y lo demás pasa a espacio.
+def texto_sepa(valor, largo):
+    valor = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii')
+    return escape(' '.join(_NO_SEPA.sub(' ', valor).split())[:largo])
+
+
+# Referencia del mandato de cada hermano; la fecha de firma es la de ingreso.
+def referencia_mandato(dni):
+    return texto_sepa(f'LUMEN-{dni}', 35)
+
+
+@dataclass
+class Acreedor:
+    nombre: str
+    iban: str
+    bic: str
+    # Identificador de acreedor SEPA (AT-02), p. ej. ES12000B12345678
+    identificador: str
+
+    @classmethod
+    def desde_settings(cls, **cambios):
+        datos = {**settings.LUMEN_SEPA_ACREEDOR, **{k: v for k, v in cambios.items() if v}}
+        faltan = [campo for campo in ('nombre', 'iban', 'identificador') if not datos.get(campo)]
+        if faltan:
+            raise ValueError(f"Faltan datos del acreedor: {', '.join(faltan)} (LUMEN_SEPA_*).")
+        if not iban_valido(datos['iban']):
+            raise ValueError('El IBAN del acreedor no es válido.')
+        return cls(**datos)
+
+
+@dataclass
+class ResultadoRemesa:
+    # (ruta, adeudos, suma de control)
+    ficheros: list = field(default_factory=list)
+    adeudos: int = 0
+    importe: Decimal = Decimal('0.00')
+    # Cuotas pendientes del período cuyo hermano no tiene IBAN
+    sin_iban: int = 0
+
+
+# Campos de cada adeudo, leídos con la cuota en la misma consulta (JOIN con hermano)
+CAMPOS_ADEUDO = ['pk', 'importe', 'hermano__nombre', 'hermano__apellidos', 'hermano__dni', 'hermano__iban',
+                 'hermano__fecha_ingreso']
+
+
+def _adeudo(fila, concepto):
+    pk, importe, nombre, apellidos, dni, iban, fecha_ingreso = fila
+    return (
+        '<DrctDbtTxInf>'
+        f'<PmtId><EndToEndId>{referencia_cuota(pk)}</EndToEndId></PmtId>'
+        f'<InstdAmt Ccy="EUR">{importe:.2f}</InstdAmt>'
+        f'<DrctDbtTx><MndtRltdInf><MndtId>{referencia_mandato(dni)}</MndtId>'
+        f'<DtOfSgntr>{fecha_ingreso:%Y-%m-%d}</DtOfSgntr></MndtRltdInf></DrctDbtTx>'
+        '<DbtrAgt><FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId></DbtrAgt>'
+        f'<Dbtr><Nm>{texto_sepa(f"{nombre} {apellidos}", 70)}</Nm></Dbtr>'
+        f'<DbtrAcct><Id><IBAN>{escape(iban)}</IBAN></Id></DbtrAcct>'
+        f'<RmtInf><Ustrd>{concepto}</Ustrd></RmtInf>'
+        '</DrctDbtTxInf>\n'
+    )
+
+
+# Cabecera y bloque de pago (pain.008.001.02) de un fichero ya con sus totales.
+def _cabecera(identificador, adeudos, suma, acreedor, fecha_cobro, creado):
+    ctrl = f'<NbOfTxs>{adeudos}</NbOfTxs><CtrlSum>{suma:.2f}</CtrlSum>'
+    bic = (
+        f'<CdtrAgt><FinInstnId><BIC>{escape(acreedor.bic)}</BIC></FinInstnId></CdtrAgt>' if acreedor.bic
+        else '<CdtrAgt><FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId></CdtrAgt>'
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:pain.008.001.02">'
+        '<CstmrDrctDbtInitn>'
+        f'<GrpHdr><MsgId>{identificador}</MsgId><CreDtTm>{creado:%Y-%m-%dT%H:%M:%S}</CreDtTm>{ctrl}'
+        f'<InitgPty><Nm>{texto_sepa(acreedor.nombre, 70)}</Nm></InitgPty></GrpHdr>'
+        f'<PmtInf><PmtInfId>{identificador}</PmtInfId><PmtMtd>DD</PmtMtd><BtchBookg>true</BtchBookg>{ctrl}'
+        '<PmtTpInf><SvcLvl><Cd>SEPA</Cd></SvcLvl><LclInstrm><Cd>CORE</Cd></LclInstrm><SeqTp>RCUR</SeqTp></PmtTpInf>'
+        f'<ReqdColltnDt>{fecha_cobro:%Y-%m-%d}</ReqdColltnDt>'
+        f'<Cdtr><Nm>{texto_sepa(acreedor.nombre, 70)}</Nm></Cdtr>'
+        f'<CdtrAcct><Id><IBAN>{escape(acreedor.iban)}</IBAN></Id></CdtrAcct>{bic}<ChrgBr>SLEV</ChrgBr>'
+        '<CdtrSchmeId><Id><PrvtId><Othr>'
+        f'<Id>{texto_sepa(acreedor.identificador, 35)}</Id><SchmeNm><Prtry>SEPA</Prtry></SchmeNm>'
+        '</Othr></PrvtId></Id></CdtrSchmeId>\n'
+    )
+
+
+PIE = '</PmtInf></CstmrDrctDbtInitn></Document>\n'
+
+
+# Los períodos se repiten cada año: como en emitir_cuotas, cuenta el año de la cuota.
+def cuotas_domiciliables(periodo, anio):
+    return Cuota.objects.filter(estado_pago=EstadoPago.PENDIENTE, periodo=periodo, fecha__year=anio)
+
+
+# Genera las remesas de las cuotas pendientes de un período del año `anio` (por
+# defecto el de la fecha de cobro) en `destino`, en ficheros de como mucho `por_fichero` adeudos. Las cuotas se leen una sola vez
+# con iterator() y sin instanciar modelos; los adeudos de cada fichero se van
+# escribiendo en un temporal mientras se suman y, al cerrarlo, se escribe la
+# cabecera con los totales y se copia detrás. En memoria solo hay un trozo de cuotas.
+def generar_remesas(periodo, fecha_cobro, destino, acreedor, por_fichero=POR_FICHERO, concepto=None, anio=None):
+    anio = anio or fecha_cobro.year
+    destino = Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    creado = timezone.localtime()
+    concepto = texto_sepa(concepto or f'Cuota {periodo} {anio}', 140)
+    resultado = ResultadoRemesa()
+    cuotas = cuotas_domiciliables(periodo, anio)
+    resultado.sin_iban = cuotas.filter(hermano__iban='').count()
+    cuotas = cuotas.exclude(hermano__iban='').order_by('pk').values_list(*CAMPOS_ADEUDO)
+
+    cuerpo, adeudos, suma = None, 0, Decimal('0.00')
+
+    def cerrar():
+        numero = len(resultado.ficheros) + 1
+        identificador = f'LUMEN-{periodo}{anio}-{creado:%Y%m%d%H%M%S}-{numero}'[:35]
+        ruta = destino / f'remesa_{periodo}_{anio}_{fecha_cobro:%Y%m%d}_{numero:03d}.xml'
+        with open(ruta, 'w', encoding='utf-8') as fichero:
+            fichero.write(_cabecera(identificador, adeudos, suma, acreedor, fecha_cobro, creado))
+            cuerpo.seek(0)
+            shutil.copyfileobj(cuerpo, fichero)
+            fichero.write(PIE)
+        cuerpo.close()
+        resultado.ficheros.append((ruta, adeudos, suma))
+        resultado.adeudos += adeudos
+        resultado.importe += suma
+
+    for fila in cuotas.iterator(chunk_size=TAMANO_TROZO):
+        if cuerpo is None:
+            cuerpo = tempfile.TemporaryFile('w+', encoding='utf-8')
+        cuerpo.write(_adeudo(fila, concepto))
+        adeudos += 1
+        suma += fila[1]
+        if adeudos == por_fichero:
+            cerrar()
+            cuerpo, adeudos, suma = None, 0, Decimal('0.00')
+    if cuerpo is not None:
+        cerrar()
+    return resultado
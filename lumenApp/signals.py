@@ -0,0 +1,224 @@
+import logging
+
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .antiguedad import colocar, quitar_numero
+from .balances import aplicar_movimiento, aportacion, asegurar_balances
+from .estadisticas import invalidar_estadisticas
+from .fragmentos import invalidar_fragmentos
+from .imagenes import borrar_rendiciones, generar_rendiciones, preparar_original
+from .metricas import instalar_medidor
+from .models import Culto, Cuota, EstadoHermano, Hermano, HermanoRol, ParticipacionCulto, Rol, TipoCulto
+from .permisos import invalidar_es_admin
+
+
+logger = logging.getLogger(__name__)
+
+
+# Se invalida al confirmar la transacción para que nadie guarde un snapshot
+# calculado con datos que todavía no son visibles para el resto.
+@receiver(post_save, sender=Hermano)
+@receiver(post_delete, sender=Hermano)
+@receiver(post_save, sender=Cuota)
+@receiver(post_delete, sender=Cuota)
+@receiver(post_save, sender=Culto)
+@receiver(post_delete, sender=Culto)
+def estadisticas_modificadas(sender, **kwargs):
+    transaction.on_commit(invalidar_estadisticas)
+
+
+# Fragmentos cacheados de las páginas de detalle (fragmentos.py). La ficha y las
+# cuotas van por hermano y el detalle del culto por culto; el nombre del
+# hermano también sale en los cultos en los que participa.
+@receiver(post_save, sender=Hermano)
+@receiver(post_delete, sender=Hermano)
+def fragmentos_hermano(sender, instance, **kwargs):
+    cultos = list(ParticipacionCulto.objects.filter(hermano_id=instance.pk).values_list('culto_id', flat=True).distinct())
+
+    def invalidar():
+        invalidar_fragmentos('hermano', [instance.pk])
+        invalidar_fragmentos('culto', cultos)
+
+    transaction.on_commit(invalidar)
+
+
+@receiver(post_save, sender=Cuota)
+@receiver(post_delete, sender=Cuota)
+@receiver(post_save, sender=HermanoRol)
+@receiver(post_delete, sender=HermanoRol)
+def fragmentos_de_hermano(sender, instance, **kwargs):
+    hermano_id = instance.hermano_id
+    transaction.on_commit(lambda: invalidar_fragmentos('hermano', [hermano_id]))
+
+
+@receiver(post_save, sender=Culto)
+@receiver(post_delete, sender=Culto)
+@receiver(post_save, sender=ParticipacionCulto)
+@receiver(post_delete, sender=ParticipacionCulto)
+def fragmentos_culto(sender, instance, **kwargs):
+    culto_id = instance.pk if sender is Culto else instance.culto_id
+    transaction.on_commit(lambda: invalidar_fragmentos('culto', [culto_id]))
+
+
+# Los nombres de roles y tipos de culto salen en muchas páginas a la vez
+@receiver(post_save, sender=Rol)
+@receiver(post_delete, sender=Rol)
+@receiver(post_save, sender=TipoCulto)
+@receiver(post_delete, sender=TipoCulto)
+def fragmentos_globales(sender, **kwargs):
+    transaction.on_commit(invalidar_fragmentos)
+
+
+@receiver(post_save, sender=Hermano)
+def hermano_guardado(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        asegurar_balances([instance.pk])
+
+
+# Número de antigüedad (antiguedad.py): se apunta lo que había en la base de
+# datos para saber si el hermano cambia de puesto. Los números de los demás
+# pueden haber cambiado desde que se cargó la instancia, por eso se releen y el
+# UPDATE del save() escribe el número actual, no el de cuando se cargó.
+@receiver(pre_save, sender=Hermano)
+def antiguedad_antes_de_guardar(sender, instance, raw=False, **kwargs):
+    instance._antiguedad_anterior = None
+    if raw:
+        return
+    if instance.pk and not instance._state.adding:
+        instance._antiguedad_anterior = (
+            Hermano.objects.filter(pk=instance.pk)
+            .values_list('estado', 'fecha_ingreso', 'dni', 'numero_antiguedad').first()
+        )
+    instance.numero_antiguedad = instance._antiguedad_anterior[3] if instance._antiguedad_anterior else None
+
+
+@receiver(post_save, sender=Hermano)
+def antiguedad_hermano_guardado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = getattr(instance, '_antiguedad_anterior', None)
+    activo = instance.estado == EstadoHermano.ACTIVO
+    if anterior and anterior[:3] == (instance.estado, instance.fecha_ingreso, instance.dni):
+        instance.numero_antiguedad = anterior[3]
+        return
+    with transaction.atomic():
+        if anterior and anterior[3] is not None:
+            quitar_numero(instance.pk, anterior[3])
+        instance.numero_antiguedad = None
+        if activo:
+            colocar(instance)
+
+
+@receiver(pre_delete, sender=Hermano)
+def antiguedad_antes_de_borrar(sender, instance, **kwargs):
+    instance._numero_borrado = Hermano.objects.filter(pk=instance.pk).values_list('numero_antiguedad', flat=True).first()
+
+
+@receiver(post_delete, sender=Hermano)
+def antiguedad_hermano_borrado(sender, instance, **kwargs):
+    numero = getattr(instance, '_numero_borrado', None)
+    if numero is not None:
+        quitar_numero(instance.pk, numero)
+
+
+# Las subidas nuevas se reducen y se limpian de EXIF antes de escribirse en disco.
+# Se apunta la imagen anterior para borrar sus rendiciones si se sustituye.
+@receiver(pre_save, sender=Hermano)
+def hermano_antes_de_guardar(sender, instance, raw=False, **kwargs):
+    instance._imagen_nueva = False
+    if raw or not instance.imagen or instance.imagen._committed:
+        return
+    instance._imagen_anterior = None
+    if instance.pk and not instance._state.adding:
+        instance._imagen_anterior = Hermano.objects.filter(pk=instance.pk).values_list('imagen', flat=True).first()
+    preparada = preparar_original(instance.imagen)
+    if preparada is not None:
+        instance.imagen = preparada
+    instance._imagen_nueva = True
+
+
+# Las rendiciones se generan al confirmar, con el original ya guardado y sin
+# alargar la transacción.
+@receiver(post_save, sender=Hermano)
+def imagen_hermano_guardada(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_imagen_nueva', False):
+        return
+    instance._imagen_nueva = False
+    campo = instance.imagen
+    anterior = instance._imagen_anterior
+
+    def generar():
+        if anterior and anterior != campo.name:
+            borrar_rendiciones(campo.storage, anterior)
+        try:
+            generar_rendiciones(campo)
+        except OSError:
+            # Se reintentará al pedirlas (url_rendicion)
+            logger.warning('No se pudieron generar las rendiciones de %s', campo.name)
+
+    transaction.on_commit(generar)
+
+
+@receiver(post_delete, sender=Hermano)
+def imagen_hermano_borrada(sender, instance, **kwargs):
+    if instance.imagen:
+        storage, nombre = instance.imagen.storage, instance.imagen.name
+        transaction.on_commit(lambda: borrar_rendiciones(storage, nombre))
+
+
+# Al editar una cuota se guarda lo que aportaba antes para poder restarlo. Se
+# bloquea la fila (Cuota.save() abre la transacción) para que dos ediciones a
+# la vez no resten dos veces lo mismo.
+@receiver(pre_save, sender=Cuota)
+def cuota_antes_de_guardar(sender, instance, raw=False, **kwargs):
+    instance._aportacion_anterior = None
+    if not raw and instance.pk and not instance._state.adding:
+        instance._aportacion_anterior = (
+            Cuota.objects.select_for_update().filter(pk=instance.pk)
+            .values_list('hermano_id', 'importe', 'estado_pago').first()
+        )
+
+
+@receiver(post_save, sender=Cuota)
+def cuota_guardada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    with transaction.atomic():
+        anterior = getattr(instance, '_aportacion_anterior', None)
+        if anterior:
+            hermano_id, importe, estado_pago = anterior
+            num, pagado, pendiente = aportacion(importe, estado_pago)
+            aplicar_movimiento(hermano_id, -num, -pagado, -pendiente)
+        aplicar_movimiento(instance.hermano_id, *aportacion(instance.importe, instance.estado_pago))
+
+
+@receiver(post_delete, sender=Cuota)
+def cuota_borrada(sender, instance, **kwargs):
+    num, pagado, pendiente = aportacion(instance.importe, instance.estado_pago)
+    aplicar_movimiento(instance.hermano_id, -num, -pagado, -pendiente, crear=False)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def grupos_usuario_modificados(sender, instance, action, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, User):
+        invalidar_es_admin(instance.pk)
+    else:
+        invalidar_es_admin()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def grupo_modificado(sender, **kwargs):
+    invalidar_es_admin()
+
+
+# Cada conexión nueva suma sus consultas a la medición de la petición en curso (metricas.py).
+@receiver(connection_created)
+def medir_conexion(sender, connection, **kwargs):
+    instalar_medidor(connection)
@@ -0,0 +1,27 @@
+from django import template
+
+from ..imagenes import RENDICIONES, url_rendicion
+
+
+register = template.Library()
+
+
+# <picture> con la rendición en WebP y JPEG de alternativa:
+# {% imagen_hermano hermano "card" "img-thumbnail" %}
+@register.inclusion_tag('lumenApp/imagen_hermano.html')
+def imagen_hermano(hermano, rendicion='thumb', clase=''):
+    ancho, alto, recortar = RENDICIONES[rendicion]
+    return {
+        'hermano': hermano,
+        'webp': url_rendicion(hermano.imagen, rendicion, 'webp'),
+        'jpeg': url_rendicion(hermano.imagen, rendicion, 'jpeg'),
+        # Solo las recortadas tienen tamaño fijo; así el navegador reserva el hueco
+        'ancho': ancho if recortar else None,
+        'alto': alto if recortar else None,
+        'clase': clase,
+    }
+
+
+@register.simple_tag
+def url_imagen_hermano(hermano, rendicion='thumb', formato='webp'):
+    return url_rendicion(hermano.imagen, rendicion, formato) or ''
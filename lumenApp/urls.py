@@ -1,29 +1,47 @@
 from . import views
+from django.conf import settings
 from django.urls import path
 
 from .views import *
 
+# Con ASGI las vistas de solo lectura más visitadas se sirven en su versión async
+if settings.LUMEN_VISTAS_ASYNC:
+    from .views_async import cuota_lista, culto_detalle, cultos_lista, fichas_lista, fichas_lista_datos
+else:
+    from .views import cuota_lista, fichas_lista, fichas_lista_datos
+    cultos_lista = CultoListView.as_view()
+    culto_detalle = CultoDetailView.as_view()
+
 
 urlpatterns = [
    path('', views.principal, name='principal' ),
-   path('fichas_lista/', views.fichas_lista, name='fichas_lista' ),
+   path('fichas_lista/', fichas_lista, name='fichas_lista' ),
+   path('fichas_lista/datos/', fichas_lista_datos, name='fichas_lista_datos'),
    path('ficha/<int:pk>/', FichaDetalleView.as_view(), name='detalle_hermano'),
    path('ficha/<int:pk>/editar/', views.FichaUpdateView.as_view(), name='editar_hermano'),
    path('ficha/crear/', views.FichaCreateView.as_view(), name='crear_hermano'),
    path('ficha/<int:pk>/eliminar/', views.FichaDeleteView.as_view(), name='eliminar_hermano'),
    path('ficha/<int:pk>/asignar_rol/', views.asignar_rol, name='asignar_rol'),
    path('ficha/<int:pk>/eliminar_rol/', views.eliminar_rol, name='eliminar_rol'),
-   path('cuotas/<int:hermano_pk>/', views.cuota_lista, name='cuota_lista'),
+   path('cuotas/<int:hermano_pk>/', cuota_lista, name='cuota_lista'),
    path('hermano/<int:hermano_pk>/cuota/crear/', crear_cuota, name='crear_cuota'),
    path('cuota/crear-masiva/', views.crear_cuota_masiva, name='crear_cuota_masiva'),
+   path('exportar/<str:tipo>/', views.exportar, name='exportar'),
+   path('documentos/<str:tipo>/', views.documentos, name='documentos'),
+   path('hermanos/autocompletar/', views.hermanos_autocompletar, name='hermanos_autocompletar'),
+   path('hermanos/antiguedad/', views.hermanos_antiguedad, name='hermanos_antiguedad'),
    path('cuota/<int:pk>/eliminar/', CuotaDeleteView.as_view(), name='eliminar_cuota'),
    path('cuota/<int:pk>/editar/', CuotaUpdateView.as_view(), name='editar_cuota'),
-   path('cultos/', CultoListView.as_view(), name='cultos_lista'),
-   path('culto/<int:pk>/', CultoDetailView.as_view(), name='detalle_culto'),
+   path('cultos/', cultos_lista, name='cultos_lista'),
+   path('culto/<int:pk>/', culto_detalle, name='detalle_culto'),
    path('culto/crear/', CultoCreateView.as_view(), name='crear_culto'),
    path('culto/<int:pk>/eliminar/', CultoDeleteView.as_view(), name='eliminar_culto'),
    path('culto/<int:culto_pk>/asignar_participante/', views.asignar_participante, name='asignar_participante'),
+   path('culto/<int:culto_pk>/cortejo/', views.generar_cortejo, name='generar_cortejo'),
+   path('culto/<int:culto_pk>/asistencia/', views.registrar_asistencia, name='registrar_asistencia'),
    path('estadisticas', EstadisticasTemplateView.as_view(), name='estadisticas'),
+   path('morosidad/', MorosidadTemplateView.as_view(), name='morosidad'),
    path('registro/', RegistroView.as_view(), name='registro'),
+   path('metrics', views.metricas, name='metricas'),
 
 ]
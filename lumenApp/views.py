@@ -1,65 +1,246 @@
+import tempfile
 from datetime import date
-from pyexpat.errors import messages
+from itertools import groupby
+from operator import attrgetter
+from django.conf import settings
+from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from django.shortcuts import redirect, render, get_object_or_404
-from django.urls import reverse_lazy
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse, reverse_lazy
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_http_methods
 from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView, TemplateView
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Count, Sum
+from django.core.paginator import Paginator
 from django.contrib.auth.models import User
 
 from .models import *
-from .forms import HermanoForm, AsignarRolForm, CuotaForm, CuotaMasivaForm, CultoForm, RegistroHermanoForm
-
-# Funcion para comprobar que un usuario es admin o no.
-def es_admin(user):
-    return user.groups.filter(name="Administradores").exists()
+from .consultas import (
+    COLUMNAS_FICHAS, CUANDO_CULTOS, MAX_FILAS_PAGINA, con_participantes, con_total_cuotas, entero, fecha,
+    fichas_queryset, filtrar_cultos, pagina_keyset, participantes_culto,
+)
+from .contrasenas import cambiar_contrasena, crear_usuario
+from .antiguedad import rango_antiguedad
+from .asistencia import escanear, resumen_asistencia
+from .cortejo import aplicar_cortejo, planificar_cortejo
+from .cuotas import emitir_cuotas
+from .documentos import DOCUMENTOS, FORMATOS as FORMATOS_DOCUMENTOS, generar_documentos
+from .estadisticas import obtener_estadisticas
+from .exportacion import EXPORTACIONES, FORMATOS as FORMATOS_EXPORTACION, escribir_xlsx, lineas_csv, xlsx_disponible
+from .fragmentos import clave_fragmento, crear_fragmento, guardar_fragmento, leer_fragmento
+from .imagenes import url_rendicion
+from .metricas import exportar_metricas
+from .morosidad import obtener_informe, umbrales_morosidad
+from .forms import HermanoForm, AsignarRolForm, CortejoForm, CuotaForm, CuotaMasivaForm, CultoForm, RegistroHermanoForm
 
 #Mostrar la pagina principal y comprobar si es admin o hermano.
 @login_required
 def principal(request):
-    context = {
-        'es_admin': es_admin(request.user),
-        'hermano': None
-    }
+    context = {'hermano': None}
 
-    if not es_admin(request.user):
+    if not request.es_admin:
         context['hermano'] = get_object_or_404(Hermano, usuario=request.user)
 
     return render(request, 'lumenApp/principal.html', context)
 
+# Exportaciones que se ofrecen encima de la tabla de fichas
+EXPORTACIONES_FICHAS = [('hermanos', 'Hermanos'), ('cuotas', 'Cuotas'), ('roles', 'Roles')]
+
+
 @login_required
 def fichas_lista(request):
-    if es_admin(request.user):
-        fichas = Hermano.objects.all().annotate(total_cuotas=Count('cuotas'))
-    else:
-        fichas = Hermano.objects.filter(usuario=request.user).annotate(total_cuotas=Count('cuotas'))
-    
-    # Filtro por rol
-    rol_id = request.GET.get('rol')
-    if rol_id:
-        fichas = fichas.filter(roles__id=rol_id).distinct()
-    
+    # La tabla se rellena por AJAX desde fichas_lista_datos, aquí solo van los filtros.
     roles = Rol.objects.all()
-    context = {'fichas': fichas, 'es_admin': es_admin(request.user), 'roles': roles, 'rol_seleccionado': rol_id}
+    context = {
+        'roles': roles,
+        'rol_seleccionado': request.GET.get('rol'),
+        'exportaciones': EXPORTACIONES_FICHAS,
+    }
     return render(request, 'lumenApp/fichas_lista.html', context)
 
 
+# Parámetros de DataTables que usa fichas_lista_datos (también la versión async).
+def parametros_fichas(request):
+    columna = entero(request.GET.get('order[0][column]'))
+    campo = COLUMNAS_FICHAS[columna] if 0 <= columna < len(COLUMNAS_FICHAS) else None
+
+    limite = entero(request.GET.get('length'), 10)
+    if limite <= 0 or limite > MAX_FILAS_PAGINA:
+        limite = MAX_FILAS_PAGINA
+
+    return {
+        'rol_id': entero(request.GET.get('rol')) or None,
+        'busqueda': request.GET.get('search[value]', '').strip(),
+        'campo': campo or COLUMNAS_FICHAS[0],
+        'descendente': request.GET.get('order[0][dir]') == 'desc',
+        'limite': limite,
+        'inicio': max(entero(request.GET.get('start')), 0),
+        'cursor': request.GET.get('cursor'),
+    }
+
+
+def filas_fichas(filas, admin):
+    return [{
+        'nombre': ficha.nombre,
+        'apellidos': ficha.apellidos,
+        'total_cuotas': ficha.total_cuotas,
+        'miniatura': url_rendicion(ficha.imagen, 'thumb'),
+        'url_detalle': reverse('detalle_hermano', args=[ficha.pk]),
+        'url_editar': reverse('editar_hermano', args=[ficha.pk]),
+        'url_eliminar': reverse('eliminar_hermano', args=[ficha.pk]) if admin else None,
+    } for ficha in filas]
+
+
+# Datos de la tabla de fichas en el formato de DataTables en modo servidor.
+# Con el parámetro "cursor" se pagina por clave en vez de por desplazamiento.
+@login_required
+def fichas_lista_datos(request):
+    admin = request.es_admin
+    p = parametros_fichas(request)
+
+    base = fichas_queryset(request.user, admin, rol_id=p['rol_id'])
+    total = base.count()
+    fichas = fichas_queryset(request.user, admin, rol_id=p['rol_id'], busqueda=p['busqueda'])
+    filtrados = fichas.count() if p['busqueda'] else total
+
+    fichas = con_total_cuotas(fichas)
+    siguiente = None
+    if p['cursor'] is not None:
+        filas, siguiente = pagina_keyset(fichas, p['campo'], p['descendente'], p['cursor'], p['limite'])
+    else:
+        orden = f"-{p['campo']}" if p['descendente'] else p['campo']
+        filas = fichas.order_by(orden, 'pk')[p['inicio']:p['inicio'] + p['limite']]
+
+    return JsonResponse({
+        'draw': entero(request.GET.get('draw')),
+        'recordsTotal': total,
+        'recordsFiltered': filtrados,
+        'data': filas_fichas(filas, admin),
+        'siguiente': siguiente,
+    })
+
+
+# Descarga de hermanos, cuotas, roles, participaciones o morosidad con los filtros
+# de fichas_lista (rol, q), de cultos_lista (tipo) y los umbrales del informe de
+# morosidad. Cada hermano solo exporta lo suyo.
+@login_required
+def exportar(request, tipo):
+    if tipo not in EXPORTACIONES:
+        raise Http404('Exportación desconocida')
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        return HttpResponseBadRequest('Formato no soportado')
+
+    filtros = {
+        'user': request.user,
+        'admin': request.es_admin,
+        'rol_id': entero(request.GET.get('rol')) or None,
+        'busqueda': request.GET.get('q', '').strip(),
+        'tipo_culto': entero(request.GET.get('tipo')) or None,
+        'umbrales': umbrales_morosidad(request.GET),
+    }
+    nombre = f'{tipo}_{date.today():%Y%m%d}.{formato}'
+
+    if formato == 'csv':
+        respuesta = StreamingHttpResponse(lineas_csv(tipo, **filtros), content_type='text/csv; charset=utf-8')
+        respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        return respuesta
+
+    if not xlsx_disponible():
+        return HttpResponse('La exportación a XLSX no está disponible en este servidor.', status=501)
+    # Se escribe en un temporal que se borra al cerrar la respuesta
+    fichero = tempfile.TemporaryFile()
+    escribir_xlsx(tipo, fichero, **filtros)
+    fichero.seek(0)
+    return FileResponse(fichero, as_attachment=True, filename=nombre)
+
+
+# Recibos de cuotas o carnets de hermanos activos en un PDF o en un ZIP con un PDF
+# por documento, con los filtros de fichas_lista (rol, q) y, para los recibos,
+# período, año y estado. Cada hermano solo descarga los suyos.
+@login_required
+def documentos(request, tipo):
+    if tipo not in DOCUMENTOS:
+        raise Http404('Documento desconocido')
+    formato = request.GET.get('formato', 'pdf')
+    if formato not in FORMATOS_DOCUMENTOS:
+        return HttpResponseBadRequest('Formato no soportado')
+
+    periodo = request.GET.get('periodo')
+    estado = request.GET.get('estado')
+    filtros = {
+        'user': request.user,
+        'admin': request.es_admin,
+        'rol_id': entero(request.GET.get('rol')) or None,
+        'busqueda': request.GET.get('q', '').strip(),
+        'periodo': periodo if periodo in PeriodoCuota.values else None,
+        'anio': entero(request.GET.get('anio')) or None,
+        'estado_pago': estado if estado in EstadoPago.values else None,
+    }
+    tipo_contenido = 'application/zip' if formato == 'zip' else 'application/pdf'
+    respuesta = StreamingHttpResponse(generar_documentos(tipo, formato, **filtros), content_type=tipo_contenido)
+    respuesta['Content-Disposition'] = f'attachment; filename="{tipo}_{date.today():%Y%m%d}.{formato}"'
+    return respuesta
+
+
+# Buscador para el selector de hermanos de la emisión masiva de cuotas.
+@login_required
+def hermanos_autocompletar(request):
+    if not request.es_admin:
+        return JsonResponse({'resultados': []}, status=403)
+
+    busqueda = request.GET.get('q', '').strip()
+    resultados = []
+    if len(busqueda) >= 2:
+        hermanos = fichas_queryset(request.user, True, busqueda=busqueda).order_by('apellidos', 'nombre')
+        resultados = [
+            {'id': pk, 'texto': f'{nombre} {apellidos} ({dni})'}
+            for pk, nombre, apellidos, dni in hermanos.values_list('pk', 'nombre', 'apellidos', 'dni')[:20]
+        ]
+    return JsonResponse({'resultados': resultados})
+
+
+# Hermanos activos entre dos números de antigüedad (?desde=500&hasta=600), como
+# máximo MAX_FILAS_PAGINA. Una consulta por rango sobre el índice de numero_antiguedad.
+@login_required
+def hermanos_antiguedad(request):
+    if not request.es_admin:
+        return JsonResponse({'hermanos': []}, status=403)
+
+    desde = max(entero(request.GET.get('desde'), 1), 1)
+    hasta = min(entero(request.GET.get('hasta'), desde + MAX_FILAS_PAGINA - 1), desde + MAX_FILAS_PAGINA - 1)
+    hermanos = rango_antiguedad(desde, hasta).values('numero_antiguedad', 'id', 'nombre', 'apellidos', 'dni', 'fecha_ingreso')
+    return JsonResponse({'desde': desde, 'hasta': hasta, 'hermanos': list(hermanos)})
+
+
 class FichaDetalleView(LoginRequiredMixin, DetailView):
     model = Hermano
     template_name = 'lumenApp/ficha_detalle.html'
     context_object_name = 'hermano'
 
     def get_queryset(self):
-        if es_admin(self.request.user):
+        if self.request.es_admin:
             return Hermano.objects.all()
         return Hermano.objects.filter(usuario=self.request.user)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
+    # En un acierto de la caché de fragmentos no se consulta la ficha: el permiso
+    # se comprueba con el dueño guardado junto al HTML.
+    def get(self, request, *args, **kwargs):
+        clave = clave_fragmento('ficha_detalle', 'hermano', kwargs['pk'], bool(request.es_admin))
+        fragmento = leer_fragmento('ficha_detalle', clave)
+        if fragmento is None:
+            self.object = self.get_object()
+            context = self.get_context_data(object=self.object)
+            fragmento = crear_fragmento(
+                request, self.template_name, context, f'Detalle de {self.object.nombre}', self.object.usuario_id,
+            )
+            guardar_fragmento(clave, fragmento)
+        elif not request.es_admin and fragmento['propietario'] != request.user.pk:
+            raise Http404
+        return render(request, 'lumenApp/fragmento.html', fragmento)
 
 
 class FichaUpdateView(LoginRequiredMixin, UpdateView):
@@ -69,15 +250,10 @@ class FichaUpdateView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('fichas_lista')
 
     def get_queryset(self):
-        if es_admin(self.request.user):
+        if self.request.es_admin:
             return Hermano.objects.all()
         return Hermano.objects.filter(usuario=self.request.user)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
-
 
 class FichaCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Hermano
@@ -86,19 +262,14 @@ class FichaCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     success_url = reverse_lazy('fichas_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
+        return self.request.es_admin
 
     def form_valid(self, form):
         dni = form.cleaned_data['dni']
-        user = User.objects.create_user(username=dni, password=dni)
+        user = crear_usuario(dni, dni)
         form.instance.usuario = user
         return super().form_valid(form)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
-
 
 class FichaDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = Hermano
@@ -106,17 +277,12 @@ class FichaDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('fichas_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
+        return self.request.es_admin
 
 
 @login_required
 def asignar_rol(request, pk):
-    if not es_admin(request.user):
+    if not request.es_admin:
         return redirect('principal')
 
     hermano = get_object_or_404(Hermano, pk=pk)
@@ -136,13 +302,13 @@ def asignar_rol(request, pk):
     else:
         form = AsignarRolForm()
 
-    context = {'form': form, 'hermano': hermano, 'es_admin': True}
+    context = {'form': form, 'hermano': hermano}
     return render(request, 'lumenApp/asignar_rol.html', context)
 
 
 @login_required
 def eliminar_rol(request, pk):
-    if not es_admin(request.user):
+    if not request.es_admin:
         return redirect('principal')
 
     hermano = get_object_or_404(Hermano, pk=pk)
@@ -152,42 +318,50 @@ def eliminar_rol(request, pk):
         HermanoRol.objects.filter(hermano=hermano, rol_id=rol_id).delete()
         return redirect('detalle_hermano', pk=hermano.pk)
 
-    context = {'hermano': hermano, 'roles': hermano.roles.all(), 'es_admin': True}
+    context = {'hermano': hermano, 'roles': hermano.roles.all()}
     return render(request, 'lumenApp/eliminar_rol.html', context)
 
 
 @login_required
 def cuota_lista(request, hermano_pk):
-    hermano = get_object_or_404(Hermano, pk=hermano_pk)
-    if not es_admin(request.user) and hermano.usuario != request.user:
+    clave = clave_fragmento('cuotas_lista', 'hermano', hermano_pk, bool(request.es_admin))
+    fragmento = leer_fragmento('cuotas_lista', clave)
+    if fragmento is not None:
+        if not request.es_admin and fragmento['propietario'] != request.user.pk:
+            return redirect('principal')
+        return render(request, 'lumenApp/fragmento.html', fragmento)
+
+    hermano = get_object_or_404(Hermano.objects.select_related('balance'), pk=hermano_pk)
+    if not request.es_admin and hermano.usuario_id != request.user.pk:
         return redirect('principal')
 
     cuotas = Cuota.objects.filter(hermano=hermano)
 
-    total_cuotas_pagadas = cuotas.filter(estado_pago='Pagado').aggregate(total=Sum('importe'))['total'] or 0
-    total_cuotas_pendientes = cuotas.filter(estado_pago='Pendiente').aggregate(total=Sum('importe'))['total'] or 0
+    # Los totales vienen del balance del hermano, no se agregan en cada visita
+    balance = getattr(hermano, 'balance', None)
 
     context = {
         'hermano': hermano,
         'cuotas': cuotas,
-        'total_cuotas_pagadas': total_cuotas_pagadas,
-        'total_cuotas_pendientes': total_cuotas_pendientes,
-        'es_admin': es_admin(request.user)
+        'total_cuotas_pagadas': balance.total_pagado if balance else 0,
+        'total_cuotas_pendientes': balance.total_pendiente if balance else 0,
     }
-    return render(request, 'lumenApp/cuotas_lista.html', context)
+    fragmento = crear_fragmento(request, 'lumenApp/cuotas_lista.html', context, f'Cuotas - {hermano.nombre}', hermano.usuario_id)
+    guardar_fragmento(clave, fragmento)
+    return render(request, 'lumenApp/fragmento.html', fragmento)
 
 @login_required
 def crear_cuota(request, hermano_pk):
     hermano = get_object_or_404(Hermano, pk=hermano_pk)
 
-    if not es_admin(request.user) and hermano.usuario != request.user:
+    if not request.es_admin and hermano.usuario != request.user:
         return redirect('principal')
 
     if request.method == 'POST':
         form = CuotaForm(request.POST)
         if form.is_valid():
             cuota = form.save(commit=False)
-            cuota.hermano = hermano  
+            cuota.hermano = hermano
             cuota.save()
             return redirect('cuota_lista', hermano_pk=hermano.pk)
     else:
@@ -204,12 +378,7 @@ class CuotaUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     success_url = reverse_lazy('fichas_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
+        return self.request.es_admin
 
 
 class CuotaDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
@@ -218,31 +387,63 @@ class CuotaDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('fichas_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
+        return self.request.es_admin
+
+
+CULTOS_POR_PAGINA = 25
+
+
+# Filtros de cultos_lista a partir de la query string.
+def parametros_cultos(request):
+    cuando = request.GET.get('cuando')
+    cuando = cuando if cuando in CUANDO_CULTOS else None
+    return {
+        'filtros': {
+            'tipo_id': entero(request.GET.get('tipo')) or None,
+            'cuando': cuando,
+            'desde': fecha(request.GET.get('desde')),
+            'hasta': fecha(request.GET.get('hasta')),
+        },
+        # Los próximos del más cercano al más lejano; el resto, del más reciente hacia atrás
+        'descendente': cuando != 'proximos',
+        'cursor': request.GET.get('cursor'),
+    }
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
-        return context
+
+def contexto_cultos(request, filas, siguiente):
+    # Los enlaces de paginación conservan los filtros
+    filtros = request.GET.copy()
+    filtros.pop('cursor', None)
+    return {
+        'cultos': filas,
+        'object_list': filas,
+        'tipo_seleccionado': request.GET.get('tipo'),
+        'cuando': request.GET.get('cuando', ''),
+        'desde': request.GET.get('desde', ''),
+        'hasta': request.GET.get('hasta', ''),
+        'filtros_url': filtros.urlencode(),
+        'siguiente': siguiente,
+        'primera_pagina': not request.GET.get('cursor'),
+    }
 
 
+# Paginación por clave sobre (fecha_inicio, id): cada página cuesta lo mismo
+# por muchos cultos que se acumulen.
 class CultoListView(LoginRequiredMixin, ListView):
     model = Culto
     template_name = 'lumenApp/cultos_lista.html'
     context_object_name = 'cultos'
 
     def get_queryset(self):
-        cultos = Culto.objects.all()
-        tipo_id = self.request.GET.get('tipo')
-        if tipo_id:
-            cultos = cultos.filter(tipo__id=tipo_id)
-        return cultos
+        self.parametros = parametros_cultos(self.request)
+        return con_participantes(filtrar_cultos(**self.parametros['filtros']))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
+        p = self.parametros
+        filas, siguiente = pagina_keyset(self.object_list, 'fecha_inicio', p['descendente'], p['cursor'], CULTOS_POR_PAGINA)
+        context.update(contexto_cultos(self.request, filas, siguiente))
         context['tipos'] = TipoCulto.objects.all()
-        context['tipo_seleccionado'] = self.request.GET.get('tipo')
         return context
 
 
@@ -250,12 +451,36 @@ class CultoDetailView(LoginRequiredMixin, DetailView):
     model = Culto
     template_name = 'lumenApp/culto_detalle.html'
     context_object_name = 'culto'
+    participantes_por_pagina = 200
 
+    def get_queryset(self):
+        return Culto.objects.select_related('tipo')
+
+    # Participantes paginados y agrupados por tramo.
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['es_admin'] = es_admin(self.request.user)
+        participaciones = participantes_culto(self.object)
+        pagina = Paginator(participaciones, self.participantes_por_pagina).get_page(self.request.GET.get('page'))
+        context['pagina'] = pagina
+        context['tramos'] = [(tramo, list(grupo)) for tramo, grupo in groupby(pagina, key=attrgetter('tramo'))]
         return context
 
+    # Cualquier hermano puede ver un culto: el fragmento va por página y es_admin.
+    def get(self, request, *args, **kwargs):
+        pedida = entero(request.GET.get('page'), 1)
+        clave = clave_fragmento('culto_detalle', 'culto', kwargs['pk'], bool(request.es_admin), pedida)
+        fragmento = leer_fragmento('culto_detalle', clave)
+        if fragmento is None:
+            self.object = self.get_object()
+            context = self.get_context_data(object=self.object)
+            fragmento = crear_fragmento(request, self.template_name, context, f'Detalle del Culto - {self.object.tipo.nombre}')
+            # Se guarda con la página servida: una fuera de rango no crea otra entrada
+            servida = context['pagina'].number
+            if servida != pedida:
+                clave = clave_fragmento('culto_detalle', 'culto', kwargs['pk'], bool(request.es_admin), servida)
+            guardar_fragmento(clave, fragmento)
+        return render(request, 'lumenApp/fragmento.html', fragmento)
+
 
 class CultoCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Culto
@@ -264,12 +489,7 @@ class CultoCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     success_url = reverse_lazy('cultos_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = True
-        return context
+        return self.request.es_admin
 
 
 class CultoDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
@@ -278,17 +498,12 @@ class CultoDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('cultos_lista')
 
     def test_func(self):
-        return es_admin(self.request.user)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['es_admin'] = True
-        return context
+        return self.request.es_admin
 
 
 @login_required
 def asignar_participante(request, culto_pk):
-    if not es_admin(request.user):
+    if not request.es_admin:
         return redirect('principal')
 
     culto = get_object_or_404(Culto, pk=culto_pk)
@@ -308,33 +523,94 @@ def asignar_participante(request, culto_pk):
 
         return redirect('detalle_culto', pk=culto.pk)
 
-    context = {'culto': culto, 'hermanos': hermanos, 'roles': roles, 'es_admin': True}
+    context = {'culto': culto, 'hermanos': hermanos, 'roles': roles}
     return render(request, 'lumenApp/asignar_participante.html', context)
 
 
+# Reparte en tramos a todos los hermanos activos con los roles elegidos. "Previsualizar"
+# muestra lo que cambiaría sin escribir nada; "Aplicar" lo guarda de una vez.
+@login_required
+def generar_cortejo(request, culto_pk):
+    if not request.es_admin:
+        return redirect('principal')
+
+    culto = get_object_or_404(Culto.objects.select_related('tipo'), pk=culto_pk)
+    plan = None
+    form = CortejoForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        datos = form.cleaned_data
+        opciones = {
+            'tramo_inicial': datos['tramo_inicial'],
+            'max_tramos': datos['max_tramos'],
+            'antiguos_primero': datos['antiguos_primero'],
+        }
+        if 'aplicar' in request.POST:
+            plan = aplicar_cortejo(culto, datos['roles'], datos['capacidades'], datos['quitar_sobrantes'], **opciones)
+            borrados = len(plan.sobrantes) if datos['quitar_sobrantes'] else 0
+            messages.success(
+                request,
+                f"Cortejo guardado: {len(plan.crear)} nuevos, {len(plan.actualizar)} cambiados de tramo, "
+                f"{plan.sin_cambios} sin cambios y {borrados} quitados."
+            )
+            return redirect('detalle_culto', pk=culto.pk)
+        plan = planificar_cortejo(culto, datos['roles'], datos['capacidades'], **opciones)
+
+    context = {'culto': culto, 'form': form, 'plan': plan}
+    return render(request, 'lumenApp/generar_cortejo.html', context)
+
+
+# Escáner de la puerta: POST con el código leído del QR del carnet. Se contesta
+# en cuanto lo resuelve el mapa en memoria del culto; la asistencia se guarda
+# después en lote (ver asistencia.py). GET devuelve cuántos han entrado.
+@login_required
+@require_http_methods(['GET', 'POST'])
+def registrar_asistencia(request, culto_pk):
+    if not request.es_admin:
+        return JsonResponse({'estado': None}, status=403)
+
+    if request.method == 'GET':
+        resumen = resumen_asistencia(culto_pk)
+        if resumen is None:
+            raise Http404('Culto no encontrado')
+        return JsonResponse(resumen)
+
+    resultado = escanear(culto_pk, request.POST.get('codigo', ''))
+    if resultado is None:
+        raise Http404('Culto no encontrado')
+    estado, datos = resultado
+    respuesta = {'estado': estado, 'mensaje': estado.label}
+    if datos is not None:
+        respuesta.update(hermano=datos[0], nombre=datos[1], tramo=datos[2])
+    return JsonResponse(respuesta)
+
+
 class EstadisticasTemplateView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
     template_name = 'lumenApp/estadisticas.html'
 
     def test_func(self):
-        return es_admin(self.request.user)
+        return self.request.es_admin
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context.update(obtener_estadisticas())
+        return context
 
-        context['total_hermanos'] = Hermano.objects.count()
-        context['hermanos_activos'] = Hermano.objects.filter(estado='Activo').count()
-        context['hermanos_inactivos'] = Hermano.objects.filter(estado='Inactivo').count()
-        context['hermanos_suspendidos'] = Hermano.objects.filter(estado='Suspendido').count()
 
-        cuotas = Cuota.objects.all()
-        context['total_cuotas'] = cuotas.count()
-        context['importe_total'] = cuotas.aggregate(total=Sum('importe'))['total'] or 0
-        context['importe_pagado'] = cuotas.filter(estado_pago='Pagado').aggregate(total=Sum('importe'))['total'] or 0
-        context['importe_pendiente'] = cuotas.filter(estado_pago='Pendiente').aggregate(total=Sum('importe'))['total'] or 0
+# Hermanos con cuotas pendientes, con umbrales de número de cuotas, importe y
+# antigüedad de la deuda (ver morosidad.py).
+class MorosidadTemplateView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = 'lumenApp/morosidad.html'
 
-        context['total_cultos'] = Culto.objects.count()
+    def test_func(self):
+        return self.request.es_admin
 
-        context['es_admin'] = True
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        umbrales = umbrales_morosidad(self.request.GET)
+        context.update(obtener_informe(umbrales))
+        context['umbrales'] = umbrales
+        context['periodos'] = PeriodoCuota.choices
+        context['consulta'] = self.request.GET.urlencode()
         return context
 
 
@@ -347,7 +623,11 @@ class RegistroView(CreateView):
         dni = form.cleaned_data['dni']
         password = form.cleaned_data['password']
 
-        user = User.objects.create_user(username=dni, password=password)
+        if form.hermano_activable:
+            cambiar_contrasena(form.hermano_activable.usuario, password)
+            return redirect(self.success_url)
+
+        user = crear_usuario(dni, password)
 
         hermano = form.save(commit=False)
         hermano.usuario = user
@@ -357,31 +637,40 @@ class RegistroView(CreateView):
 
 @login_required
 def crear_cuota_masiva(request):
-    if not es_admin(request.user):
+    if not request.es_admin:
         return redirect('principal')
 
     if request.method == 'POST':
         form = CuotaMasivaForm(request.POST)
         if form.is_valid():
-            hermanos = form.cleaned_data['hermanos']
-            importe = form.cleaned_data['importe']
-            periodo = form.cleaned_data['periodo']
-            estado_pago = form.cleaned_data['estado_pago']
-            
-            cuotas_creadas = 0
-            for hermano in hermanos:
-                Cuota.objects.create(
-                    hermano=hermano,
-                    importe=importe,
-                    periodo=periodo,
-                    estado_pago=estado_pago
+            try:
+                resumen = emitir_cuotas(
+                    form.cleaned_data['hermanos'],
+                    form.cleaned_data['importe'],
+                    form.cleaned_data['periodo'],
+                    form.cleaned_data['estado_pago'],
+                )
+            except ValidationError as e:
+                form.add_error('importe', e)
+            else:
+                messages.success(
+                    request,
+                    f"Se han creado {resumen['creadas']} cuota(s) correctamente. "
+                    f"Omitidas {resumen['omitidas']} por existir ya en este período."
                 )
-                cuotas_creadas += 1
-            
-            messages.success(request, f'Se han creado {cuotas_creadas} cuota(s) correctamente.')
-            return redirect('fichas_lista')
+                return redirect('fichas_lista')
     else:
         form = CuotaMasivaForm()
 
-    context = {'form': form, 'es_admin': True}
-    return render(request, 'lumenApp/cuota_masiva.html', context)
\ No newline at end of file
+    context = {'form': form}
+    return render(request, 'lumenApp/cuota_masiva.html', context)
+
+# Histogramas de las métricas por petición en formato de texto de Prometheus
+# (ver metricas.py). Para administradores o con LUMEN_METRICAS_TOKEN, que es
+# lo que usa Prometheus al leerlas.
+def metricas(request):
+    token = settings.LUMEN_METRICAS_TOKEN
+    cabecera = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(cabecera, f'Bearer {token}')) and not request.es_admin:
+        return HttpResponse(status=403)
+    return HttpResponse(exportar_metricas(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,157 @@
+from itertools import groupby
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from .consultas import (
+    apagina_keyset, con_participantes, con_total_cuotas, entero, fichas_queryset, filtrar_cultos, participantes_culto,
+)
+from .fragmentos import aclave_fragmento, aguardar_fragmento, aleer_fragmento, crear_fragmento
+from .models import Culto, Cuota, Hermano, Rol, TipoCulto
+from .permisos import aes_admin
+from .views import (
+    CULTOS_POR_PAGINA, EXPORTACIONES_FICHAS, CultoDetailView, contexto_cultos, filas_fichas, parametros_cultos,
+    parametros_fichas,
+)
+
+
+# Versiones async de las vistas de solo lectura más visitadas. Con ASGI se
+# sirven estas (ver LUMEN_VISTAS_ASYNC en urls.py) y mientras esperan a la
+# base de datos el worker sigue atendiendo a otros. Las plantillas y el resto
+# de código síncrono se ejecutan con sync_to_async, nunca en el bucle de eventos.
+
+
+async def _usuario_y_admin(request):
+    user = await request.auser()
+    request.es_admin = await aes_admin(user)
+    return user, request.es_admin
+
+
+async def _render(request, plantilla, context):
+    return await sync_to_async(render)(request, plantilla, context)
+
+
+# Renderiza el contenido, lo guarda en la caché de fragmentos y devuelve la página.
+async def _render_fragmento(request, clave, plantilla, context, titulo, propietario=None):
+    fragmento = await sync_to_async(crear_fragmento)(request, plantilla, context, titulo, propietario)
+    await aguardar_fragmento(clave, fragmento)
+    return await _render(request, 'lumenApp/fragmento.html', fragmento)
+
+
+@login_required
+async def fichas_lista(request):
+    await _usuario_y_admin(request)
+    context = {
+        'roles': [rol async for rol in Rol.objects.all()],
+        'rol_seleccionado': request.GET.get('rol'),
+        'exportaciones': EXPORTACIONES_FICHAS,
+    }
+    return await _render(request, 'lumenApp/fichas_lista.html', context)
+
+
+@login_required
+async def fichas_lista_datos(request):
+    user, admin = await _usuario_y_admin(request)
+    p = parametros_fichas(request)
+
+    total = await fichas_queryset(user, admin, rol_id=p['rol_id']).acount()
+    fichas = fichas_queryset(user, admin, rol_id=p['rol_id'], busqueda=p['busqueda'])
+    filtrados = await fichas.acount() if p['busqueda'] else total
+
+    fichas = con_total_cuotas(fichas)
+    siguiente = None
+    if p['cursor'] is not None:
+        filas, siguiente = await apagina_keyset(fichas, p['campo'], p['descendente'], p['cursor'], p['limite'])
+    else:
+        orden = f"-{p['campo']}" if p['descendente'] else p['campo']
+        filas = [ficha async for ficha in fichas.order_by(orden, 'pk')[p['inicio']:p['inicio'] + p['limite']]]
+
+    return JsonResponse({
+        'draw': entero(request.GET.get('draw')),
+        'recordsTotal': total,
+        'recordsFiltered': filtrados,
+        # Las miniaturas pueden tener que generarse: fuera del bucle de eventos
+        'data': await sync_to_async(filas_fichas)(filas, admin),
+        'siguiente': siguiente,
+    })
+
+
+@login_required
+async def cuota_lista(request, hermano_pk):
+    user, admin = await _usuario_y_admin(request)
+    clave = await aclave_fragmento('cuotas_lista', 'hermano', hermano_pk, admin)
+    fragmento = await aleer_fragmento('cuotas_lista', clave)
+    if fragmento is not None:
+        if not admin and fragmento['propietario'] != user.pk:
+            return redirect('principal')
+        return await _render(request, 'lumenApp/fragmento.html', fragmento)
+
+    hermano = await aget_object_or_404(Hermano.objects.select_related('balance'), pk=hermano_pk)
+    if not admin and hermano.usuario_id != user.pk:
+        return redirect('principal')
+
+    balance = getattr(hermano, 'balance', None)
+    context = {
+        'hermano': hermano,
+        'cuotas': [cuota async for cuota in Cuota.objects.filter(hermano=hermano)],
+        'total_cuotas_pagadas': balance.total_pagado if balance else 0,
+        'total_cuotas_pendientes': balance.total_pendiente if balance else 0,
+    }
+    return await _render_fragmento(
+        request, clave, 'lumenApp/cuotas_lista.html', context, f'Cuotas - {hermano.nombre}', hermano.usuario_id,
+    )
+
+
+@login_required
+async def cultos_lista(request):
+    await _usuario_y_admin(request)
+    p = parametros_cultos(request)
+    cultos = con_participantes(filtrar_cultos(**p['filtros']))
+    filas, siguiente = await apagina_keyset(cultos, 'fecha_inicio', p['descendente'], p['cursor'], CULTOS_POR_PAGINA)
+    context = contexto_cultos(request, filas, siguiente)
+    context['tipos'] = [tipo async for tipo in TipoCulto.objects.all()]
+    return await _render(request, 'lumenApp/cultos_lista.html', context)
+
+
+@login_required
+async def culto_detalle(request, pk):
+    _, admin = await _usuario_y_admin(request)
+    pedida = entero(request.GET.get('page'), 1)
+    clave = await aclave_fragmento('culto_detalle', 'culto', pk, admin, pedida)
+    fragmento = await aleer_fragmento('culto_detalle', clave)
+    if fragmento is not None:
+        return await _render(request, 'lumenApp/fragmento.html', fragmento)
+
+    culto = await aget_object_or_404(Culto.objects.select_related('tipo'), pk=pk)
+    participaciones = participantes_culto(culto)
+
+    # Paginator.get_page() cuenta y trocea de forma síncrona: se cuenta con
+    # acount() y se le pasa el total para que no vuelva a consultar
+    paginador = Paginator(participaciones, CultoDetailView.participantes_por_pagina)
+    paginador.count = await participaciones.acount()
+    try:
+        numero = paginador.validate_number(request.GET.get('page') or 1)
+    except PageNotAnInteger:
+        numero = 1
+    except EmptyPage:
+        numero = paginador.num_pages
+    inicio = (numero - 1) * paginador.per_page
+    filas = [fila async for fila in participaciones[inicio:inicio + paginador.per_page]]
+    pagina = Page(filas, numero, paginador)
+    # Se guarda con la página servida: una fuera de rango no crea otra entrada
+    if numero != pedida:
+        clave = await aclave_fragmento('culto_detalle', 'culto', pk, admin, numero)
+
+    context = {
+        'culto': culto,
+        'object': culto,
+        'pagina': pagina,
+        'tramos': [(tramo, list(grupo)) for tramo, grupo in groupby(filas, key=attrgetter('tramo'))],
+    }
+    return await _render_fragmento(
+        request, clave, 'lumenApp/culto_detalle.html', context, f'Detalle del Culto - {culto.tipo.nombre}',
+    )